@@ -1,6 +1,9 @@
 import streamlit as st
-import json
-from property_pricer import calculate_property_prices
+import os
+from property_pricer import calculate_property_prices, PriceCache, fingerprint_file
+from property_pricer.lookup import load_price_lookup, lookup_property_prices
+from property_pricer.columnar import open_property_data
+from property_pricer.curves import load_quantile_curves
 
 st.set_page_config(
     page_title="Property Pricing App", page_icon="📊", initial_sidebar_state="expanded"
@@ -27,14 +30,59 @@ We also offer two pricing options, to make the numbers as transparent as we can:
 """
 )
 
-@st.cache
-def load_data():
-    with open('data/cleaned_data/clean_property_info.json') as f:
-        data = json.load(f)
-    return data
+# Prefer the memory-mappable columnar artifact when it has been built
+DATA_PATH = (
+    'data/cleaned_data/clean_property_info' 
+    if os.path.isdir('data/cleaned_data/clean_property_info') 
+    else 'data/cleaned_data/clean_property_info.json'
+)
+LOOKUP_PATH = 'data/cleaned_data/price_lookup.json'
+CURVES_PATH = 'data/cleaned_data/quantile_curves.json'
+
+
+def optional_fingerprint(filepath):
+    # Files that have not been precomputed yet fingerprint as None
+    return fingerprint_file(filepath) if os.path.exists(filepath) else None
+
+
+# One read-only, lazily loaded copy shared by every session (only
+# the postcode index is read up front), the fingerprint argument 
+# makes a regenerated data file reload
+@st.experimental_singleton
+def load_data(fingerprint):
+    return open_property_data(DATA_PATH)
+
+
+# One price cache shared by every session, which invalidates
+# itself when the data file changes
+@st.experimental_singleton
+def load_price_cache():
+    return PriceCache(DATA_PATH, cache_dir='data/cleaned_data/price_cache')
 
 
-data = load_data()
+# Precomputed answers from precompute_prices.py (if up to date),
+# reloaded when either the data or the table is regenerated
+@st.experimental_singleton
+def load_lookup(fingerprint, lookup_fingerprint):
+    # Only tables priced with the default options the app uses
+    return load_price_lookup(LOOKUP_PATH, DATA_PATH, options={})
+
+
+# Quantile curves answer any slider position without refitting
+@st.experimental_singleton
+def load_curves(fingerprint, curves_fingerprint):
+    return load_quantile_curves(CURVES_PATH, DATA_PATH)
+
+
+data_fingerprint = fingerprint_file(DATA_PATH)
+data = load_data(data_fingerprint)
+price_cache = load_price_cache()
+price_lookup = load_lookup(data_fingerprint, optional_fingerprint(LOOKUP_PATH))
+quantile_curves = load_curves(data_fingerprint, optional_fingerprint(CURVES_PATH))
+
+# Live fits use the options the curves were built with, so every
+# slider position they cover is read off them
+curve_options = quantile_curves['options'] if quantile_curves is not None else {}
 
 property_types = {
     'Terraced' : 'T',
@@ -58,11 +106,18 @@ with st.form("user_input"):
     
     if submitted:
         try:
-            lower_bound, upper_bound, lower_bound_delta, upper_bound_delta, conf = (
-                calculate_property_prices(
-                    data, postcode,price_type,property_types[property_type], confidence
+            try:
+                prices = lookup_property_prices(
+                    price_lookup or {'prices' : {}}, postcode, price_type,
+                    property_types[property_type], confidence
+                )
+            except KeyError:
+                prices = calculate_property_prices(
+                    data, postcode,price_type,property_types[property_type], confidence,
+                    cache=price_cache, quantile_curves=quantile_curves,
+                    **curve_options
                 )
-            )
+            lower_bound, upper_bound, lower_bound_delta, upper_bound_delta, conf = prices
             
             st.write(f"""
                     ## We Are {100*(1-(2*conf)):.2f}% Confident that {property_type} 
@@ -0,0 +1,264 @@
+import argparse
+import csv
+import os
+import string
+import numpy as np
+import pandas as pd
+from typing import List
+
+# Share of sales by property type, roughly as in the price paid data
+PROPERTY_TYPE_SHARES = {'D' : 0.25, 'S' : 0.28, 'T' : 0.28, 'F' : 0.17, 'O' : 0.02}
+
+# Price premium of each property type over a terraced house
+PROPERTY_TYPE_PREMIUMS = {'D' : 1.6, 'S' : 1.15, 'T' : 1., 'F' : 0.8, 'O' : 1.3}
+
+POSTCODE_AREAS = [
+    'AB', 'AL', 'B', 'BA', 'BB', 'BD', 'BH', 'BL', 'BN', 'BR', 'BS', 'CA',
+    'CB', 'CF', 'CH', 'CM', 'CO', 'CR', 'CT', 'CV', 'CW', 'DA', 'DE', 'DH',
+    'DL', 'DN', 'DT', 'DY', 'E', 'EC', 'EX', 'FY', 'GL', 'GU', 'HA', 'HD',
+    'HG', 'HP', 'HR', 'HU', 'HX', 'IG', 'IP', 'KT', 'L', 'LA', 'LD', 'LE',
+    'LN', 'LS', 'LU', 'M', 'ME', 'MK', 'N', 'NE', 'NG', 'NN', 'NP', 'NR',
+    'NW', 'OL', 'OX', 'PE', 'PL', 'PO', 'PR', 'RG', 'RH', 'RM', 'S', 'SA',
+    'SE', 'SG', 'SK', 'SL', 'SM', 'SN', 'SO', 'SP', 'SR', 'SS', 'ST', 'SW',
+    'SY', 'TA', 'TF', 'TN', 'TQ', 'TR', 'TS', 'TW', 'UB', 'W', 'WA', 'WC',
+    'WD', 'WF', 'WN', 'WR', 'WS', 'WV', 'YO'
+]
+
+
+def generate_postcode_districts(
+    n_postcodes : int, neighbour_density : float, rng : np.random.Generator
+) -> pd.DataFrame:
+    """
+    Generates postcode districts scattered over Great Britain, each
+    with a town, region, location and its nearest districts as
+    neighbours (as in the Postcode districts file).
+
+    Parameters
+    ----------
+    n_postcodes : int
+        The number of postcode districts
+    neighbour_density : float
+        The average number of nearby districts of each district
+    rng : np.random.Generator
+        The random generator
+
+    Returns
+    -------
+    districts : pd.DataFrame
+        The Postcode, Latitude, Longitude, Town/Area, Region and
+        Nearby districts of every district.
+    """
+    postcodes = [
+        f'{POSTCODE_AREAS[i % len(POSTCODE_AREAS)]}{i // len(POSTCODE_AREAS) + 1}'
+        for i in range(n_postcodes)
+    ]
+    latitude = rng.uniform(50.2, 58.5, n_postcodes)
+    longitude = rng.uniform(-5.5, 1.7, n_postcodes)
+
+    # Neighbouring districts share towns (about 5 districts per town)
+    # and regions (about 10 towns per region)
+    order = np.lexsort((longitude, np.round(latitude, 0)))
+    town_ids = np.empty(n_postcodes, dtype=int)
+    town_ids[order] = np.arange(n_postcodes) // 5
+    region_ids = town_ids // 10
+
+    # Nearest districts, with a varying number of neighbours each
+    n_neighbours = np.clip(
+        rng.poisson(neighbour_density, n_postcodes), 0, n_postcodes - 1
+    )
+    coordinates = np.stack([latitude, longitude * np.cos(np.radians(54))], axis=1)
+    nearby = []
+    for i in range(n_postcodes):
+        distances = ((coordinates - coordinates[i])**2).sum(axis=1)
+        nearest = np.argsort(distances)[:n_neighbours[i] + 1]
+        nearby.append(
+            ', '.join(postcodes[x] for x in nearest) if n_neighbours[i] else np.nan
+        )
+
+    return pd.DataFrame({
+        'Postcode' : postcodes,
+        'Latitude' : latitude.round(5),
+        'Longitude' : longitude.round(5),
+        'Town/Area' : [f'Town {x}' for x in town_ids],
+        'Region' : [f'Region {x}' for x in region_ids],
+        'Nearby districts' : nearby
+    })
+
+
+def generate_price_index(
+    start_year : int, end_year : int, rng : np.random.Generator
+) -> pd.DataFrame:
+    """
+    Generates a monthly, seasonally adjusted average house price
+    series: a 4% a year trend with a random walk around it.
+    """
+    months = pd.date_range(f'{start_year}-01-01', f'{end_year}-12-01', freq='MS')
+    years = np.arange(len(months)) / 12
+    walk = np.cumsum(rng.normal(0, 0.004, len(months)))
+    prices = 150000 * np.exp(0.04 * years + walk)
+
+    return pd.DataFrame({
+        'date' : months.strftime('%Y-%m-%d'),
+        'adjusted_avg_price' : prices.round(0)
+    })
+
+
+def generate_sales(
+    districts : pd.DataFrame, price_index : pd.DataFrame, n_rows : int,
+    missing_postcode_rate : float, rng : np.random.Generator
+) -> pd.DataFrame:
+    """
+    Generates property sales in the price paid data layout (every
+    column, in file order), with prices following the district, the
+    property type and the price index.
+    """
+    n_postcodes = len(districts)
+
+    # Busier districts sell more and districts vary in price
+    district_weights = rng.pareto(2., n_postcodes) + 0.1
+    district_ids = rng.choice(
+        n_postcodes, size=n_rows, p=district_weights / district_weights.sum()
+    )
+    district_levels = rng.lognormal(0, 0.35, n_postcodes)
+
+    property_types = rng.choice(
+        list(PROPERTY_TYPE_SHARES), size=n_rows,
+        p=list(PROPERTY_TYPE_SHARES.values())
+    )
+    premiums = pd.Series(PROPERTY_TYPE_PREMIUMS)[property_types].values
+
+    month_ids = rng.integers(0, len(price_index), n_rows)
+    index_prices = price_index.adjusted_avg_price.values[month_ids]
+    sold_price = (
+        index_prices * district_levels[district_ids] * premiums *
+        rng.lognormal(0, 0.3, n_rows)
+    ).round(-2).astype(np.int64)
+
+    months = pd.to_datetime(price_index.date.values[month_ids])
+    sold_date = (
+        months + pd.to_timedelta(rng.integers(0, 28, n_rows), unit='D')
+    ).strftime('%Y-%m-%d 00:00')
+
+    # Full postcodes within the district, e.g. AB1 2CD
+    letters = np.array(list(string.ascii_uppercase))
+    postcode = (
+        districts.Postcode.values[district_ids].astype(object) + ' ' +
+        rng.integers(0, 10, n_rows).astype(str).astype(object) +
+        letters[rng.integers(0, 26, n_rows)].astype(object) +
+        letters[rng.integers(0, 26, n_rows)].astype(object)
+    )
+    postcode[rng.random(n_rows) < missing_postcode_rate] = ''
+
+    # A handful of roads per district, so imputation finds matches
+    road_name = (
+        'ROAD ' + districts.Postcode.values[district_ids].astype(object) + '-' +
+        rng.integers(0, 8, n_rows).astype(str).astype(object)
+    )
+    town = districts['Town/Area'].str.upper().values[district_ids]
+
+    return pd.DataFrame({
+        'transaction_id' : [
+            f'{{{x[:8]}-{x[8:12]}-{x[12:16]}-{x[16:20]}-{x[20:]}}}' 
+            for x in (f'{a:016X}{b:016X}' for a, b in rng.integers(0, 2**63, (n_rows, 2)))
+        ],
+        'sold_price' : sold_price,
+        'sold_date' : sold_date,
+        'postcode' : postcode,
+        'property_type' : property_types,
+        'unknown' : rng.choice(['Y', 'N'], size=n_rows, p=[0.1, 0.9]),
+        'freehold' : np.where(property_types == 'F', 'L', 'F'),
+        'door_number' : rng.integers(1, 200, n_rows).astype(str),
+        'apartment_number' : '',
+        'road_name' : road_name,
+        'area' : '',
+        'city' : town,
+        'town' : town,
+        'region' : districts.Region.str.upper().values[district_ids],
+        'category' : 'A',
+        'record_status' : 'A'
+    })
+
+
+def generate_dataset(
+    output_dir : str, n_rows : int = 100000, n_postcodes : int = 500,
+    neighbour_density : float = 8., missing_postcode_rate : float = 0.01,
+    start_year : int = 2015, end_year : int = 2021, seed : int = 0
+) -> List[str]:
+    """
+    Writes a synthetic, reproducible Land Registry style dataset:
+    yearly pp-<year>.csv price paid files, Postcode districts.csv
+    and Average-price-seasonally-adjusted.csv.
+
+    Parameters
+    ----------
+    output_dir : str
+        The directory the files are written to
+    n_rows : int
+        The total number of property sales
+    n_postcodes : int
+        The number of postcode districts
+    neighbour_density : float
+        The average number of nearby districts of each district
+    missing_postcode_rate : float
+        The fraction of sales without a postcode
+    start_year, end_year : int
+        The years of sales (one pp file per year)
+    seed : int
+        Seeds the generator, the same seed gives identical files.
+
+    Returns
+    -------
+    sales_files : list
+        The paths of the yearly price paid files.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    districts = generate_postcode_districts(n_postcodes, neighbour_density, rng)
+    districts.to_csv(os.path.join(output_dir, 'Postcode districts.csv'), index=False)
+
+    price_index = generate_price_index(start_year, end_year, rng)
+    price_index.to_csv(
+        os.path.join(output_dir, 'Average-price-seasonally-adjusted.csv'),
+        index=False
+    )
+
+    sales = generate_sales(
+        districts, price_index, n_rows, missing_postcode_rate, rng
+    )
+    sales_year = sales.sold_date.str[:4].astype(int).values
+
+    sales_files = []
+    for year in range(start_year, end_year + 1):
+        filepath = os.path.join(output_dir, f'pp-{year}.csv')
+        sales.loc[sales_year == year].to_csv(
+            filepath, header=False, index=False, quoting=csv.QUOTE_ALL
+        )
+        sales_files.append(filepath)
+
+    return sales_files
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic Land Registry style dataset'
+    )
+    parser.add_argument('--output_dir', type=str, default='data/synthetic')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--postcodes', type=int, default=500)
+    parser.add_argument('--neighbour_density', type=float, default=8.)
+    parser.add_argument('--missing_postcode_rate', type=float, default=0.01)
+    parser.add_argument('--start_year', type=int, default=2015)
+    parser.add_argument('--end_year', type=int, default=2021)
+    parser.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    sales_files = generate_dataset(
+        args.output_dir, n_rows=args.rows, n_postcodes=args.postcodes,
+        neighbour_density=args.neighbour_density,
+        missing_postcode_rate=args.missing_postcode_rate,
+        start_year=args.start_year, end_year=args.end_year, seed=args.seed
+    )
+    print(f'Wrote {len(sales_files)} price paid files to {args.output_dir}')
@@ -0,0 +1,256 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import sklearn
+from typing import Callable
+from benchmarks.generate_data import generate_dataset
+from property_pricer import (
+    ingest_join_properties, ingest_price_adjustments, impute_postcodes,
+    append_time_information, calculate_adjustment_ratio,
+    apply_sold_price_adjustments, convert_property_info_to_json, save_json,
+    get_optimal_kde, calculate_critical_value, calculate_property_prices
+)
+from property_pricer.determine_price import min_max_normalize
+
+# Dataset sizes, any of which can be overridden from the command line
+SCALES = {
+    'small' : {'n_rows' : 20000, 'n_postcodes' : 200},
+    'medium' : {'n_rows' : 200000, 'n_postcodes' : 1000},
+    'large' : {'n_rows' : 2000000, 'n_postcodes' : 3000}
+}
+
+
+def measure(
+    func : Callable, setup : Callable = None, repeats : int = 3
+) -> dict:
+    """
+    Times func over several runs and records its peak Python memory
+    allocation (with tracemalloc, on one extra run so it does not
+    slow down the timed runs).
+
+    Parameters
+    ----------
+    func : Callable
+        The benchmarked stage, called with the arguments from setup
+    setup : Callable
+        Returns fresh (untimed) arguments for every run, for stages
+        that modify their inputs
+    repeats : int
+        The number of timed runs
+
+    Returns
+    -------
+    result : dict
+        The run times, their best and mean, and the peak memory.
+    """
+    setup = setup or (lambda: ())
+
+    seconds = []
+    for _ in range(repeats):
+        args = setup()
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        seconds.append(time.perf_counter() - start)
+
+    args = setup()
+    gc.collect()
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'seconds' : seconds,
+        'best_seconds' : min(seconds),
+        'mean_seconds' : float(np.mean(seconds)),
+        'peak_memory_bytes' : peak
+    }
+
+
+def run_benchmarks(data_dir : str, repeats : int = 3, n_queries : int = 5) -> dict:
+    """
+    Benchmarks every stage of the pipeline on the dataset in
+    data_dir (see generate_data.generate_dataset), feeding the
+    output of each stage into the next.
+
+    Returns
+    -------
+    results : dict
+        The measure results of every stage, keyed by stage name.
+    """
+    results = {}
+
+    def run(name, func, setup=None):
+        print(f'Benchmarking {name}')
+        results[name] = measure(func, setup, repeats)
+        print(
+            f"    best {results[name]['best_seconds']:.4f}s, peak "
+            f"{results[name]['peak_memory_bytes'] / 2**20:.1f}MiB"
+        )
+
+    sales_files = sorted(
+        os.path.join(data_dir, x) for x in os.listdir(data_dir)
+        if x.startswith('pp-')
+    )
+    postcodes = pd.read_csv(os.path.join(data_dir, 'Postcode districts.csv'))
+    price_adjs = ingest_price_adjustments(
+        os.path.join(data_dir, 'Average-price-seasonally-adjusted.csv')
+    )
+
+    # Preprocessing stages, in pipeline order
+    run('ingest_join_properties', lambda: ingest_join_properties(sales_files))
+    all_df = ingest_join_properties(sales_files)
+
+    run('impute_postcodes', impute_postcodes, lambda: (all_df.copy(),))
+    all_df = impute_postcodes(all_df)
+
+    run('append_time_information', append_time_information, lambda: (all_df.copy(),))
+    all_df = append_time_information(all_df)
+
+    price_adjs = calculate_adjustment_ratio(price_adjs, all_df)
+    run(
+        'apply_sold_price_adjustments',
+        lambda: apply_sold_price_adjustments(price_adjs, all_df)
+    )
+    df_adjusted = apply_sold_price_adjustments(price_adjs, all_df)
+
+    run(
+        'convert_property_info_to_json',
+        lambda: convert_property_info_to_json(postcodes, df_adjusted)
+    )
+    property_info = convert_property_info_to_json(postcodes, df_adjusted)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run(
+            'save_json',
+            lambda: save_json(os.path.join(tmp_dir, 'property_info.json'), property_info)
+        )
+
+    # Modelling stages, on the busiest terraced house sales
+    busiest = max(property_info, key=lambda x: len(property_info[x]['T']['adjusted']))
+    prices = np.asarray(property_info[busiest]['T']['adjusted'], dtype=float)
+    prices_normalised, _, _ = min_max_normalize(prices[:1000])
+
+    run('get_optimal_kde', lambda: get_optimal_kde(prices_normalised))
+    optimal_kde = get_optimal_kde(prices_normalised)
+
+    run('calculate_critical_value', lambda: calculate_critical_value(optimal_kde, 0.025))
+
+    # End to end pricing of a fixed set of postcodes
+    rng = np.random.default_rng(0)
+    queries = rng.choice(list(property_info), size=n_queries, replace=False)
+
+    def price_queries():
+        for postcode in queries:
+            calculate_property_prices(
+                property_info, postcode, 'adjusted', 'T', 0.95, random_state=0
+            )
+
+    run('calculate_property_prices', price_queries)
+    results['calculate_property_prices']['n_queries'] = n_queries
+
+    return results
+
+
+def compare_results(baseline : dict, current : dict, tolerance : float = 0.2) -> list:
+    """
+    Compares two benchmark result files, flagging every stage whose
+    best time or peak memory grew by more than tolerance.
+
+    Returns
+    -------
+    regressions : list
+        A description of every regression found.
+    """
+    # How a growth of each metric is described
+    regression_words = {'best_seconds' : 'slower', 'peak_memory_bytes' : 'larger'}
+
+    regressions = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        for metric, word in regression_words.items():
+            before, after = baseline['results'][name][metric], result[metric]
+            ratio = after / before if before else 1.
+            print(f'{name} {metric}: {before:.4g} -> {after:.4g} ({ratio:.2f}x)')
+            if ratio > 1 + tolerance:
+                regressions.append(f'{name} {metric} {ratio:.2f}x {word}')
+
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the pipeline on a synthetic dataset'
+    )
+    parser.add_argument('--scale', type=str, default='small', choices=list(SCALES))
+    parser.add_argument('--rows', type=int, default=None)
+    parser.add_argument('--postcodes', type=int, default=None)
+    parser.add_argument('--neighbour_density', type=float, default=8.)
+    parser.add_argument('--missing_postcode_rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=5)
+    parser.add_argument(
+        '--data_dir', type=str, default=None,
+        help='Reuse (or keep) the generated dataset in this directory'
+    )
+    parser.add_argument('--output', type=str, default='benchmark_results.json')
+    parser.add_argument(
+        '--compare', type=str, default=None,
+        help='Previous results file to check for regressions'
+    )
+    parser.add_argument('--tolerance', type=float, default=0.2)
+
+    args = parser.parse_args()
+
+    config = dict(
+        SCALES[args.scale], neighbour_density=args.neighbour_density,
+        missing_postcode_rate=args.missing_postcode_rate, seed=args.seed
+    )
+    if args.rows is not None:
+        config['n_rows'] = args.rows
+    if args.postcodes is not None:
+        config['n_postcodes'] = args.postcodes
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        if not os.path.isdir(data_dir) or not os.listdir(data_dir):
+            print(f'Generating synthetic data in {data_dir}')
+            generate_dataset(data_dir, **config)
+
+        results = {
+            'created' : datetime.datetime.now().isoformat(timespec='seconds'),
+            'config' : dict(config, scale=args.scale, repeats=args.repeats),
+            'environment' : {
+                'python' : sys.version.split()[0],
+                'platform' : platform.platform(),
+                'cpu_count' : os.cpu_count(),
+                'numpy' : np.__version__,
+                'pandas' : pd.__version__,
+                'sklearn' : sklearn.__version__
+            },
+            'results' : run_benchmarks(data_dir, args.repeats, args.queries)
+        }
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=4)
+    print(f'Wrote results to {args.output}')
+
+    if args.compare is not None:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare_results(json.load(f), results, args.tolerance)
+        if regressions:
+            print('Regressions found:\n    ' + '\n    '.join(regressions))
+            raise SystemExit(1)
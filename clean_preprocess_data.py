@@ -1,8 +1,247 @@
 import pandas as pd
+import os
+import glob
+import argparse
+import tempfile
+import logging
+from property_pricer import (
+    ingest_join_properties, ingest_price_adjustments, impute_postcodes,
+    append_time_information, calculate_adjustment_ratio, 
+    apply_sold_price_adjustments, convert_property_info_to_json,
+    iter_property_info, save_json
+)
+from property_pricer.columnar import (
+    save_columnar, rebase_columnar, load_property_data
+)
+from property_pricer.lookup import precompute_quantile_curves
+from property_pricer.sketch import build_sketches, save_sketches
+from property_pricer.pipeline import preprocess_sharded
+from property_pricer.utils import JSON_COMPRESSION_SUFFIXES
+from property_pricer.incremental import (
+    get_preprocessing_state, save_preprocessing_state,
+    load_preprocessing_state, update_property_info, record_applied_files,
+    unapplied_files, state_price_adjustments
+)
+
+
+IMPUTED_PATH = 'data/cleaned_data/joined_imputed_data.csv'
+JSON_PATH = 'data/cleaned_data/clean_property_info.json'
+COLUMNAR_PATH = 'data/cleaned_data/clean_property_info'
+STATE_PATH = 'data/cleaned_data/preprocessing_state.json'
+CURVES_PATH = 'data/cleaned_data/quantile_curves.json'
+SKETCH_PATH = 'data/cleaned_data/price_sketches.npz'
+
+
+def get_json_path(compression=None):
+    # Compressed outputs are marked by their extension
+    suffixes = {name : suffix for suffix, name in JSON_COMPRESSION_SUFFIXES.items()}
+    return JSON_PATH + suffixes.get(compression, '')
+
+
+def save_outputs(
+    property_info_json, output_format, sketches=False, compression=None,
+    rebase_scale=None, price_adjustments=None
+):
+    data_paths = []
+    if output_format in {'json', 'both'}:
+        save_json(get_json_path(compression), property_info_json)
+        data_paths.append(get_json_path(compression))
+    
+    # Binary columnar artifact that workers can memory-map
+    if output_format in {'columnar', 'both'}:
+        # When only the reference price moved, a compact artifact is
+        # re-based by swapping its ratios rather than rewritten
+        rebased = False
+        if rebase_scale is not None:
+            try:
+                rebase_columnar(COLUMNAR_PATH, rebase_scale)
+                rebased = True
+            except (OSError, ValueError):
+                # Missing, or in the full layout
+                pass
+        if not rebased:
+            save_columnar(
+                COLUMNAR_PATH, property_info_json,
+                price_adjustments=price_adjustments
+            )
+        data_paths.append(COLUMNAR_PATH)
+    
+    # Quantile sketches for approximate pricing, tied to the data
+    # written alongside them
+    if sketches:
+        save_sketches(
+            SKETCH_PATH, build_sketches(property_info_json), data_paths
+        )
+
+
+def save_property_info(
+    property_info, output_format, sketches=False, compression=None,
+    price_adjustments=None
+):
+    # Convert to JSON format for consumption in the web app, streamed
+    # to disk one postcode at a time when nothing else needs the dict
+    if output_format == 'json' and not sketches:
+        save_json(get_json_path(compression), property_info)
+    else:
+        save_outputs(
+            dict(property_info), output_format, sketches, compression,
+            price_adjustments=price_adjustments
+        )
+
+
+def save_quantile_curves(output_format, compression=None):
+    # Quantile curves let any confidence level be priced without 
+    # refitting, built from whichever artifact was just written
+    data_path = (
+        COLUMNAR_PATH if output_format != 'json' else get_json_path(compression)
+    )
+    precompute_quantile_curves(data_path, CURVES_PATH)
+
+
+def run_incremental_update(
+    new_files, output_format, quantile_curves=False, sketches=False,
+    compression=None
+):
+    """
+    Adds the sales in new yearly/monthly pp files to the existing 
+    outputs, without re-reading or re-imputing the history. Files
+    already applied (by an earlier update or a sharded run) are
+    skipped, so their sales are never added twice.
+    """
+    previous_state = load_preprocessing_state(STATE_PATH)
+    unapplied = unapplied_files(previous_state, new_files)
+    skipped = [x for x in new_files if x not in unapplied]
+    new_files = unapplied
+    if skipped:
+        logging.info('Skipping files that were already applied: %s', skipped)
+    if not new_files:
+        return
+
+    new_sales = ingest_join_properties(new_files)
+
+    # Only the fields used to match missing postcodes are read back
+    history = pd.read_csv(
+        IMPUTED_PATH, usecols=['road_name', 'town', 'city', 'region', 'postcode']
+    )
+
+    # Start from whichever artifact the previous run wrote, preferring
+    # the one this run writes
+    data_paths = [get_json_path(compression), COLUMNAR_PATH]
+    if output_format == 'columnar':
+        data_paths.reverse()
+    data_path = next(
+        (x for x in data_paths if os.path.exists(x)), data_paths[0]
+    )
+    property_info_json = dict(load_property_data(data_path))
+
+    price_adjs = ingest_price_adjustments(
+        'data/raw_data/Average-price-seasonally-adjusted.csv'
+    )
+
+    property_info_json, state, new_sales_imputed, affected = (
+        update_property_info(
+            property_info_json, previous_state, new_sales, history, price_adjs
+        )
+    )
+    logging.info(
+        'Added %d sales to %d postcodes', len(new_sales_imputed), len(affected)
+    )
+
+    # Without new samples in any postcode, the adjusted prices were
+    # only re-referenced
+    rebase_scale = (
+        state['reference_price'] / previous_state['reference_price']
+        if not affected else None
+    )
+
+    # Append (rather than rewrite) the imputed history
+    new_sales_imputed.to_csv(IMPUTED_PATH, mode='a', header=False)
+    save_outputs(
+        property_info_json, output_format, sketches, compression, rebase_scale,
+        state_price_adjustments(price_adjs, state)
+    )
+    save_preprocessing_state(
+        STATE_PATH, record_applied_files(
+            {**state, 'applied_files' : previous_state.get('applied_files', {})},
+            new_files
+        )
+    )
+    if quantile_curves:
+        save_quantile_curves(output_format, compression)
 
 
 if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--output_format', type=str, default='json', 
+        choices=['json', 'columnar', 'both'],
+        help='json, a memory-mappable columnar artifact, or both'
+    )
+    parser.add_argument(
+        '--incremental', type=str, nargs='+', default=None,
+        help='New pp files to add to the existing outputs'
+    )
+    parser.add_argument(
+        '--quantile_curves', action='store_true',
+        help='Also precompute quantile curves for every postcode'
+    )
+    parser.add_argument(
+        '--sketches', action='store_true',
+        help='Also build quantile sketches for approximate pricing'
+    )
+    parser.add_argument(
+        '--compression', type=str, default=None, choices=['gzip', 'zstd'],
+        help='Compress the json output (zstd needs the zstandard package)'
+    )
+    parser.add_argument(
+        '--shards', type=int, default=None,
+        help='Preprocess the raw pp files (imputing postcodes) in this many '
+        'partitions by postcode group, across worker processes'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='Worker processes for --shards (defaults to one per CPU)'
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    
+    if args.incremental is not None:
+        run_incremental_update(
+            args.incremental, args.output_format, 
+            args.quantile_curves, args.sketches, args.compression
+        )
+        raise SystemExit(0)
     
+    # Load in postcode info
+    postcodes = pd.read_csv('data/raw_data/Postcode districts.csv')
+
+    # Load in historical price index adjustments
+    price_adjs = ingest_price_adjustments(
+        'data/raw_data/Average-price-seasonally-adjusted.csv'
+    )
+
+    if args.shards is not None:
+        # Imputes every pp file from scratch with bounded memory per
+        # process, also rewriting the imputed history
+        sales_files = sorted(glob.glob('data/raw_data/pp-*.csv'))
+        with tempfile.TemporaryDirectory(dir='data/cleaned_data') as work_dir:
+            property_info, state = preprocess_sharded(
+                sales_files, postcodes,
+                price_adjs, work_dir, n_shards=args.shards, 
+                n_workers=args.workers, imputed_path=IMPUTED_PATH
+            )
+            save_property_info(
+                property_info, args.output_format, args.sketches, 
+                args.compression, state_price_adjustments(price_adjs, state)
+            )
+        save_preprocessing_state(
+            STATE_PATH, record_applied_files(state, sales_files)
+        )
+        if args.quantile_curves:
+            save_quantile_curves(args.output_format, args.compression)
+        raise SystemExit(0)
+
     ## If postcodes need imputing 
     # all_df = (
     #     ingest_join_properties(
@@ -11,23 +250,16 @@ if __name__ == "__main__":
     #     )
     # )
     # all_df = impute_postcodes(all_df) # WARNING - very very slow
-    # all_df.to_csv('data/cleaned_data/joined_imputed_data.csv')
+    # all_df.to_csv(IMPUTED_PATH)
 
 
     # If postcodes have been imputed before, start from here
-    all_df = pd.read_csv('data/cleaned_data/joined_imputed_data.csv',index_col=0)
+    all_df = pd.read_csv(IMPUTED_PATH,index_col=0)
     all_df = append_time_information(all_df)
 
-    # Load in postcode info
-    postcodes = pd.read_csv('data/raw_data/Postcode districts.csv')
-
-    # Load in historical price index adjustments
-    price_adjs = ingest_price_adjustments(
-        'data/raw_data/Average-price-seasonally-adjusted.csv'
-    )
-
     # Calculate adjusted price
     price_adjs = calculate_adjustment_ratio(price_adjs, all_df)
+    state = get_preprocessing_state(price_adjs, all_df)
 
     # Free up memory
     df = all_df[[
@@ -44,9 +276,13 @@ if __name__ == "__main__":
         )
     )
 
-    # Convert to JSON format for consumption in the web app
-    property_info_json = convert_property_info_to_json(postcodes, df_adjusted)
-    save_json(
-        'data/cleaned_data/clean_property_info_test.json', 
-        property_info_json
-    )
\ No newline at end of file
+    save_property_info(
+        iter_property_info(postcodes, df_adjusted), args.output_format,
+        args.sketches, args.compression, price_adjs
+    )
+
+    # Reference point for later incremental updates
+    save_preprocessing_state(STATE_PATH, state)
+
+    if args.quantile_curves:
+        save_quantile_curves(args.output_format, args.compression)
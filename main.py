@@ -1,19 +1,40 @@
 import pandas as pd
 import os
 import json
-from property_pricer import calculate_property_prices
+import logging
+from property_pricer import calculate_property_prices, PriceCache
+from property_pricer.instrumentation import trace_request
+from property_pricer.lookup import load_price_lookup, lookup_property_prices
+from property_pricer.columnar import open_property_data
+from property_pricer.curves import load_quantile_curves
+from property_pricer.sketch import load_sketches
 import argparse
 
 
-if __name__ == "__main__":
-    
-    with open('data/cleaned_data/clean_property_info.json') as f:
-        d = json.load(f)
+# Prefer the memory-mappable columnar artifact when it has been built
+DATA_PATH = (
+    'data/cleaned_data/clean_property_info' 
+    if os.path.isdir('data/cleaned_data/clean_property_info') 
+    else 'data/cleaned_data/clean_property_info.json'
+)
+CACHE_DIR = 'data/cleaned_data/price_cache'
+LOOKUP_PATH = 'data/cleaned_data/price_lookup.json'
+CURVES_PATH = 'data/cleaned_data/quantile_curves.json'
+SKETCH_PATH = 'data/cleaned_data/price_sketches.npz'
 
 
-    lower_bound, upper_bound, lower_bound_delta, upper_bound_delta, conf = calculate_property_prices(data, postcode,price_type,property_type, confidence)
+def positive(type_):
+    # argparse type that only accepts values above zero
+    def parse(value):
+        value = type_(value)
+        if value <= 0:
+            raise argparse.ArgumentTypeError(f'must be positive, got {value}')
+        return value
+    return parse
 
 
+if __name__ == "__main__":
+
     # Create the parser
     parser = argparse.ArgumentParser()
     # Add an argument
@@ -21,15 +42,110 @@ if __name__ == "__main__":
     parser.add_argument('--price_type', type=str, required=True)
     parser.add_argument('--property_type', type=str, required=True)
     parser.add_argument('--confidence', type=float, required=True)
+    parser.add_argument('--bandwidth_method', type=str, default='grid_search')
+    parser.add_argument(
+        '--bootstrap_engine', type=str, default='replicas',
+        choices=['replicas', 'vectorised'],
+        help='Fit a KDE per bootstrap replica, or all replicas at once'
+    )
+    parser.add_argument(
+        '--approximate', action='store_true',
+        help='Answer from the quantile sketches instead of the KDE'
+    )
+    parser.add_argument(
+        '--window_months', type=positive(int), default=None,
+        help='Only price from sales in this many months up to --as_of'
+    )
+    parser.add_argument(
+        '--recency_half_life', type=positive(float), default=None,
+        help='Weight sales by recency, halving every this many months'
+    )
+    parser.add_argument(
+        '--as_of', type=str, default=None,
+        help='Month (YYYY-MM) the window ends at, defaults to the latest sale'
+    )
+    parser.add_argument(
+        '--upsampling', type=str, default='neighbours', 
+        choices=['neighbours', 'nearest'],
+        help='Upsample through neighbouring districts or the nearest districts'
+    )
+    parser.add_argument(
+        '--trace', action='store_true',
+        help='Print where the time of the query went'
+    )
     
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    query_options = dict(
+        window_months=args.window_months, 
+        recency_half_life=args.recency_half_life, as_of=args.as_of,
+        upsampling=args.upsampling, bootstrap_engine=args.bootstrap_engine
+    )
+
+    def price_query():
+        # Prefer the precomputed lookup table from precompute_prices.py
+        # if it was priced with the same options (over the whole history)
+        lookup = load_price_lookup(LOOKUP_PATH, DATA_PATH, options=dict(
+            bandwidth_method=args.bandwidth_method, upsampling=args.upsampling,
+            bootstrap_engine=args.bootstrap_engine
+        ))
+        if (
+            lookup is not None and not args.approximate 
+            and args.window_months is None and args.recency_half_life is None
+        ):
+            try:
+                return lookup_property_prices(
+                    lookup, args.postcode, args.price_type, 
+                    args.property_type, args.confidence
+                )
+            except KeyError:
+                pass
+
+        # Sketches built from older data are never used
+        sketches = None
+        if args.approximate:
+            sketches = load_sketches(SKETCH_PATH, DATA_PATH)
+            if sketches is None:
+                raise SystemExit(
+                    'No sketches of the current data, rerun '
+                    'clean_preprocess_data.py with --sketches'
+                )
 
-    lower_bound, upper_bound, lower_bound_delta, upper_bound_delta, conf = (
-        calculate_property_prices(
+        # Only the postcode index and the samples this query
+        # touches are read (a json file is converted once)
+        data = open_property_data(DATA_PATH)
+        return calculate_property_prices(
             data, args.postcode,args.price_type,
-            args.property_type, args.confidence
+            args.property_type, args.confidence,
+            bandwidth_method=args.bandwidth_method,
+            quantile_curves=load_quantile_curves(CURVES_PATH, DATA_PATH),
+            sketches=sketches,
+            **query_options
         )
+
+    # Persistent cache of previous answers, invalidated whenever
+    # the data file is regenerated, so repeat queries skip loading
+    # the data entirely
+    cache = PriceCache(DATA_PATH, cache_dir=CACHE_DIR)
+    key = cache.make_key(
+        args.postcode, args.price_type, args.property_type, 
+        args.confidence, bandwidth_method=args.bandwidth_method,
+        approximate=args.approximate, **query_options
     )
+    with trace_request(args.postcode) as trace:
+        prices = cache.get_or_compute(key, price_query)
+
+    if prices is None:
+        window = (
+            f' in the {args.window_months} months to {args.as_of or "the latest sale"}'
+            if args.window_months is not None else ''
+        )
+        raise SystemExit(
+            f'Not enough sales{window} in {args.postcode} or its neighbours '
+            'to price it, try a wider window or another postcode'
+        )
+    lower_bound, upper_bound, lower_bound_delta, upper_bound_delta, conf = prices
     
     property_types = {
         'T' : 'Terraced',
@@ -40,8 +156,11 @@ if __name__ == "__main__":
     }
 
     print(f"""
-    We Are {100*(1-(conf/2)):.2f}% Confident that {property_types[property_type]} 
-    Properties in {postcode} have an {price_type} Price Starting From 
+    We Are {100*(1-(conf*2)):.2f}% Confident that {property_types[args.property_type]} 
+    Properties in {args.postcode} have an {args.price_type} Price Starting From 
     [£{lower_bound - lower_bound_delta} - £{lower_bound + lower_bound_delta}] ranging up 
     to [£{upper_bound - upper_bound_delta} - £{upper_bound + upper_bound_delta}]
     """)
+
+    if args.trace:
+        print(json.dumps(trace.breakdown(), indent=4))
@@ -0,0 +1,44 @@
+from property_pricer.lookup import precompute_property_prices
+import argparse
+import logging
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Precompute prices for every postcode, property type and price type'
+    )
+    parser.add_argument(
+        '--data', type=str, 
+        default='data/cleaned_data/clean_property_info.json'
+    )
+    parser.add_argument(
+        '--output', type=str, 
+        default='data/cleaned_data/price_lookup.json'
+    )
+    parser.add_argument(
+        '--checkpoint', type=str, 
+        default='data/cleaned_data/price_lookup_checkpoint.jsonl'
+    )
+    parser.add_argument(
+        '--confidences', type=float, nargs='+', default=[0.9, 0.95, 0.99]
+    )
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--bandwidth_method', type=str, default='grid_search')
+    parser.add_argument('--random_state', type=int, default=None)
+    
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    lookup = precompute_property_prices(
+        args.data, args.output, 
+        confidences=args.confidences,
+        checkpoint_path=args.checkpoint,
+        n_workers=args.workers,
+        bandwidth_method=args.bandwidth_method,
+        random_state=args.random_state
+    )
+    print(
+        f"Wrote {len(lookup['prices'])} prices to {args.output} "
+        f"({len(lookup['errors'])} queries failed)"
+    )
@@ -4,9 +4,15 @@ from property_pricer.preprocessing import (
     append_time_information, apply_sold_price_adjustments
 )
 from property_pricer.model import (
-    get_optimal_kde, calculate_critical_value
+    get_optimal_kde, select_bandwidth, select_bandwidths,
+    batch_kde_critical_values, weight_bandwidths,
+    calculate_critical_value, calculate_critical_values
 )
-from property_pricer.transform import convert_property_info_to_json
-from property_pricer.utils import save_json
+from property_pricer.transform import convert_property_info_to_json, iter_property_info
+from property_pricer.utils import save_json, load_json
+from property_pricer.cache import PriceCache, fingerprint_file
+from property_pricer.instrumentation import TraceRecorder, trace_request
 
-from property_pricer.determine_price import calculate_property_prices
\ No newline at end of file
+from property_pricer.determine_price import (
+    calculate_property_prices, calculate_property_prices_batch
+)
\ No newline at end of file
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+
+def fingerprint_file(filepath : str) -> str:
+    """
+    Computes a cheap fingerprint of a data artifact from its path,
+    size and modification time, so that any rewrite of the file
+    (e.g. by clean_preprocess_data.py) changes the fingerprint.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the data artifact (a file, or a directory whose 
+        files are fingerprinted together)
+
+    Returns
+    -------
+    fingerprint : str
+        Hex digest identifying the current version of the file.
+    """
+    if os.path.isdir(filepath):
+        filepaths = [
+            os.path.join(filepath, x) for x in sorted(os.listdir(filepath))
+        ]
+    else:
+        filepaths = [filepath]
+
+    identity = ''
+    for path in filepaths:
+        stat = os.stat(path)
+        identity += f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns};'
+
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+def data_fingerprints(data_path : str) -> set:
+    """
+    Returns the fingerprints that identify the current version of
+    the data at data_path: its own, plus that of the JSON file a
+    columnar artifact was converted from (see convert_to_columnar),
+    so outputs fingerprinted against either match.
+    """
+    fingerprints = {fingerprint_file(data_path)}
+    metadata_path = os.path.join(data_path, 'metadata.json')
+    if os.path.isdir(data_path) and os.path.exists(metadata_path):
+        with open(metadata_path, encoding='utf-8') as f:
+            source_fingerprint = json.load(f).get('source_fingerprint')
+        if source_fingerprint is not None:
+            fingerprints.add(source_fingerprint)
+    return fingerprints
+
+
+class PriceCache:
+    """
+    Two tier cache of property price estimates. Results are held in
+    a bounded in-memory LRU and, optionally, persisted to a directory
+    so they survive restarts. Entries are scoped to a fingerprint of
+    the data artifact and are dropped automatically once the
+    artifact changes. On disk every artifact has its own directory,
+    so caches of different artifacts can share a cache_dir. None
+    results (too few samples) are only held in memory.
+
+    Parameters
+    ----------
+    artifact_path : str
+        Path to the data artifact the cached prices were computed
+        from (or None if the data does not come from a file).
+    max_entries : int
+        The maximum number of results held in memory.
+    cache_dir : str
+        Optional directory for the persistent on-disk tier.
+    """
+    def __init__(
+        self, artifact_path : str = None,
+        max_entries : int = 1024, cache_dir : str = None
+    ):
+        self.artifact_path = artifact_path
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._artifact_dir = None
+        if cache_dir is not None:
+            artifact = (
+                os.path.abspath(artifact_path) if artifact_path is not None
+                else 'static'
+            )
+            self._artifact_dir = os.path.join(
+                cache_dir, hashlib.sha1(artifact.encode('utf-8')).hexdigest()[:16]
+            )
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._stats = {
+            'memory_hits' : 0, 'disk_hits' : 0, 'misses' : 0,
+            'evictions' : 0, 'invalidations' : 0
+        }
+        self._check_fingerprint()
+
+    @staticmethod
+    def make_key(
+        postcode : str, pricing_type : str, property_type : str,
+        confidence : float, **options
+    ) -> str:
+        """
+        Builds the cache key for a pricing query. Any option that
+        changes the estimate (bandwidth method, bootstrap engine,
+        random state, ...) must be passed as a keyword argument.
+        """
+        options = {
+            name : getattr(value, '__qualname__', value)
+            for name, value in options.items()
+        }
+        return json.dumps(
+            [postcode, pricing_type, property_type, float(confidence), options],
+            sort_keys=True, default=str
+        )
+
+    def _check_fingerprint(self) -> str:
+        """
+        Re-fingerprints the artifact, clearing every entry computed
+        from a previous version of it.
+        """
+        fingerprint = (
+            fingerprint_file(self.artifact_path)
+            if self.artifact_path is not None else 'static'
+        )
+        if fingerprint != self._fingerprint:
+            if self._fingerprint is not None:
+                self._stats['invalidations'] += 1
+            self._entries.clear()
+            self._fingerprint = fingerprint
+            self._prune_disk()
+
+        return fingerprint
+
+    def _prune_disk(self) -> None:
+        """
+        Removes on-disk entries belonging to stale versions of this
+        cache's artifact (never those of other artifacts).
+        """
+        if self._artifact_dir is None or not os.path.isdir(self._artifact_dir):
+            return
+
+        for name in os.listdir(self._artifact_dir):
+            path = os.path.join(self._artifact_dir, name)
+            if name != self._fingerprint and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _disk_path(self, key : str) -> str:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self._artifact_dir, self._fingerprint, digest + '.json')
+
+    def get(self, key : str) -> Tuple[bool, object]:
+        """
+        Looks a key up in memory, then on disk.
+
+        Returns
+        -------
+        hit : bool
+            Whether the key was found.
+        result : object
+            The cached result (None on a miss).
+        """
+        with self._lock:
+            self._check_fingerprint()
+
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return True, self._entries[key]
+
+            if self.cache_dir is not None:
+                path = self._disk_path(key)
+                if os.path.exists(path):
+                    with open(path, encoding='utf-8') as f:
+                        entry = json.load(f)
+                    result = entry['result']
+                    if isinstance(result, list):
+                        result = tuple(result)
+                    self._stats['disk_hits'] += 1
+                    self._remember(key, result)
+                    return True, result
+
+            self._stats['misses'] += 1
+            return False, None
+
+    def put(self, key : str, result : object) -> None:
+        """
+        Stores a result in memory and, if enabled and the result is
+        not None, on disk.
+        """
+        with self._lock:
+            self._check_fingerprint()
+            self._remember(key, result)
+
+            if self.cache_dir is not None and result is not None:
+                path = self._disk_path(key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                # Write then rename so readers never see partial files
+                tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'key' : key, 'result' : result}, f)
+                os.replace(tmp_path, path)
+
+    def _remember(self, key : str, result : object) -> None:
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def get_or_compute(self, key : str, compute : Callable) -> object:
+        """
+        Returns the cached result for key, calling compute() and
+        caching its result on a miss.
+        """
+        hit, result = self.get(key)
+        if not hit:
+            result = compute()
+            self.put(key, result)
+        return result
+
+    def clear(self) -> None:
+        """
+        Drops every in-memory and on-disk entry of this cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            if self._artifact_dir is not None:
+                shutil.rmtree(self._artifact_dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss statistics of the cache.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.
+            stats['size'] = len(self._entries)
+            return stats
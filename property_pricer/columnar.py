@@ -0,0 +1,473 @@
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from collections import OrderedDict
+from collections.abc import Mapping
+from property_pricer.cache import fingerprint_file
+from property_pricer.utils import load_json, strip_compression_suffix
+from property_pricer.neighbours import NeighbourIndex, PROPERTY_TYPES, PRICE_TYPES
+
+COLUMNAR_FORMAT_VERSION = 2
+
+# Largest sold price and number of months the compact layout can hold
+_MAX_COMPACT_PRICE = np.iinfo(np.int32).max
+_MAX_COMPACT_MONTHS = np.iinfo(np.uint16).max + 1
+
+
+def _adjustment_ratios(
+    unadjusted : np.ndarray, adjusted : np.ndarray, month_ids : np.ndarray,
+    first_month : int, price_adjustments = None
+) -> np.ndarray:
+    """
+    Builds the adjustment ratio of every month (sold price over
+    adjusted price, see apply_sold_price_adjustments) from the output
+    of calculate_adjustment_ratio. Months it does not cover (or every
+    month, without it) are recovered from their sales instead, and
+    months without either get a ratio of 1, no sample refers to them.
+    """
+    n_months = int(month_ids.max()) + 1 if len(month_ids) else 0
+    valid = adjusted > 0
+    counts = np.bincount(month_ids[valid], minlength=n_months)
+    sums = np.bincount(
+        month_ids[valid], weights=unadjusted[valid] / adjusted[valid],
+        minlength=n_months
+    )
+    ratios = np.where(counts > 0, sums / np.maximum(counts, 1), 1.)
+
+    if price_adjustments is not None:
+        ids = np.asarray(
+            price_adjustments.date.values, dtype='datetime64[M]'
+        ).astype(np.int64) - first_month
+        known = (ids >= 0) & (ids < n_months)
+        ratios[ids[known]] = np.asarray(
+            price_adjustments.adjustment_ratio.values, dtype=np.float64
+        )[known]
+
+    return ratios
+
+
+def save_columnar(
+    dirpath : str, postcode_info : dict, source_path : str = None,
+    price_adjustments = None
+) -> None:
+    """
+    Saves the property information produced by
+    convert_property_info_to_json as a binary columnar artifact:
+        - metadata.json: postcodes, property/price types, sales counts
+        - unadjusted.npy: contiguous int32 sold prices, sorted by
+          postcode then property type
+        - months.npy: the uint16 month of every sale, counted from
+          the first sale month (recorded in the metadata)
+        - adjustment_ratios.npy: one float64 ratio per month, so
+          adjusted prices are derived as sold price / ratio when read
+        - offsets.npy: start of every (postcode, property type) slice
+        - neighbour_offsets.npy, neighbour_ids.npy: the neighbour
+          table in compressed sparse row form
+        - centroids.npy: the (latitude, longitude) of every postcode,
+          NaN where unknown
+
+    Parameters
+    ----------
+    dirpath : str
+        Directory the artifact is written to (replaced if it exists)
+    postcode_info : dict
+        The postcode information structured in JSON format
+    source_path : str
+        Optional path of the JSON file the information was read from,
+        whose fingerprint is recorded so the artifact can be checked
+        for staleness
+    price_adjustments : pd.DataFrame
+        The output of calculate_adjustment_ratio the adjusted prices
+        were computed with, whose ratios are stored as they are
+        (without it they are recovered from the sales of each month)
+
+    Information without sale months (or with prices that do not fit
+    an int32) is saved in the full layout instead: one contiguous
+    float64 <price type>.npy array per price type.
+    """
+    postcodes = list(postcode_info.keys())
+    ids = {postcode : i for i, postcode in enumerate(postcodes)}
+
+    # Lengths of every (postcode, property type) slice
+    lengths = np.array([
+        len(postcode_info[postcode][prop_type][PRICE_TYPES[0]])
+        for postcode in postcodes for prop_type in PROPERTY_TYPES
+    ], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    def flatten(key, dtype):
+        cells = [
+            np.asarray(postcode_info[postcode][prop_type][key], dtype=dtype)
+            for postcode in postcodes for prop_type in PROPERTY_TYPES
+        ]
+        return np.concatenate(cells) if cells else np.zeros(0, dtype=dtype)
+
+    prices = {price_type : flatten(price_type, np.float64) for price_type in PRICE_TYPES}
+
+    # Sold prices are whole pounds, so the compact layout stores them
+    # once (as int32) with a month index, and adjusted prices are
+    # recomputed from the month's adjustment ratio
+    compact = all(
+        'months' in postcode_info[postcode][prop_type]
+        for postcode in postcodes for prop_type in PROPERTY_TYPES
+    )
+    if compact:
+        months = flatten('months', np.int64)
+        first_month = int(months.min()) if len(months) else 0
+        month_ids = months - first_month
+        unadjusted = prices['unadjusted']
+        compact = (
+            np.array_equal(unadjusted, np.round(unadjusted)) and
+            np.all(np.abs(unadjusted) <= _MAX_COMPACT_PRICE) and
+            (len(month_ids) == 0 or month_ids.max() < _MAX_COMPACT_MONTHS)
+        )
+
+    if compact:
+        arrays = {
+            'unadjusted' : unadjusted.astype(np.int32),
+            'months' : month_ids.astype(np.uint16),
+            'adjustment_ratios' : _adjustment_ratios(
+                unadjusted, prices['adjusted'], month_ids, first_month,
+                price_adjustments
+            )
+        }
+    else:
+        arrays = prices
+
+    # Neighbours outside the data can never be visited, so are dropped
+    neighbours = [
+        sorted(ids[x] for x in postcode_info[postcode]['Neighbours'] if x in ids)
+        for postcode in postcodes
+    ]
+    neighbour_offsets = np.concatenate(
+        [[0], np.cumsum([len(x) for x in neighbours])]
+    ).astype(np.int64)
+    neighbour_ids = np.array(
+        [x for row in neighbours for x in row], dtype=np.int64
+    )
+
+    centroids = np.array([
+        postcode_info[postcode].get('Centroid') or (np.nan, np.nan)
+        for postcode in postcodes
+    ], dtype=np.float64).reshape(-1, 2)
+
+    metadata = {
+        'format_version' : COLUMNAR_FORMAT_VERSION,
+        'compact' : bool(compact),
+        'first_month' : (
+            str(np.datetime64(first_month, 'M')) if compact else None
+        ),
+        'postcodes' : postcodes,
+        'property_types' : PROPERTY_TYPES,
+        'price_types' : PRICE_TYPES,
+        'n' : [int(postcode_info[postcode]['n']) for postcode in postcodes],
+        'source_path' : source_path,
+        'source_fingerprint' : (
+            fingerprint_file(source_path) if source_path is not None else None
+        )
+    }
+
+    # Write alongside and swap in, so readers never see a partial artifact
+    tmp_dirpath = f"{dirpath.rstrip('/')}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dirpath, ignore_errors=True)
+    os.makedirs(tmp_dirpath)
+
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_dirpath, f'{name}.npy'), values)
+    np.save(os.path.join(tmp_dirpath, 'offsets.npy'), offsets)
+    np.save(os.path.join(tmp_dirpath, 'neighbour_offsets.npy'), neighbour_offsets)
+    np.save(os.path.join(tmp_dirpath, 'neighbour_ids.npy'), neighbour_ids)
+    np.save(os.path.join(tmp_dirpath, 'centroids.npy'), centroids)
+    with open(os.path.join(tmp_dirpath, 'metadata.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f)
+
+    shutil.rmtree(dirpath, ignore_errors=True)
+    os.replace(tmp_dirpath, dirpath)
+    return
+
+
+class ColumnarPropertyData(Mapping):
+    """
+    Read-only, memory-mapped view of a columnar artifact. Behaves
+    like the property information dict (data[postcode][property type]
+    [price type]) but every sample array is a zero-copy view into
+    the mapped files, so processes share pages via the OS page cache.
+    In the compact layout the unadjusted samples are int32 views and
+    the adjusted samples are computed per read with one gather and
+    divide by the month adjustment ratios.
+
+    Only the postcode index is read up front. Postcode entries are
+    built on demand and the most recent are kept in a bounded,
+    thread safe LRU, so one instance can be shared read-only by every
+    session of the app.
+
+    Parameters
+    ----------
+    dirpath : str
+        Directory holding the artifact written by save_columnar
+    cache_size : int
+        The maximum number of postcode entries kept built
+    """
+    def __init__(self, dirpath : str, cache_size : int = 256):
+        self.dirpath = dirpath
+        self.cache_size = cache_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        with open(os.path.join(dirpath, 'metadata.json'), encoding='utf-8') as f:
+            metadata = json.load(f)
+
+        if metadata['format_version'] not in {1, COLUMNAR_FORMAT_VERSION}:
+            raise ValueError(
+                f"Unsupported columnar format version {metadata['format_version']}"
+            )
+
+        self.source_path = metadata.get('source_path')
+        self.source_fingerprint = metadata.get('source_fingerprint')
+        self.postcodes = metadata['postcodes']
+        self.ids = {postcode : i for i, postcode in enumerate(self.postcodes)}
+        self.property_types = metadata['property_types']
+        self.price_types = metadata['price_types']
+        self.n = metadata['n']
+        self.compact = metadata.get('compact', False)
+
+        def load(name):
+            return np.load(os.path.join(dirpath, f'{name}.npy'), mmap_mode='r')
+
+        if self.compact:
+            self.first_month = np.datetime64(metadata['first_month'], 'M')
+            self.unadjusted = load('unadjusted')
+            self.month_ids = load('months')
+            self.adjustment_ratios = np.load(
+                os.path.join(dirpath, 'adjustment_ratios.npy')
+            )
+            # The ratios run from the first to the last sale month
+            self.last_month = (
+                int(self.first_month.astype(np.int64)) + 
+                len(self.adjustment_ratios) - 1
+            )
+        else:
+            self.prices = {price_type : load(price_type) for price_type in self.price_types}
+        self.offsets = load('offsets')
+        self.neighbour_offsets = load('neighbour_offsets')
+        self.neighbour_ids = load('neighbour_ids')
+
+        # Artifacts saved before centroids were recorded have none
+        centroids_path = os.path.join(dirpath, 'centroids.npy')
+        self.centroids = (
+            np.load(centroids_path) if os.path.exists(centroids_path) else None
+        )
+
+    def __len__(self) -> int:
+        return len(self.postcodes)
+
+    def __iter__(self):
+        return iter(self.postcodes)
+
+    def __contains__(self, postcode) -> bool:
+        return postcode in self.ids
+
+    def neighbours(self, postcode : str) -> set:
+        i = self.ids[postcode]
+        return {
+            self.postcodes[x] for x in
+            self.neighbour_ids[self.neighbour_offsets[i]:self.neighbour_offsets[i + 1]]
+        }
+
+    def centroid(self, postcode : str) -> list:
+        if self.centroids is None:
+            return None
+        centroid = self.centroids[self.ids[postcode]]
+        return None if np.isnan(centroid).any() else centroid.tolist()
+
+    def samples(
+        self, postcode : str, property_type : str, price_type : str
+    ) -> np.ndarray:
+        """
+        Returns the samples of a postcode, a zero-copy view except for
+        the adjusted prices of the compact layout.
+        """
+        start, end = self._cell_bounds(postcode, property_type)
+        if not self.compact:
+            return self.prices[price_type][start:end]
+
+        unadjusted = self.unadjusted[start:end]
+        if price_type == 'unadjusted':
+            return unadjusted
+        if price_type != 'adjusted':
+            raise KeyError(price_type)
+        return unadjusted / self.adjustment_ratios[self.month_ids[start:end]]
+
+    def sale_months(self, postcode : str, property_type : str) -> np.ndarray:
+        """
+        Returns the sale month of every sample of a postcode, as months
+        since January 1970 (the datetime64[M] integer code).
+        """
+        if not self.compact:
+            raise ValueError('Sale months are only stored in the compact layout')
+        start, end = self._cell_bounds(postcode, property_type)
+        return self.month_ids[start:end] + self.first_month.astype(np.int64)
+
+    def _cell_bounds(self, postcode : str, property_type : str) -> tuple:
+        cell = self.ids[postcode] * len(self.property_types) + (
+            self.property_types.index(property_type)
+        )
+        return self.offsets[cell], self.offsets[cell + 1]
+
+    def __getitem__(self, postcode : str) -> dict:
+        with self._lock:
+            if postcode in self._entries:
+                self._entries.move_to_end(postcode)
+                return self._entries[postcode]
+
+        entry = self._build_entry(postcode)
+        with self._lock:
+            self._entries[postcode] = entry
+            while len(self._entries) > self.cache_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _build_entry(self, postcode : str) -> dict:
+        if postcode not in self.ids:
+            raise KeyError(postcode)
+
+        entry = {
+            prop_type : {
+                price_type : self.samples(postcode, prop_type, price_type)
+                for price_type in self.price_types
+            }
+            for prop_type in self.property_types
+        }
+        if self.compact:
+            for prop_type in self.property_types:
+                entry[prop_type]['months'] = self.sale_months(postcode, prop_type)
+        entry['n'] = self.n[self.ids[postcode]]
+        entry['Neighbours'] = self.neighbours(postcode)
+        entry['Centroid'] = self.centroid(postcode)
+        return entry
+
+    def neighbour_index(self) -> NeighbourIndex:
+        """
+        Builds the NeighbourIndex straight from the offset tables,
+        without materialising any postcode entries.
+        """
+        n_postcodes, n_types = len(self.postcodes), len(self.property_types)
+        counts = np.diff(np.asarray(self.offsets)).reshape(n_postcodes, n_types)
+        adjacency = np.split(
+            np.asarray(self.neighbour_ids), np.asarray(self.neighbour_offsets)[1:-1]
+        )
+        return NeighbourIndex.from_arrays(
+            self.postcodes, adjacency,
+            np.repeat(counts[:, :, np.newaxis], len(PRICE_TYPES), axis=2),
+            latest_month=self.last_month if self.compact else None,
+            centroids=self.centroids
+        )
+
+
+def rebase_columnar(dirpath : str, scale : float) -> None:
+    """
+    Re-references the adjusted prices of a compact artifact in place
+    by swapping its adjustment ratio vector (see
+    rebase_adjusted_prices): every ratio is divided by scale, the new
+    over the old reference price, and no sample is rewritten.
+    """
+    with open(os.path.join(dirpath, 'metadata.json'), encoding='utf-8') as f:
+        if not json.load(f).get('compact', False):
+            raise ValueError(f'{dirpath} is not a compact columnar artifact')
+
+    filepath = os.path.join(dirpath, 'adjustment_ratios.npy')
+    tmp_filepath = f'{filepath}.{os.getpid()}.tmp.npy'
+    np.save(tmp_filepath, np.load(filepath) / scale)
+    os.replace(tmp_filepath, filepath)
+    return
+
+
+def convert_to_columnar(json_path : str, dirpath : str = None) -> str:
+    """
+    Converts a (possibly compressed) cleaned JSON file to a columnar
+    artifact, once: the
+    conversion is skipped while an artifact converted from the
+    current version of the file exists.
+
+    Parameters
+    ----------
+    json_path : str
+        Path to the cleaned JSON file
+    dirpath : str
+        Directory of the artifact (defaults to json_path without
+        its extensions)
+
+    Returns
+    -------
+    dirpath : str
+        Directory of the up to date artifact.
+    """
+    if dirpath is None:
+        dirpath = os.path.splitext(strip_compression_suffix(json_path))[0]
+
+    metadata_path = os.path.join(dirpath, 'metadata.json')
+    if os.path.exists(metadata_path):
+        with open(metadata_path, encoding='utf-8') as f:
+            source_fingerprint = json.load(f).get('source_fingerprint')
+        if source_fingerprint == fingerprint_file(json_path):
+            return dirpath
+
+    save_columnar(dirpath, load_json(json_path), source_path=json_path)
+
+    return dirpath
+
+
+def open_property_data(path : str, cache_size : int = 256) -> ColumnarPropertyData:
+    """
+    Opens the cleaned property information lazily: a JSON file is
+    converted to a columnar artifact the first time (see
+    convert_to_columnar), after which opening only reads the
+    postcode index. An artifact converted from a JSON file that has
+    since been rewritten is converted again.
+
+    Parameters
+    ----------
+    path : str
+        Path to the cleaned JSON file or columnar artifact directory
+    cache_size : int
+        The maximum number of postcode entries kept built
+
+    Returns
+    -------
+    data : ColumnarPropertyData
+        The property information, keyed by postcode.
+    """
+    if not os.path.isdir(path):
+        path = convert_to_columnar(path)
+
+    data = ColumnarPropertyData(path, cache_size=cache_size)
+    if data.source_path is not None and os.path.exists(data.source_path) and (
+        data.source_fingerprint != fingerprint_file(data.source_path)
+    ):
+        data = ColumnarPropertyData(
+            convert_to_columnar(data.source_path, path), cache_size=cache_size
+        )
+
+    return data
+
+
+def load_property_data(path : str) -> Mapping:
+    """
+    Loads the cleaned property information, memory-mapping it if
+    path is a columnar artifact directory and parsing it otherwise.
+
+    Parameters
+    ----------
+    path : str
+        Path to the cleaned JSON file or columnar artifact directory
+
+    Returns
+    -------
+    data : Mapping
+        The property information, keyed by postcode.
+    """
+    if os.path.isdir(path):
+        return ColumnarPropertyData(path)
+
+    return load_json(path)
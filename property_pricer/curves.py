@@ -0,0 +1,118 @@
+import bisect
+import json
+import os
+import numpy as np
+from property_pricer.cache import data_fingerprints
+
+# Two sided thresholds the curves are stored at, i.e. confidence
+# levels from 50% to 99.9%, denser in the tails and exact at the
+# usual 90%, 95% and 99% levels
+QUANTILE_CURVE_THRESHOLDS = np.unique(np.round(np.concatenate([
+    np.geomspace(0.0005, 0.01, 8), np.linspace(0.01, 0.25, 25),
+    [0.005, 0.025, 0.05]
+]), 6)).tolist()
+
+
+def curve_key(postcode : str, pricing_type : str, property_type : str) -> str:
+    """
+    Builds the quantile curve key of a (postcode, property type,
+    price type).
+    """
+    return f'{postcode}|{property_type}|{pricing_type}'
+
+
+def load_quantile_curves(curves_path : str, data_path : str = None) -> dict:
+    """
+    Loads precomputed quantile curves (see
+    lookup.precompute_quantile_curves).
+
+    Parameters
+    ----------
+    curves_path : str
+        Path to the quantile curves JSON
+    data_path : str
+        If given, the curves are only returned if they were computed
+        from the current version of this data file (or of the JSON
+        file a columnar artifact was converted from, or the columnar
+        artifact converted from a JSON file).
+
+    Returns
+    -------
+    curves : dict
+        The quantile curves (or None if they are missing or stale).
+    """
+    if not os.path.exists(curves_path):
+        return None
+
+    with open(curves_path, encoding='utf-8') as f:
+        curves = json.load(f)
+
+    # Curves saved without fingerprints can't be checked
+    if data_path is not None and not (
+        set(curves.get('fingerprints', [])) & data_fingerprints(data_path)
+    ):
+        return None
+
+    return curves
+
+
+def interpolate_price_range(
+    curves : dict, postcode : str, pricing_type : str,
+    property_type : str, threshold : float, n_samples : int = None
+) -> tuple:
+    """
+    Reads the price range of any threshold off a precomputed quantile
+    curve, interpolating linearly in log threshold between the two
+    nearest stored thresholds.
+
+    Parameters
+    ----------
+    curves : dict
+        The output of load_quantile_curves
+    postcode : str
+        The postcode being priced
+    pricing_type : str
+        Whether to use 'adjusted' or 'unadjusted' prices
+    property_type : str
+        The property type being priced
+    threshold : float
+        two sided confidence interval threshold
+    n_samples : int
+        If given, the number of samples the postcode holds now, so
+        curves built before the postcode changed are not used.
+
+    Returns
+    -------
+    price_range : tuple
+        The (lower bound, upper bound, lower bound uncertainty, upper
+        bound uncertainty, threshold), or None if the curve is missing,
+        stale or does not cover the threshold.
+    """
+    thresholds = curves['thresholds']
+    if not thresholds[0] <= threshold <= thresholds[-1]:
+        return None
+
+    entry = curves['curves'].get(curve_key(postcode, pricing_type, property_type))
+    if entry is None:
+        return None
+
+    n, *columns = entry
+    if n_samples is not None and n != n_samples:
+        return None
+
+    # Bracketing stored thresholds
+    upper = bisect.bisect_left(thresholds, threshold)
+    lower = max(upper - 1, 0)
+    weight = 0. if upper == lower else (
+        np.log(threshold / thresholds[lower]) /
+        np.log(thresholds[upper] / thresholds[lower])
+    )
+
+    price_range = []
+    for column in columns:
+        start, end = column[lower], column[upper]
+        if start is None or end is None:
+            return None
+        price_range.append(int(round(start + weight * (end - start))))
+
+    return tuple(price_range) + (threshold,)
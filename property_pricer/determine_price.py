@@ -1,13 +1,314 @@
-import copy
+import contextvars
+import logging
+import warnings
 import numpy as np
 import scipy.stats as stats
-from tqdm import tqdm
-from property_pricer import get_optimal_kde, calculate_critical_value
-from typing import Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from property_pricer import (
+    get_optimal_kde, calculate_critical_values,
+    select_bandwidths, batch_kde_critical_values, weight_bandwidths
+)
+from property_pricer.curves import interpolate_price_range
+from property_pricer.instrumentation import count, span
+from property_pricer.recency import gather_recent_samples
+from property_pricer.sketch import TDigest, sketch_price_range
+from property_pricer.neighbours import (
+    NeighbourIndex, gather_samples, get_neighbour_index
+)
+from typing import Callable, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+def _run_bootstrap_replica(
+    prices : np.ndarray, sample_size : int, 
+    seed : np.random.SeedSequence, thresholds : np.ndarray,
+    bandwidth_method : Union[str, Callable] = 'grid_search',
+    weights : np.ndarray = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Runs a single resample -> normalise -> fit -> quantile bootstrap
+    replica with its own random generator.
+    
+    Parameters
+    ----------
+    prices : np.ndarray
+        Observed prices from the unknown price probability distribution
+    sample_size : int
+        The number of prices drawn (with replacement) in the replica
+    seed : np.random.SeedSequence
+        The seed for the replica's independent random generator
+    thresholds : np.ndarray
+        The two sided confidence interval thresholds to estimate
+    bandwidth_method : str or callable
+        The KDE bandwidth selection strategy
+    weights : np.ndarray
+        Optional weight of every price, carried into the KDE fit
+    
+    Returns
+    -------
+    lower_bounds : np.ndarray
+        The lower bound price for each threshold
+    upper_bounds : np.ndarray
+        The upper bound price for each threshold
+    """
+    with span('normalisation'):
+        rng = np.random.default_rng(seed)
+        
+        # randomly select a subset of the prices
+        sample_ids = rng.choice(len(prices), size = sample_size)
+        price_sample = prices[sample_ids]
+        sample_weight = weights[sample_ids] if weights is not None else None
+        
+        # Normalise prices to [0,1] range
+        price_sample_normalised, sample_min, sample_max =(
+            min_max_normalize(price_sample)
+        )
+    
+    # Fit optimal kernel density estimator to prices
+    optimal_kde = get_optimal_kde(
+        price_sample_normalised, 
+        bandwidth_method=bandwidth_method,
+        sample_weight=sample_weight
+    )
+
+    # Estimate normalised upper and lower bounds
+    with span('quantile_extraction'):
+        lb_normalised, ub_normalised, precision = (
+            calculate_critical_values(
+                optimal_kde, thresholds=thresholds
+            )
+        )
+    if precision > 1e-4:
+        warnings.warn(
+            f'Critical values only located to a precision of {precision:.2g}'
+        )
+    
+    # Undo normalisation on estimates 
+    return (
+        unnormalize(lb_normalised,sample_max, sample_min),
+        unnormalize(ub_normalised,sample_max, sample_min)
+    )
+
+
+def _run_bootstrap_replicas(
+    prices : np.ndarray, n_bootstraps : int, sample_size : int,
+    seed : np.random.SeedSequence, thresholds : np.ndarray,
+    bandwidth_method : Union[str, Callable] = 'grid_search',
+    executor : str = 'serial', n_workers : int = None,
+    weights : np.ndarray = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Runs the bootstrap replicas one sklearn KDE at a time on the 
+    requested executor, each with a SeedSequence spawned from seed.
+    
+    Parameters
+    ----------
+    prices : np.ndarray
+        Observed prices from the unknown price probability distribution
+    n_bootstraps : int
+        The number of bootstrap replicas
+    sample_size : int
+        The number of prices drawn (with replacement) in each replica
+    seed : np.random.SeedSequence
+        The seed from which the replica seeds are spawned
+    thresholds : np.ndarray
+        The two sided confidence interval thresholds to estimate
+    bandwidth_method : str or callable
+        The KDE bandwidth selection strategy
+    executor : str
+        'serial', 'thread' or 'process'
+    n_workers : int
+        The number of pool workers
+    weights : np.ndarray
+        Optional weight of every price, carried into the KDE fits
+    
+    Returns
+    -------
+    lower_bounds : np.ndarray
+        The lower bound prices, shape (n_bootstraps, n_thresholds)
+    upper_bounds : np.ndarray
+        The upper bound prices, shape (n_bootstraps, n_thresholds)
+    """
+    run_replica = partial(
+        _run_bootstrap_replica, prices, sample_size,
+        thresholds=thresholds, bandwidth_method=bandwidth_method,
+        weights=weights
+    )
+    seeds = seed.spawn(n_bootstraps)
+    
+    if executor == 'serial':
+        replicas = list(map(run_replica, seeds))
+    
+    elif executor == 'thread':
+        # Each replica runs in a copy of the caller's context, so
+        # its spans are recorded in the caller's trace
+        contexts = [contextvars.copy_context() for _ in seeds]
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            replicas = list(pool.map(
+                lambda context, seed: context.run(run_replica, seed),
+                contexts, seeds
+            ))
+    
+    elif executor == 'process':
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            replicas = list(pool.map(run_replica, seeds))
+    
+    else:
+        raise ValueError(f'Unknown bootstrap executor: {executor}')
+    
+    lower_bounds, upper_bounds = zip(*replicas)
+    
+    return np.array(lower_bounds), np.array(upper_bounds)
+
+
+def _run_vectorised_bootstrap(
+    prices : np.ndarray, n_bootstraps : int, sample_size : int,
+    seed : np.random.SeedSequence, thresholds : np.ndarray,
+    bandwidth_method : Union[str, Callable] = 'grid_search',
+    weights : np.ndarray = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Runs every bootstrap replica at once: the resample indices are
+    drawn as one (n_bootstraps, sample_size) matrix and the 
+    normalisation, density evaluation and quantile extraction are
+    batched across the replicas.
+    
+    Parameters
+    ----------
+    prices : np.ndarray
+        Observed prices from the unknown price probability distribution
+    n_bootstraps : int
+        The number of bootstrap replicas
+    sample_size : int
+        The number of prices drawn (with replacement) in each replica
+    seed : np.random.SeedSequence
+        The seed for the random generator
+    thresholds : np.ndarray
+        The two sided confidence interval thresholds to estimate
+    bandwidth_method : str or callable
+        The KDE bandwidth selection strategy
+    weights : np.ndarray
+        Optional weight of every price, carried into the KDEs
+    
+    Returns
+    -------
+    lower_bounds : np.ndarray
+        The lower bound prices, shape (n_bootstraps, n_thresholds)
+    upper_bounds : np.ndarray
+        The upper bound prices, shape (n_bootstraps, n_thresholds)
+    """
+    with span('normalisation'):
+        rng = np.random.default_rng(seed)
+        sample_ids = rng.integers(0, len(prices), size=(n_bootstraps, sample_size))
+        price_samples = prices[sample_ids]
+        sample_weights = weights[sample_ids] if weights is not None else None
+        
+        # Normalise every replica to the [0,1] range
+        sample_min = price_samples.min(axis=1, keepdims=True)
+        sample_max = price_samples.max(axis=1, keepdims=True)
+        sample_range = np.where(sample_max > sample_min, sample_max - sample_min, 1)
+        price_samples_normalised = (price_samples - sample_min) / sample_range
+    
+    with span('bandwidth_search'):
+        bandwidths = select_bandwidths(price_samples_normalised, bandwidth_method)
+        if sample_weights is not None:
+            bandwidths = weight_bandwidths(bandwidths, sample_weights)
+    lb_normalised, ub_normalised = batch_kde_critical_values(
+        price_samples_normalised, bandwidths, thresholds, 
+        weights=sample_weights
+    )
+    
+    # Undo normalisation on estimates 
+    return (
+        lb_normalised * sample_range + sample_min,
+        ub_normalised * sample_range + sample_min
+    )
+
+
+def get_price_ranges(
+    prices : np.ndarray, thresholds : np.ndarray, 
+    n_bootstraps : int = 10, bootstrap_fraction : float = 0.8,
+    bandwidth_method : Union[str, Callable] = 'grid_search',
+    executor : str = 'serial', n_workers : int = None,
+    random_state : Union[int, np.random.SeedSequence] = None,
+    bootstrap_engine : str = 'replicas', weights : np.ndarray = None
+) -> List[Tuple[int, int, int, int, float]]:
+    """
+    Calculate the price ranges for several two-sided confidence 
+    intervals at once. Every bootstrap KDE is fitted once and all 
+    of the thresholds are extracted from the same fitted densities.
+    
+    Parameters
+    ----------
+    prices : np.ndarray
+        Observed prices from the unknown price probability distribution
+    thresholds : np.ndarray
+        two sided confidence interval thresholds i.e. 0.05 corresponds 
+        to the 90% confidence interval.
+    n_bootstraps, bootstrap_fraction, bandwidth_method, executor, 
+    n_workers, random_state, bootstrap_engine, weights
+        As in get_price_range
+    
+    Returns
+    -------
+    price_ranges : list
+        The (lower bound, upper bound, lower bound uncertainty, upper
+        bound uncertainty, threshold) of every threshold, in order.
+    """
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+    if not isinstance(random_state, np.random.SeedSequence):
+        random_state = np.random.SeedSequence(random_state)
+    sample_size = int(len(prices)*bootstrap_fraction)
+    count('bootstrap_replicas', n_bootstraps)
+    
+    # Run the bootstrap resamples
+    with span('bootstrap'):
+        if bootstrap_engine == 'replicas':
+            lower_bounds, upper_bounds = _run_bootstrap_replicas(
+                prices, n_bootstraps, sample_size, random_state, 
+                thresholds, bandwidth_method=bandwidth_method,
+                executor=executor, n_workers=n_workers, weights=weights
+            )
+        
+        elif bootstrap_engine == 'vectorised':
+            lower_bounds, upper_bounds = _run_vectorised_bootstrap(
+                prices, n_bootstraps, sample_size, random_state, 
+                thresholds, bandwidth_method=bandwidth_method,
+                weights=weights
+            )
+        
+        else:
+            raise ValueError(f'Unknown bootstrap engine: {bootstrap_engine}')
+
+    price_ranges = []
+    for i, threshold in enumerate(thresholds):
+        lower_bound_estimates = lower_bounds[:, i]
+        upper_bound_estimates = upper_bounds[:, i]
+        
+        # Compute uncertainty in threshold estimates
+        lower_bound_uncertainty = int(calculate_uncertainty(lower_bound_estimates))
+        upper_bound_uncertainty = int(calculate_uncertainty(upper_bound_estimates))
+        
+        # Compute average estimate in the mean bound price
+        lower_bound_estimate = int(np.mean(lower_bound_estimates))
+        upper_bound_estimate = int(np.mean(upper_bound_estimates))
+        
+        price_ranges.append((
+            lower_bound_estimate, upper_bound_estimate, 
+            lower_bound_uncertainty, upper_bound_uncertainty, float(threshold)
+        ))
+    
+    return price_ranges
+
 
 def get_price_range(
     prices : np.ndarray, threshold : float = 0.05, 
-    n_bootstraps : int = 10, bootstrap_fraction : float = 0.8
+    n_bootstraps : int = 10, bootstrap_fraction : float = 0.8,
+    bandwidth_method : Union[str, Callable] = 'grid_search',
+    executor : str = 'serial', n_workers : int = None,
+    random_state : Union[int, np.random.SeedSequence] = None,
+    bootstrap_engine : str = 'replicas', weights : np.ndarray = None
 ) -> Tuple[np.ndarray, np.ndarray, float, float]:
     """
     Calculate the price range for a given two-sided confidence interval
@@ -25,6 +326,30 @@ def get_price_range(
         The number of bootstrap sampling rounds to run for the estimates
     bootstrap_fraction : float
         Proportion of samples to be included in each bootstrap run
+    bandwidth_method : str or callable
+        The KDE bandwidth selection strategy (see 
+        model.select_bandwidth), defaults to the grid search.
+    executor : str
+        How to run the bootstrap replicas: 'serial', 'thread' (thread
+        pool) or 'process' (process pool, a callable bandwidth_method
+        must then be picklable).
+    n_workers : int
+        The number of pool workers (defaults to the number of CPUs).
+    random_state : int or np.random.SeedSequence
+        Seeds the replicas. Each replica gets its own spawned 
+        SeedSequence, so results are identical for any executor
+        and worker count.
+    bootstrap_engine : str
+        'replicas' fits an sklearn KDE per replica on the chosen 
+        executor, 'vectorised' evaluates the densities and quantiles
+        of all replicas at once with batched NumPy operations (the
+        executor is then unused). Only the analytic bandwidth rules
+        ('silverman', 'scott') are batched too, other strategies
+        select each replica's bandwidth in turn (grid_search still
+        runs a GridSearchCV per replica).
+    weights : np.ndarray
+        Optional weight of every price (e.g. recency weights), every
+        bootstrap KDE is then weighted by the weights of its resample.
     
     Returns
     -------
@@ -37,81 +362,38 @@ def get_price_range(
     upper_bound_uncertainty : int
         The uncertainty in the upper bound estimate
     threshold : float
-        The true threshold used in the calculation (will be different
-        from input if numerical precision is exceeded).
+        The threshold used in the calculation.
     """
-    lower_bound_estimates = []
-    upper_bound_estimates = []
-    
-    # Run the bootstrap resamples
-    for _ in tqdm(range(n_bootstraps)):
-        
-        # randomly select a subset of the prices
-        price_sample = np.random.choice(
-            prices,
-            size = int(len(prices)*bootstrap_fraction)
-        )
-        
-        # Normalise prices to [0,1] range
-        price_sample_normalised, sample_min, sample_max =(
-            min_max_normalize(price_sample)
-        )
-        
-        # Fit optimal kernel density estimator to prices
-        optimal_kde = get_optimal_kde(
-            price_sample_normalised
-        )
-
-        # Estimate normalised upper and lower bounds
-        lb_normalised, ub_normalised, threshold = (
-            calculate_critical_value(
-                optimal_kde, threshold=threshold
-            )
-        )
-        
-        # Undo normalisation on estimates 
-        lb, ub = (
-            unnormalize(lb_normalised,sample_max, sample_min),
-            unnormalize(ub_normalised,sample_max, sample_min)
-        )
-
-        lower_bound_estimates.append(lb)
-        upper_bound_estimates.append(ub)
-
-    lower_bound_estimates = np.array(lower_bound_estimates)
-    upper_bound_estimates = np.array(upper_bound_estimates)
-    
-    # Compute uncertainty in threshold estimates
-    lower_bound_uncertainty = int(calculate_uncertainty(lower_bound_estimates))
-    upper_bound_uncertainty = int(calculate_uncertainty(upper_bound_estimates))
-    
-    # Compute average estimate in the mean bound price
-    lower_bound_estimate = int(np.mean(lower_bound_estimates))
-    upper_bound_estimate = int(np.mean(upper_bound_estimates))
-    
+    lb_estimate, ub_estimate, lb_uncertainty, ub_uncertainty, _ = (
+        get_price_ranges(
+            prices, [threshold], n_bootstraps=n_bootstraps,
+            bootstrap_fraction=bootstrap_fraction,
+            bandwidth_method=bandwidth_method, executor=executor,
+            n_workers=n_workers, random_state=random_state,
+            bootstrap_engine=bootstrap_engine, weights=weights
+        )[0]
+    )
     return (
-        lower_bound_estimate, upper_bound_estimate, 
-        lower_bound_uncertainty, upper_bound_uncertainty, threshold
+        lb_estimate, ub_estimate, 
+        lb_uncertainty, ub_uncertainty, threshold
     )
 
 
 
 def upsample_data(
-    neighbours_to_visit : set, samples : list, price_type : str, 
-    property_type : str, data : dict, needed_samples : int, 
-    visited_neighbours : set
-)-> list:
+    postcode : str, price_type : str, property_type : str, 
+    data : dict, needed_samples : int, 
+    neighbour_index : NeighbourIndex = None, upsampling : str = 'neighbours'
+)-> np.ndarray:
     """
-    Recursively upsample data by including neighbouring 
-    postcode data, until statistical significance is reached.
+    Upsample data by including neighbouring postcode data, expanding
+    breadth first through the neighbour graph (or nearest first by
+    centroid distance) until statistical significance is reached.
     
     Parameters
     ----------
-    neighbours_to_visit : set
-        The queue of neighbouring postcodes to visit next
-        in the recursion
-    samples : list
-        The property sale price samples currently in the path
+    postcode : str
+        The postcode whose samples are being upsampled
     price_type : str
         Whether to use 'adjusted' or 'unadjusted' prices for
         the samples.
@@ -122,79 +404,313 @@ def upsample_data(
     needed_samples : int
         The lower bound on the number of samples needed for statistical
         significance.
-    visited_neighbours : set
-        The neighbouring postcodes that have already been included in the 
-        upsampling random walk
+    neighbour_index : NeighbourIndex
+        Precomputed neighbour graph of the data (built and reused
+        per data object if not given).
+    upsampling : str
+        'neighbours' or 'nearest' (see NeighbourIndex.find_neighbourhood)
     
     Returns
     -------
-    samples : list
-        The list of upregulated samples (or None if no possible upsampling
-        walk could be found).
+    samples : np.ndarray
+        The upregulated samples (or None if no neighbourhood with
+        sufficient data could be found).
     """
-    if len(neighbours_to_visit) == 0:
-        print('No possible path of neighbours with sufficient data could be found')
-        return None
+    if neighbour_index is None:
+        neighbour_index = get_neighbour_index(data)
     
-    neighbour = neighbours_to_visit.pop()
-    visited_neighbours.add(neighbour)
+    neighbourhood = neighbour_index.find_neighbourhood(
+        postcode, property_type, price_type, needed_samples, 
+        upsampling=upsampling
+    )
+    if neighbourhood is None:
+        logger.info(
+            'No possible path of neighbours of %s with sufficient data '
+            'could be found', postcode
+        )
+        return None
     
-    print(f'Adding in samples from postcode: {neighbour}')
-    neighbour_data = data[neighbour]
-    neighbours_to_visit.union(set(neighbour_data['Neighbours']))
+    count('neighbours_added', len(neighbourhood) - 1)
+    for neighbour in neighbourhood[1:]:
+        logger.debug('Adding in samples from postcode: %s', neighbour)
     
-    samples = samples + neighbour_data[property_type][price_type]
-                               
-    if len(samples) < needed_samples:
-        upsample_data(
-            neighbours_to_visit, samples, 
-            price_type, property_type, data, needed_samples, visited_neighbours
-        )
-    return samples
-
+    return gather_samples(data, neighbourhood, property_type, price_type)
 
 
 
-
-
-
-def calculate_property_prices(data, postcode, pricing_type, property_type, confidence):
+def calculate_property_prices(
+    data, postcode, pricing_type, property_type, confidence,
+    bandwidth_method='grid_search', executor='serial', n_workers=None,
+    random_state=None, bootstrap_engine='replicas', cache=None,
+    neighbour_index=None, quantile_curves=None, sketches=None,
+    window_months=None, recency_half_life=None, as_of=None,
+    upsampling='neighbours'
+):
+    
+    # Answer repeated queries from the cache, keyed on every
+    # option that changes the estimate
+    if cache is not None:
+        options = dict(
+            bandwidth_method=bandwidth_method, random_state=random_state,
+            bootstrap_engine=bootstrap_engine, window_months=window_months,
+            recency_half_life=recency_half_life, as_of=as_of,
+            upsampling=upsampling
+        )
+        key = cache.make_key(
+            postcode, pricing_type, property_type, confidence, 
+            approximate=sketches is not None, **options
+        )
+        return cache.get_or_compute(
+            key, 
+            lambda: calculate_property_prices(
+                data, postcode, pricing_type, property_type, confidence,
+                executor=executor, n_workers=n_workers, 
+                neighbour_index=neighbour_index, 
+                quantile_curves=quantile_curves, sketches=sketches, 
+                **options
+            )
+        )
     
     # Convert confidence to 2-sided threshold value
     threshold = (1-confidence)/2
     
-    # heuristic based on having a quarter
-    # of a standard deviation of error in an unobserved 
-    # normal distribution at a given threshold
-    needed_samples = int(np.ceil(16 * 4 * (stats.norm.ppf(1 - threshold)**2)))
+    needed_samples = get_needed_samples(threshold)
+    
+    # Time windows and recency weights price recent sales only, so
+    # neither the whole history sketches nor curves apply
+    if window_months is not None or recency_half_life is not None:
+        if sketches is not None:
+            raise ValueError(
+                'Time windows and recency weights need the samples, '
+                'not quantile sketches'
+            )
+        with span('upsampling'):
+            samples, weights = gather_recent_samples(
+                data, postcode, property_type, pricing_type, needed_samples,
+                window_months=window_months, 
+                recency_half_life=recency_half_life, as_of=as_of,
+                neighbour_index=neighbour_index, upsampling=upsampling
+            )
+        return _price_samples(
+            samples, postcode, threshold, weights=weights,
+            bandwidth_method=bandwidth_method, executor=executor, 
+            n_workers=n_workers, random_state=random_state, 
+            bootstrap_engine=bootstrap_engine
+        )
+    
+    # Approximate mode, answered from quantile sketches alone
+    if sketches is not None:
+        return approximate_property_prices(
+            data, sketches, postcode, pricing_type, property_type, 
+            threshold, needed_samples, neighbour_index, upsampling
+        )
     
     # Obtain samples we currently have for postcode
     postcode_data =  data[postcode]
     samples = postcode_data[property_type][pricing_type]
     
-    if len(samples) < needed_samples:
-        samples = upsample_data(
-            set(postcode_data['Neighbours']), samples, 
-            pricing_type, property_type, copy.deepcopy(data), 
-            needed_samples, set()
+    # Read any confidence off a precomputed quantile curve built with
+    # the same options (and upsampled through the neighbour graph),
+    # if it is still current for this postcode
+    if (
+        quantile_curves is not None and upsampling == 'neighbours' and 
+        quantile_curves['options'] == {
+            'bandwidth_method' : bandwidth_method, 
+            'bootstrap_engine' : bootstrap_engine
+        }
+    ):
+        price_range = interpolate_price_range(
+            quantile_curves, postcode, pricing_type, property_type,
+            threshold, n_samples=len(samples)
         )
+        if price_range is not None:
+            return price_range
+    
+    if len(samples) < needed_samples:
+        with span('upsampling'):
+            samples = upsample_data(
+                postcode, pricing_type, property_type, data,
+                needed_samples, neighbour_index, upsampling
+            )
     
-    if not samples:
-        print(
-            'Could not obtain a sufficient number' 
-            ' of samples - returning no estimate'
+    return _price_samples(
+        samples, postcode, threshold,
+        bandwidth_method=bandwidth_method, executor=executor, 
+        n_workers=n_workers, random_state=random_state, 
+        bootstrap_engine=bootstrap_engine
+    )
+
+
+def _price_samples(samples, postcode, threshold, weights=None, **kwargs):
+    if samples is None or len(samples) == 0:
+        logger.info(
+            'Could not obtain a sufficient number of samples for %s'
+            ' - returning no estimate', postcode
         )
         return None
+    count('samples', len(samples))
     
     lb_estimate, ub_estimate, lb_uncertainty, ub_uncertainty, threshold = (
         get_price_range(
-            np.array(samples),
-            threshold
+            np.asarray(samples, dtype=float), threshold, 
+            weights=weights, **kwargs
         )
     )
     return lb_estimate, ub_estimate, lb_uncertainty, ub_uncertainty, threshold
 
 
+def approximate_property_prices(
+    data, sketches, postcode, pricing_type, property_type, 
+    threshold, needed_samples, neighbour_index=None, upsampling='neighbours'
+):
+    """
+    Prices a query from quantile sketches (see sketch.build_sketches)
+    instead of the bootstrap KDE. The neighbourhood is found as in 
+    upsample_data, but its sketches are merged rather than its price
+    lists concatenated, so no sample arrays are read.
+    
+    Returns
+    -------
+    price_range : tuple
+        As from calculate_property_prices (or None if no 
+        neighbourhood with sufficient data could be found).
+    """
+    if neighbour_index is None:
+        neighbour_index = get_neighbour_index(data)
+    
+    with span('upsampling'):
+        neighbourhood = neighbour_index.find_neighbourhood(
+            postcode, property_type, pricing_type, needed_samples,
+            upsampling=upsampling
+        )
+    if neighbourhood is None:
+        logger.info(
+            'Could not obtain a sufficient number of samples for %s'
+            ' - returning no estimate', postcode
+        )
+        return None
+    count('neighbours_added', len(neighbourhood) - 1)
+    
+    with span('quantile_extraction'):
+        digest = TDigest.merge(
+            sketches.get((x, property_type, pricing_type)) 
+            for x in neighbourhood
+        )
+        if digest is None:
+            return None
+        count('samples', digest.count)
+        return sketch_price_range(digest, threshold)
+
+
+def get_needed_samples(threshold : float) -> int:
+    # heuristic based on having a quarter
+    # of a standard deviation of error in an unobserved 
+    # normal distribution at a given threshold
+    return int(np.ceil(16 * 4 * (stats.norm.ppf(1 - threshold)**2)))
+
+
+def calculate_property_prices_batch(
+    data, queries, bandwidth_method='grid_search', executor='serial', 
+    n_workers=None, random_state=None, bootstrap_engine='replicas', 
+    neighbour_index=None, upsampling='neighbours', errors=None
+):
+    """
+    Prices many queries at once. Queries are grouped by the sample 
+    set they resolve to (the same postcode at different confidences,
+    or neighbouring postcodes upsampled into the same pool), and the
+    bootstrap KDEs of each group are fitted once with every requested
+    threshold extracted from the same fitted densities.
+    
+    Parameters
+    ----------
+    data : dict
+        The full property sales data json
+    queries : list
+        Dicts holding the postcode, pricing_type, property_type and 
+        confidence of every query
+    bandwidth_method, executor, n_workers, random_state, 
+    bootstrap_engine, neighbour_index, upsampling
+        As in calculate_property_prices. Every group is seeded from
+        random_state and pooled in the order of its first query, so
+        that query matches pricing it on its own (the rest of its 
+        group share the same fitted densities).
+    errors : dict
+        Optional dict filled with the error of every query that
+        failed (e.g. an unknown postcode), by its index in queries.
+        A failed query is answered with None and never aborts the
+        rest of the batch.
+    
+    Returns
+    -------
+    results : list
+        The calculate_property_prices result of every query, in
+        order (None where no sufficient sample set could be found
+        or the query failed).
+    """
+    if errors is None:
+        errors = {}
+    if neighbour_index is None:
+        neighbour_index = get_neighbour_index(data)
+    
+    # Resolve every query to the postcodes its samples are pooled from
+    groups = {}
+    with span('upsampling'):
+        for i, query in enumerate(queries):
+            try:
+                threshold = (1-query['confidence'])/2
+                postcode = query['postcode']
+                property_type = query['property_type']
+                pricing_type = query['pricing_type']
+            
+                if postcode not in neighbour_index.ids:
+                    raise KeyError(postcode)
+            
+                neighbourhood = neighbour_index.find_neighbourhood(
+                    postcode, property_type, pricing_type, 
+                    get_needed_samples(threshold), upsampling=upsampling
+                )
+            except Exception as e:
+                errors[i] = repr(e)
+                continue
+            if neighbourhood is None:
+                continue
+        
+            key = (frozenset(neighbourhood), property_type, pricing_type)
+            group = groups.setdefault(key, {'postcodes' : neighbourhood, 'queries' : []})
+            group['queries'].append((i, threshold))
+    
+    results = [None] * len(queries)
+    for (_, property_type, pricing_type), group in groups.items():
+        samples = gather_samples(
+            data, group['postcodes'], property_type, pricing_type
+        )
+        if len(samples) == 0:
+            continue
+        count('samples', len(samples))
+        
+        thresholds = np.unique([x for _, x in group['queries']])
+        try:
+            price_ranges = get_price_ranges(
+                samples, thresholds,
+                bandwidth_method=bandwidth_method,
+                executor=executor,
+                n_workers=n_workers,
+                random_state=random_state,
+                bootstrap_engine=bootstrap_engine
+            )
+        except Exception as e:
+            # Only the queries sharing these samples fail
+            for i, _ in group['queries']:
+                errors[i] = repr(e)
+            continue
+        
+        for i, threshold in group['queries']:
+            price_range = price_ranges[np.searchsorted(thresholds, threshold)]
+            results[i] = price_range[:4] + (threshold,)
+    
+    return results
+
+
 
 
 
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import Iterable, List, Tuple
+from property_pricer.preprocessing import (
+    build_postcode_lookups, impute_postcodes_from_lookups,
+    append_time_information, calculate_adjustment_ratio,
+    apply_sold_price_adjustments
+)
+from property_pricer.transform import group_property_sales, get_sale_months
+
+
+def get_preprocessing_state(
+    price_adjustments_w_index : pd.DataFrame, all_info : pd.DataFrame
+) -> dict:
+    """
+    Records what an incremental update needs to know about a full
+    preprocessing run: the month range of the sales and the average
+    house price that adjusted prices are referenced to.
+
+    Parameters
+    ----------
+    price_adjustments_w_index : pd.DataFrame
+        The output of calculate_adjustment_ratio
+    all_info : pd.DataFrame
+        Contains all of the historical property information.
+
+    Returns
+    -------
+    state : dict
+        The first and reference (latest) sale months, and the
+        reference average price.
+    """
+    reference_month = all_info.sold_year_month.max()
+    reference_price = price_adjustments_w_index.loc[
+        price_adjustments_w_index.date == reference_month,
+        'adjusted_avg_price'
+    ].values[0]
+
+    return {
+        'first_month' : str(pd.Timestamp(all_info.sold_year_month.min()).date()),
+        'reference_month' : str(pd.Timestamp(reference_month).date()),
+        'reference_price' : float(reference_price)
+    }
+
+
+def state_price_adjustments(
+    price_adjustments : pd.DataFrame, state : dict
+) -> pd.DataFrame:
+    """
+    Recomputes the adjustment ratios a preprocessing state was
+    computed with (see calculate_adjustment_ratio) from the output of
+    ingest_price_adjustments.
+    """
+    month_range = pd.DataFrame({'sold_year_month' : pd.to_datetime(
+        [state['first_month'], state['reference_month']]
+    )})
+    return calculate_adjustment_ratio(price_adjustments, month_range)
+
+
+def save_preprocessing_state(filepath : str, state : dict) -> None:
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=4)
+
+
+def load_preprocessing_state(filepath : str) -> dict:
+    with open(filepath, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def hash_sales_file(filepath : str) -> str:
+    """
+    Hashes the contents of a sales file, so a file is recognised
+    however it is named or wherever it is copied to.
+    """
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def record_applied_files(state : dict, filepaths : Iterable[str]) -> dict:
+    """
+    Records sales files as applied in the preprocessing state (by
+    content hash, along with their file name).
+    """
+    applied = dict(state.get('applied_files', {}))
+    for filepath in filepaths:
+        applied[hash_sales_file(filepath)] = os.path.basename(filepath)
+    return {**state, 'applied_files' : applied}
+
+
+def unapplied_files(state : dict, filepaths : Iterable[str]) -> List[str]:
+    """
+    Returns the sales files whose contents are not yet applied
+    according to the preprocessing state (keeping the first of any
+    duplicates among filepaths).
+    """
+    seen = set(state.get('applied_files', {}))
+    new_files = []
+    for filepath in filepaths:
+        digest = hash_sales_file(filepath)
+        if digest not in seen:
+            seen.add(digest)
+            new_files.append(filepath)
+    return new_files
+
+
+def impute_new_postcodes(
+    new_sales : pd.DataFrame, history : pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Imputes missing postcodes for new sales only, matching against
+    the full history plus the new sales with known postcodes.
+
+    Parameters
+    ----------
+    new_sales : pd.DataFrame
+        The newly ingested property sales
+    history : pd.DataFrame
+        Previously imputed sales, only the road_name, town, city,
+        region and postcode columns are needed.
+
+    Returns
+    -------
+    new_sales : pd.DataFrame
+        The new sales with missing postcodes imputed where possible
+        (and dropped otherwise).
+    """
+    no_postcodes = new_sales.loc[new_sales.postcode.isna()].copy()
+    entries_w_postcodes = new_sales.loc[new_sales.postcode.notna()]
+
+    match_columns = ['road_name', 'town', 'city', 'region', 'postcode']
+    candidates = pd.concat([
+        history[match_columns], entries_w_postcodes[match_columns]
+    ], axis=0)
+    candidates = candidates.loc[
+        candidates.postcode.notna() &
+        candidates.region.isin(no_postcodes.region.unique())
+    ]
+
+    no_postcodes.loc[:,'postcode'] = impute_postcodes_from_lookups(
+        no_postcodes, build_postcode_lookups(candidates)
+    )
+
+    return pd.concat([
+        entries_w_postcodes,
+        no_postcodes.loc[no_postcodes.postcode.notna()]
+    ], axis=0)
+
+
+def rebase_adjusted_prices(postcode_info : dict, scale : float) -> None:
+    """
+    Re-references every adjusted price in place with a single
+    multiply. When the reference month moves, the adjustment ratio
+    of every month is divided by new/old reference price, so each
+    adjusted price is multiplied by the same factor.
+    """
+    for entry in postcode_info.values():
+        for key, value in entry.items():
+            if isinstance(value, dict) and 'adjusted' in value:
+                value['adjusted'] = (
+                    np.asarray(value['adjusted'], dtype=float) * scale
+                ).tolist()
+
+
+def sort_by_sale_month(cell : dict) -> None:
+    """
+    Restores the sale month order of a (postcode, property type)
+    cell in place, after late registered sales were appended.
+    """
+    months = np.asarray(cell['months'])
+    if np.all(months[1:] >= months[:-1]):
+        return
+
+    order = np.argsort(months, kind='stable')
+    for key in ['adjusted', 'unadjusted', 'months']:
+        cell[key] = np.asarray(cell[key])[order].tolist()
+
+
+def update_property_info(
+    postcode_info : dict, state : dict, new_sales : pd.DataFrame,
+    history : pd.DataFrame, price_adjustments : pd.DataFrame
+) -> Tuple[dict, dict, pd.DataFrame, set]:
+    """
+    Incrementally adds newly ingested sales to existing property
+    information, without reprocessing any historical sales.
+
+    Parameters
+    ----------
+    postcode_info : dict
+        The existing output of convert_property_info_to_json (updated
+        in place)
+    state : dict
+        The preprocessing state of postcode_info
+    new_sales : pd.DataFrame
+        The newly ingested, raw property sales
+    history : pd.DataFrame
+        Previously imputed sales, used to match missing postcodes
+    price_adjustments : pd.DataFrame
+        The output of ingest_price_adjustments, which must cover the
+        newest sale month
+
+    Returns
+    -------
+    postcode_info : dict
+        The updated property information
+    state : dict
+        The updated preprocessing state
+    new_sales_imputed : pd.DataFrame
+        The new sales after postcode imputation, to be appended to
+        the imputed history
+    affected_postcodes : set
+        The postcodes that received new sales
+    """
+    new_sales_imputed = impute_new_postcodes(new_sales, history)
+    new_sales_w_time = append_time_information(new_sales_imputed.copy())
+
+    # Move the reference month forward if the new sales are newer
+    first_month = pd.Timestamp(state['first_month'])
+    reference_month = max(
+        pd.Timestamp(state['reference_month']),
+        new_sales_w_time.sold_year_month.max()
+    )
+    month_range = pd.DataFrame({'sold_year_month' : [
+        min(first_month, new_sales_w_time.sold_year_month.min()),
+        reference_month
+    ]})
+    price_adjs = calculate_adjustment_ratio(price_adjustments, month_range)
+    new_state = get_preprocessing_state(price_adjs, month_range)
+
+    scale = new_state['reference_price'] / state['reference_price']
+    if scale != 1:
+        rebase_adjusted_prices(postcode_info, scale)
+
+    new_sales_adjusted = apply_sold_price_adjustments(
+        price_adjs, new_sales_w_time
+    )
+
+    # Append the new sales to the postcodes they fall in
+    sales, cells = group_property_sales(new_sales_adjusted)
+    adjusted_prices = sales.adjusted_sold_price.values
+    unadjusted_prices = sales.sold_price.values
+    sale_months = get_sale_months(sales)
+    n_sales = new_sales_adjusted.postcode_group.value_counts()
+
+    affected_postcodes = set()
+    for (postcode, prop_type), (start, end) in cells.items():
+        if postcode not in postcode_info:
+            continue
+        postcode_info[postcode][prop_type]['adjusted'] = (
+            list(postcode_info[postcode][prop_type]['adjusted']) +
+            adjusted_prices[start:end].tolist()
+        )
+        postcode_info[postcode][prop_type]['unadjusted'] = (
+            list(postcode_info[postcode][prop_type]['unadjusted']) +
+            unadjusted_prices[start:end].tolist()
+        )
+        if 'months' in postcode_info[postcode][prop_type]:
+            postcode_info[postcode][prop_type]['months'] = (
+                list(postcode_info[postcode][prop_type]['months']) +
+                sale_months[start:end].tolist()
+            )
+            sort_by_sale_month(postcode_info[postcode][prop_type])
+        affected_postcodes.add(postcode)
+
+    for postcode in affected_postcodes:
+        postcode_info[postcode]['n'] += int(n_sales.get(postcode, 0))
+
+    return postcode_info, new_state, new_sales_imputed, affected_postcodes
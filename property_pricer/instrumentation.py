@@ -0,0 +1,211 @@
+import bisect
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# The trace of the request running in the current context (thread,
+# task or copied context), None when tracing is disabled
+_CURRENT_TRACE = contextvars.ContextVar('property_pricer_trace', default=None)
+
+# Upper bounds (seconds) of the aggregate histogram buckets
+HISTOGRAM_BOUNDS = [
+    1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 0.01, 0.03, 0.1, 0.3, 1., 3., 10., 30.
+]
+
+
+class Trace:
+    """
+    Per-request record of the time spent in every named span and of
+    named counters (sample counts, neighbours visited, ...). Spans of
+    the same name are summed and spans may nest, so e.g. 'bootstrap'
+    includes the 'bandwidth_search' time inside it.
+
+    Parameters
+    ----------
+    name : str
+        Optional label of the request
+    """
+    def __init__(self, name : str = None):
+        self.name = name
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.total_seconds = 0.
+        self._lock = threading.Lock()
+
+    def add_time(self, name : str, seconds : float) -> None:
+        with self._lock:
+            self.seconds[name] += seconds
+            self.calls[name] += 1
+
+    def increment(self, name : str, value : int = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def breakdown(self) -> dict:
+        """
+        Returns the trace as a plain (JSON serialisable) dict.
+        """
+        with self._lock:
+            return {
+                'name' : self.name,
+                'total_seconds' : self.total_seconds,
+                'spans' : {
+                    name : {'seconds' : seconds, 'calls' : self.calls[name]}
+                    for name, seconds in self.seconds.items()
+                },
+                'counters' : dict(self.counters)
+            }
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace : Trace, name : str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name : str):
+    """
+    Times the enclosed block into the current trace. With no trace
+    active this returns a shared no-op context manager, so disabled
+    instrumentation costs a single context variable lookup.
+
+    Examples
+    --------
+    >>> with span('bandwidth_search'):
+    ...     bandwidth = select_bandwidth(price_data)
+    """
+    trace = _CURRENT_TRACE.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name)
+
+
+def count(name : str, value : int = 1) -> None:
+    """
+    Adds value to a counter of the current trace (if any).
+    """
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.increment(name, int(value))
+
+
+def current_trace() -> Trace:
+    """
+    Returns the trace of the current context (or None).
+    """
+    return _CURRENT_TRACE.get()
+
+
+@contextmanager
+def trace_request(name : str = None, recorder : 'TraceRecorder' = None):
+    """
+    Traces everything run inside the block as one request.
+
+    Parameters
+    ----------
+    name : str
+        Optional label of the request
+    recorder : TraceRecorder
+        If given, the finished trace is added to its histograms
+
+    Yields
+    ------
+    trace : Trace
+        The request's trace, whose breakdown() is complete once the
+        block exits.
+    """
+    trace = Trace(name)
+    token = _CURRENT_TRACE.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.total_seconds = time.perf_counter() - start
+        _CURRENT_TRACE.reset(token)
+        if recorder is not None:
+            recorder.record(trace.breakdown())
+
+
+class TraceRecorder:
+    """
+    Thread safe aggregate of many request traces: a histogram of the
+    time per request spent in every span (and in total), and the sum
+    of every counter.
+    """
+    def __init__(self, bounds : list = HISTOGRAM_BOUNDS):
+        self.bounds = list(bounds)
+        self.requests = 0
+        self._histograms = defaultdict(lambda: [0] * (len(self.bounds) + 1))
+        self._sums = defaultdict(float)
+        self._counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, breakdown : dict) -> None:
+        """
+        Adds the breakdown of one request (see Trace.breakdown), which
+        may come from another process.
+        """
+        timings = {'total' : breakdown['total_seconds']}
+        timings.update(
+            (name, span['seconds']) for name, span in breakdown['spans'].items()
+        )
+        with self._lock:
+            self.requests += 1
+            for name, seconds in timings.items():
+                self._histograms[name][bisect.bisect_left(self.bounds, seconds)] += 1
+                self._sums[name] += seconds
+            for name, value in breakdown['counters'].items():
+                self._counters[name] += value
+
+    def histograms(self) -> dict:
+        """
+        Returns the aggregate histograms and counters.
+
+        Returns
+        -------
+        histograms : dict
+            The number of requests, the bucket upper bounds, and per
+            span the bucket counts (the last bucket is unbounded), the
+            number of requests it ran in and its mean seconds, plus the
+            summed counters.
+        """
+        with self._lock:
+            return {
+                'requests' : self.requests,
+                'bounds' : self.bounds,
+                'spans' : {
+                    name : {
+                        'buckets' : list(buckets),
+                        'count' : sum(buckets),
+                        'mean_seconds' : self._sums[name] / max(sum(buckets), 1)
+                    }
+                    for name, buckets in self._histograms.items()
+                },
+                'counters' : dict(self._counters)
+            }
@@ -0,0 +1,448 @@
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, List
+from property_pricer.cache import data_fingerprints
+from property_pricer.columnar import load_property_data
+from property_pricer.curves import QUANTILE_CURVE_THRESHOLDS, curve_key
+from property_pricer.determine_price import (
+    calculate_property_prices_batch, get_needed_samples, get_price_ranges
+)
+from property_pricer.neighbours import (
+    PROPERTY_TYPES, PRICE_TYPES, gather_samples, get_neighbour_index
+)
+
+logger = logging.getLogger(__name__)
+
+# Property data loaded once per batch worker process
+_WORKER_DATA = None
+
+# The pricing options that change how a precomputed price is
+# estimated, and their defaults in calculate_property_prices(_batch)
+LOOKUP_OPTION_DEFAULTS = {
+    'bandwidth_method' : 'grid_search', 'bootstrap_engine' : 'replicas',
+    'upsampling' : 'neighbours'
+}
+
+
+def lookup_key(
+    postcode : str, pricing_type : str,
+    property_type : str, confidence : float
+) -> str:
+    """
+    Builds the lookup table key for a pricing query.
+    """
+    return f'{postcode}|{property_type}|{pricing_type}|{confidence:.4f}'
+
+
+def lookup_options(**pricing_kwargs) -> dict:
+    """
+    Returns every pricing option that changes a precomputed price,
+    filling in the defaults, so a lookup table can be matched against
+    the options of a query.
+    """
+    return {
+        name : pricing_kwargs.get(name, default)
+        for name, default in LOOKUP_OPTION_DEFAULTS.items()
+    }
+
+
+def _log_progress(done : int, total : int, what : str) -> None:
+    # Roughly every tenth of the postcodes, and the last
+    if done == total or done % max(1, total // 10) == 0:
+        logger.info('%s %d/%d postcodes', what, done, total)
+
+
+def _init_worker(data_path : str) -> None:
+    global _WORKER_DATA
+    _WORKER_DATA = load_property_data(data_path)
+
+
+def _price_postcode(
+    postcode : str, confidences : List[float], pricing_kwargs : dict
+) -> dict:
+    """
+    Prices every property type, price type and confidence level
+    for a single postcode, fitting the KDEs of each property and
+    price type once for all confidence levels. Queries that fail
+    are recorded as None along with their error, without failing
+    the other queries of the postcode.
+    """
+    results, errors = {}, {}
+    for property_type in PROPERTY_TYPES:
+        for pricing_type in PRICE_TYPES:
+            keys = [
+                lookup_key(postcode, pricing_type, property_type, confidence)
+                for confidence in confidences
+            ]
+            queries = [
+                {
+                    'postcode' : postcode, 'pricing_type' : pricing_type,
+                    'property_type' : property_type, 'confidence' : confidence
+                }
+                for confidence in confidences
+            ]
+            query_errors = {}
+            results.update(zip(keys, calculate_property_prices_batch(
+                _WORKER_DATA, queries, errors=query_errors, **pricing_kwargs
+            )))
+            errors.update((keys[i], e) for i, e in query_errors.items())
+
+    return {'postcode' : postcode, 'results' : results, 'errors' : errors}
+
+
+def _read_checkpoint(checkpoint_path : str, header : dict) -> dict:
+    """
+    Reads the postcodes completed by previous runs, ignoring a
+    partially written final line. Checkpoints whose header (data
+    fingerprint, pricing options and confidences) does not match
+    were priced from other data or options, so are discarded.
+    """
+    completed = {}
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return completed
+
+    with open(checkpoint_path, encoding='utf-8') as f:
+        try:
+            matches = json.loads(f.readline()).get('header') == header
+        except json.JSONDecodeError:
+            matches = False
+        if not matches:
+            logger.info(
+                'Discarding %s, it was priced from other data or options',
+                checkpoint_path
+            )
+            return None
+
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            completed[entry['postcode']] = entry
+
+    return completed
+
+
+def precompute_property_prices(
+    data_path : str, output_path : str,
+    confidences : Iterable[float] = (0.9, 0.95, 0.99),
+    checkpoint_path : str = None, n_workers : int = None,
+    postcodes : Iterable[str] = None, **pricing_kwargs
+) -> dict:
+    """
+    Runs calculate_property_prices_batch for every postcode, property
+    type, price type and confidence level across a process pool,
+    and writes the results to a compact lookup table.
+
+    Parameters
+    ----------
+    data_path : str
+        Path to the cleaned property information JSON or columnar
+        artifact (which workers memory-map instead of parsing)
+    output_path : str
+        Path the lookup table JSON is written to
+    confidences : Iterable[float]
+        The confidence levels to precompute
+    checkpoint_path : str
+        Optional JSON lines file recording every finished postcode,
+        rerunning with the same checkpoint resumes where it stopped
+        (if the data, options and confidences are unchanged, and
+        starts over otherwise).
+    n_workers : int
+        The number of worker processes (defaults to the number of CPUs)
+    postcodes : Iterable[str]
+        The postcodes to price (defaults to every postcode in the data)
+    pricing_kwargs : dict
+        Extra keyword arguments for calculate_property_prices_batch
+
+    Returns
+    -------
+    lookup : dict
+        The lookup table, as written to output_path.
+    """
+    confidences = [float(x) for x in confidences]
+    if postcodes is None:
+        postcodes = list(load_property_data(data_path).keys())
+
+    # Everything the prices depend on, recorded in the checkpoint
+    # and the lookup table
+    header = {
+        'fingerprints' : sorted(data_fingerprints(data_path)),
+        'options' : lookup_options(**pricing_kwargs),
+        'pricing_kwargs' : pricing_kwargs,
+        'confidences' : confidences
+    }
+    completed = _read_checkpoint(checkpoint_path, header)
+    if completed is None:
+        completed = {}
+        os.remove(checkpoint_path)
+    if checkpoint_path is not None and not os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'header' : header}) + '\n')
+
+    remaining = [x for x in postcodes if x not in completed]
+    logger.info(
+        'Pricing %d postcodes (%d already checkpointed)',
+        len(remaining), len(completed)
+    )
+
+    checkpoint = (
+        open(checkpoint_path, 'a', encoding='utf-8')
+        if checkpoint_path is not None else None
+    )
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_init_worker,
+            initargs=(data_path,)
+        ) as pool:
+            futures = {
+                pool.submit(
+                    _price_postcode, postcode, confidences, pricing_kwargs
+                ) : postcode
+                for postcode in remaining
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                _log_progress(done, len(futures), 'Priced')
+                try:
+                    entry = future.result()
+                except Exception:
+                    # A crashed worker only loses its own postcode,
+                    # which is retried on the next resume
+                    logger.exception(
+                        'Failed to price postcode %s', futures[future]
+                    )
+                    continue
+
+                completed[entry['postcode']] = entry
+                if checkpoint is not None:
+                    checkpoint.write(json.dumps(entry) + '\n')
+                    checkpoint.flush()
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+    lookup = {
+        **header,
+        'prices' : {},
+        'errors' : {}
+    }
+    for entry in completed.values():
+        lookup['prices'].update(entry['results'])
+        lookup['errors'].update(entry['errors'])
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(lookup, f, separators=(',', ':'))
+
+    return lookup
+
+
+def _curve_postcode(
+    postcode : str, thresholds : List[float], pricing_kwargs : dict
+) -> dict:
+    """
+    Builds the quantile curve of every property type and price type
+    for a single postcode: the mean bounds and their bootstrap spread
+    at every stored threshold. The samples of each curve are fixed
+    once, as the smallest neighbourhood that is large enough for the
+    smallest threshold it can reach, and every threshold is read off
+    the same bootstrap fit (thresholds needing more samples than the
+    whole neighbour graph holds are left empty).
+    """
+    pricing_kwargs = dict(pricing_kwargs)
+    upsampling = pricing_kwargs.pop('upsampling', 'neighbours')
+    neighbour_index = get_neighbour_index(_WORKER_DATA)
+
+    curves, errors = {}, {}
+    entry = _WORKER_DATA[postcode]
+    for property_type in PROPERTY_TYPES:
+        for pricing_type in PRICE_TYPES:
+            key = curve_key(postcode, pricing_type, property_type)
+            price_ranges, neighbourhood = [None] * len(thresholds), None
+            try:
+                # Thresholds are sorted, the smallest needs the most samples
+                for first, threshold in enumerate(thresholds):
+                    neighbourhood = neighbour_index.find_neighbourhood(
+                        postcode, property_type, pricing_type,
+                        get_needed_samples(threshold), upsampling=upsampling
+                    )
+                    if neighbourhood is not None:
+                        break
+                if neighbourhood is not None:
+                    samples = gather_samples(
+                        _WORKER_DATA, neighbourhood, property_type, pricing_type
+                    )
+                    price_ranges[first:] = get_price_ranges(
+                        samples, thresholds[first:], **pricing_kwargs
+                    )
+            except Exception as e:
+                errors[key] = repr(e)
+                continue
+
+            # Bound, bound, uncertainty, uncertainty columns
+            columns = [
+                [x[i] if x is not None else None for x in price_ranges]
+                for i in range(4)
+            ]
+            curves[key] = [len(entry[property_type][pricing_type])] + columns
+
+    return {'postcode' : postcode, 'curves' : curves, 'errors' : errors}
+
+
+def precompute_quantile_curves(
+    data_path : str, output_path : str,
+    thresholds : Iterable[float] = QUANTILE_CURVE_THRESHOLDS,
+    n_workers : int = None, postcodes : Iterable[str] = None,
+    bandwidth_method : str = 'silverman',
+    bootstrap_engine : str = 'vectorised', **pricing_kwargs
+) -> dict:
+    """
+    Stores a compact quantile function for every postcode, property
+    type and price type, so calculate_property_prices can answer any
+    confidence level without refitting (see
+    curves.interpolate_price_range).
+
+    Parameters
+    ----------
+    data_path : str
+        Path to the cleaned property information JSON or columnar
+        artifact
+    output_path : str
+        Path the quantile curves JSON is written to
+    thresholds : Iterable[float]
+        The two sided thresholds the curves are stored at
+    n_workers : int
+        The number of worker processes (defaults to the number of CPUs)
+    postcodes : Iterable[str]
+        The postcodes to build curves for (defaults to every postcode)
+    bandwidth_method : str
+        The KDE bandwidth selection strategy, the curves only answer
+        queries priced with the same strategy
+    bootstrap_engine : str
+        'replicas' or 'vectorised'
+    pricing_kwargs : dict
+        Extra keyword arguments for get_price_ranges (and upsampling)
+
+    Returns
+    -------
+    curves : dict
+        The quantile curves, as written to output_path.
+    """
+    thresholds = sorted(float(x) for x in thresholds)
+    if postcodes is None:
+        postcodes = list(load_property_data(data_path).keys())
+
+    pricing_kwargs = dict(
+        pricing_kwargs, bandwidth_method=bandwidth_method,
+        bootstrap_engine=bootstrap_engine
+    )
+    curves = {
+        'fingerprints' : sorted(data_fingerprints(data_path)),
+        'thresholds' : thresholds,
+        'options' : {
+            'bandwidth_method' : bandwidth_method,
+            'bootstrap_engine' : bootstrap_engine
+        },
+        'curves' : {},
+        'errors' : {}
+    }
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers, initializer=_init_worker,
+        initargs=(data_path,)
+    ) as pool:
+        futures = {
+            pool.submit(
+                _curve_postcode, postcode, thresholds, pricing_kwargs
+            ) : postcode
+            for postcode in postcodes
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            _log_progress(done, len(futures), 'Built the curves of')
+            try:
+                entry = future.result()
+            except Exception as e:
+                # A crashed worker only loses the curves of its postcode
+                logger.exception(
+                    'Failed to build the curves of postcode %s', futures[future]
+                )
+                curves['errors'][futures[future]] = repr(e)
+                continue
+
+            curves['curves'].update(entry['curves'])
+            curves['errors'].update(entry['errors'])
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(curves, f, separators=(',', ':'))
+
+    return curves
+
+
+def load_price_lookup(
+    lookup_path : str, data_path : str = None, options : dict = None
+) -> dict:
+    """
+    Loads a precomputed lookup table.
+
+    Parameters
+    ----------
+    lookup_path : str
+        Path to the lookup table JSON
+    data_path : str
+        If given, the table is only returned if it was computed
+        from the current version of this data file (or of the JSON
+        file a columnar artifact was converted from, or the columnar
+        artifact converted from a JSON file).
+    options : dict
+        If given, the table is only returned if it was computed with
+        these pricing options (see lookup_options).
+
+    Returns
+    -------
+    lookup : dict
+        The lookup table (or None if it is missing or stale).
+    """
+    if not os.path.exists(lookup_path):
+        return None
+
+    with open(lookup_path, encoding='utf-8') as f:
+        lookup = json.load(f)
+
+    # Tables saved without fingerprints can't be checked
+    if data_path is not None and not (
+        set(lookup.get('fingerprints', [])) & data_fingerprints(data_path)
+    ):
+        return None
+
+    # Tables from before the options were recorded can't be matched
+    if options is not None and lookup.get('options') != lookup_options(**options):
+        return None
+
+    return lookup
+
+
+def lookup_property_prices(
+    lookup : dict, postcode : str, pricing_type : str,
+    property_type : str, confidence : float
+) -> tuple:
+    """
+    Answers a pricing query from a precomputed lookup table.
+
+    Returns
+    -------
+    prices : tuple
+        The calculate_property_prices result (or None if there were
+        insufficient samples).
+
+    Raises
+    ------
+    KeyError
+        If the query was not precomputed.
+    """
+    if not any(abs(confidence - x) < 5e-5 for x in lookup.get('confidences', [])):
+        raise KeyError(confidence)
+    prices = lookup['prices'][
+        lookup_key(postcode, pricing_type, property_type, confidence)
+    ]
+    return tuple(prices) if prices is not None else None
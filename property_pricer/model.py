@@ -1,30 +1,299 @@
 from sklearn.neighbors import KernelDensity # non-parametric
 from sklearn.model_selection import GridSearchCV
 from sklearn.base import BaseEstimator
-from scipy import integrate
-from typing import Tuple
+from scipy import fft, integrate, optimize, special
+from typing import Callable, Tuple, Union
 import numpy as np
 import warnings
+from property_pricer.instrumentation import span
 
-def get_optimal_kde(
+def _linear_binning(
+    price_data : np.ndarray, n_bins : int
+) -> Tuple[np.ndarray, float, float]:
+    """
+    Linearly bins 1D data onto a regular grid that extends a
+    tenth of the data range beyond the extreme samples.
+    
+    Parameters
+    ----------
+    price_data : np.ndarray
+        The 1D data to be binned
+    n_bins : int
+        The number of grid points
+    
+    Returns
+    -------
+    counts : np.ndarray
+        The (fractional) number of samples assigned to each grid point.
+    grid_min : float
+        The location of the first grid point.
+    grid_spacing : float
+        The distance between neighbouring grid points.
+    """
+    data_min, data_max = price_data.min(), price_data.max()
+    data_range = max(data_max - data_min, np.finfo(float).eps)
+    grid_min = data_min - data_range / 10
+    grid_spacing = (data_range * 1.2) / (n_bins - 1)
+    
+    # Split each sample between its two nearest grid points
+    position = (price_data - grid_min) / grid_spacing
+    left = np.clip(np.floor(position).astype(int), 0, n_bins - 2)
+    right_share = position - left
+    counts = (
+        np.bincount(left, weights=1 - right_share, minlength=n_bins) +
+        np.bincount(left + 1, weights=right_share, minlength=n_bins)
+    )
+    
+    return counts, grid_min, grid_spacing
+
+
+def _robust_spread(price_data : np.ndarray) -> float:
+    """
+    Returns min(standard deviation, IQR / 1.34), falling back
+    to whichever is non-zero for heavily tied data.
+    """
+    std = np.std(price_data, ddof=1) if len(price_data) > 1 else 0.
+    iqr = np.subtract(*np.percentile(price_data, [75, 25])) / 1.34
+    spread = min(std, iqr) if iqr > 0 else std
+    
+    return spread if spread > 0 else 1e-3
+
+
+def silverman_bandwidth(price_data : np.ndarray, **kwargs) -> float:
+    """
+    Silverman's rule of thumb for a gaussian kernel.
+    
+    Parameters
+    ----------
+    price_data : np.array
+        Contains the min-max normalized price data to be interpolated
+    
+    Returns
+    -------
+    bandwidth : float
+        The selected kernel bandwidth.
+    """
+    return 0.9 * _robust_spread(price_data) * len(price_data) ** (-1 / 5)
+
+
+def scott_bandwidth(price_data : np.ndarray, **kwargs) -> float:
+    """
+    Scott's rule of thumb for a gaussian kernel.
+    
+    Parameters
+    ----------
+    price_data : np.array
+        Contains the min-max normalized price data to be interpolated
+    
+    Returns
+    -------
+    bandwidth : float
+        The selected kernel bandwidth.
+    """
+    std = np.std(price_data, ddof=1) if len(price_data) > 1 else 0.
+    std = std if std > 0 else _robust_spread(price_data)
+    
+    return 1.06 * std * len(price_data) ** (-1 / 5)
+
+
+def isj_bandwidth(
+    price_data : np.ndarray, n_bins : int = 2**10, **kwargs
+) -> float:
+    """
+    Improved Sheather-Jones bandwidth (Botev et al. 2010), found
+    as the fixed point of the plug-in equations using a discrete
+    cosine transform of the binned data.
+    
+    Parameters
+    ----------
+    price_data : np.array
+        Contains the min-max normalized price data to be interpolated
+    n_bins : int
+        The number of grid points used for the DCT.
+    
+    Returns
+    -------
+    bandwidth : float
+        The selected kernel bandwidth (Silverman's rule is used
+        if no fixed point exists).
+    """
+    n_unique = len(np.unique(price_data))
+    counts, _, grid_spacing = _linear_binning(price_data, n_bins)
+    grid_range = grid_spacing * (n_bins - 1)
+    
+    # DCT coefficients of the normalised histogram
+    coefficients = fft.dct(counts / counts.sum(), type=2)
+    i_squared = np.arange(1, n_bins, dtype=float) ** 2
+    a_squared = (coefficients[1:] / 2) ** 2
+    
+    def fixed_point(t):
+        order = 7
+        f = 2 * np.pi ** (2 * order) * np.sum(
+            i_squared ** order * a_squared * np.exp(-i_squared * np.pi**2 * t)
+        )
+        for s in range(order - 1, 1, -1):
+            k0 = np.prod(np.arange(1, 2 * s, 2)) / np.sqrt(2 * np.pi)
+            const = (1 + (1 / 2) ** (s + 1 / 2)) / 3
+            time = (2 * const * k0 / (n_unique * f)) ** (2 / (3 + 2 * s))
+            f = 2 * np.pi ** (2 * s) * np.sum(
+                i_squared ** s * a_squared * np.exp(-i_squared * np.pi**2 * time)
+            )
+        return t - (2 * n_unique * np.sqrt(np.pi) * f) ** (-2 / 5)
+    
+    try:
+        t_star = optimize.brentq(fixed_point, 0, 0.1)
+    except ValueError:
+        warnings.warn('No ISJ fixed point found, using Silverman\'s rule')
+        return silverman_bandwidth(price_data)
+    
+    return np.sqrt(t_star) * grid_range
+
+
+def _binned_cv_inputs(
+    price_data : np.ndarray, 
+    bandwidth_search_space : np.ndarray, 
+    n_bins : int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Bins the data and returns the counts, the default (or given) 
+    bandwidth search space and the grid lags.
+    """
+    if not isinstance(bandwidth_search_space, np.ndarray):
+        bandwidth_search_space = np.exp(np.linspace(-5,2,200))
+    
+    counts, _, grid_spacing = _linear_binning(price_data, n_bins)
+    lags = np.arange(n_bins) * grid_spacing
+    
+    return counts, bandwidth_search_space, lags
+
+
+def _gaussian(x : np.ndarray, bandwidth : np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * (x / bandwidth) ** 2) / (np.sqrt(2 * np.pi) * bandwidth)
+
+
+def lscv_bandwidth(
     price_data : np.ndarray, 
     bandwidth_search_space : np.ndarray = None,
-    cross_validation_folds : int = 5
-) -> BaseEstimator:
+    n_bins : int = 2**10, **kwargs
+) -> float:
     """
-    Computes the optimal KDE model for a given set of normalized 
-    1D data.
+    Binned least-squares (unbiased) cross validation. The pairwise
+    kernel sums are computed for every candidate bandwidth from a 
+    single FFT autocorrelation of the binned counts, so each 
+    candidate costs O(n_bins) rather than O(n^2).
     
     Parameters
     ----------
     price_data : np.array
         Contains the min-max normalized price data to be interpolated
+    bandwidth_search_space : np.ndarray
+        The candidate bandwidths
+    n_bins : int
+        The number of grid points the data is binned onto
     
     Returns
     -------
-    opt_model : BaseEstimator
-        The optimal kernel density estimator model for interpolating
-        the PDF.
+    bandwidth : float
+        The bandwidth minimising the LSCV score.
+    """
+    counts, bandwidths, lags = _binned_cv_inputs(
+        price_data, bandwidth_search_space, n_bins
+    )
+    n = counts.sum()
+    
+    # Number of sample pairs at each grid lag
+    autocorrelation = np.fft.irfft(
+        np.abs(np.fft.rfft(counts, 2 * n_bins)) ** 2, 2 * n_bins
+    )[:n_bins]
+    autocorrelation[1:] *= 2
+    
+    def pair_sum(kernel_bandwidths):
+        return _gaussian(lags, kernel_bandwidths[:, np.newaxis]) @ autocorrelation
+    
+    # Integrated squared density minus twice the leave-one-out fit
+    self_pairs = n * _gaussian(0., bandwidths)
+    scores = (
+        pair_sum(np.sqrt(2) * bandwidths) / n**2 - 
+        2 * (pair_sum(bandwidths) - self_pairs) / (n * (n - 1))
+    )
+    
+    return float(bandwidths[np.argmin(scores)])
+
+
+def mlcv_bandwidth(
+    price_data : np.ndarray, 
+    bandwidth_search_space : np.ndarray = None,
+    n_bins : int = 2**10, **kwargs
+) -> float:
+    """
+    Binned leave-one-out likelihood cross validation. The density 
+    at every grid point is computed for all candidate bandwidths 
+    with a batched FFT convolution of the binned counts.
+    
+    Parameters
+    ----------
+    price_data : np.array
+        Contains the min-max normalized price data to be interpolated
+    bandwidth_search_space : np.ndarray
+        The candidate bandwidths
+    n_bins : int
+        The number of grid points the data is binned onto
+    
+    Returns
+    -------
+    bandwidth : float
+        The bandwidth maximising the leave-one-out log likelihood.
+    """
+    counts, bandwidths, lags = _binned_cv_inputs(
+        price_data, bandwidth_search_space, n_bins
+    )
+    n = counts.sum()
+    
+    # Symmetric kernels laid out for a circular convolution
+    kernels = np.zeros((len(bandwidths), 2 * n_bins))
+    kernels[:, :n_bins] = _gaussian(lags, bandwidths[:, np.newaxis])
+    kernels[:, -n_bins + 1:] = kernels[:, n_bins - 1:0:-1]
+    
+    kernel_sums = np.fft.irfft(
+        np.fft.rfft(kernels, axis=1) * np.fft.rfft(counts, 2 * n_bins),
+        2 * n_bins, axis=1
+    )[:, :n_bins]
+    
+    # Remove each sample's own kernel from its density
+    leave_one_out = (
+        kernel_sums - _gaussian(0., bandwidths)[:, np.newaxis]
+    ) / (n - 1)
+    occupied = counts > 0
+    scores = (
+        np.log(np.maximum(leave_one_out[:, occupied], 1e-300)) @ 
+        counts[occupied]
+    )
+    
+    return float(bandwidths[np.argmax(scores)])
+
+
+def grid_search_bandwidth(
+    price_data : np.ndarray, 
+    bandwidth_search_space : np.ndarray = None,
+    cross_validation_folds : int = 5, **kwargs
+) -> float:
+    """
+    Reference bandwidth selector: sklearn grid search over the 
+    held-out log likelihood.
+    
+    Parameters
+    ----------
+    price_data : np.array
+        Contains the min-max normalized price data to be interpolated
+    bandwidth_search_space : np.ndarray
+        The candidate bandwidths
+    cross_validation_folds : int
+        The number of cross validation folds
+    
+    Returns
+    -------
+    bandwidth : float
+        The bandwidth with the best held-out log likelihood.
     """
     if not isinstance(bandwidth_search_space, np.ndarray):
         bandwidth_search_space = np.exp(np.linspace(-5,2,30))
@@ -37,17 +306,504 @@ def get_optimal_kde(
     ) 
     grid.fit(price_data.reshape(-1,1))
     
+    return float(grid.best_params_['bandwidth'])
+
+
+BANDWIDTH_SELECTORS = {
+    'grid_search' : grid_search_bandwidth,
+    'lscv' : lscv_bandwidth,
+    'mlcv' : mlcv_bandwidth,
+    'isj' : isj_bandwidth,
+    'silverman' : silverman_bandwidth,
+    'scott' : scott_bandwidth,
+}
+
+
+def select_bandwidth(
+    price_data : np.ndarray, 
+    bandwidth_method : Union[str, Callable] = 'grid_search',
+    **kwargs
+) -> float:
+    """
+    Selects a gaussian kernel bandwidth for 1D data.
+    
+    Parameters
+    ----------
+    price_data : np.array
+        Contains the min-max normalized price data to be interpolated
+    bandwidth_method : str or callable
+        One of the keys of BANDWIDTH_SELECTORS, or any callable 
+        mapping the data (and keyword arguments) to a bandwidth.
+    
+    Returns
+    -------
+    bandwidth : float
+        The selected kernel bandwidth.
+    """
+    if callable(bandwidth_method):
+        return float(bandwidth_method(price_data, **kwargs))
+    
+    if bandwidth_method not in BANDWIDTH_SELECTORS:
+        raise ValueError(
+            f'Unknown bandwidth method: {bandwidth_method}, choose '
+            f'from {list(BANDWIDTH_SELECTORS)}'
+        )
+    
+    return float(BANDWIDTH_SELECTORS[bandwidth_method](price_data, **kwargs))
+
+
+def select_bandwidths(
+    price_samples : np.ndarray, 
+    bandwidth_method : Union[str, Callable] = 'grid_search',
+    **kwargs
+) -> np.ndarray:
+    """
+    Selects a bandwidth for every row of a batch of 1D samples. The
+    rules of thumb are evaluated for the whole batch at once, other
+    strategies are applied row by row.
+    
+    Parameters
+    ----------
+    price_samples : np.ndarray
+        Min-max normalized samples, shape (n_batches, n_samples)
+    bandwidth_method : str or callable
+        The bandwidth selection strategy, see select_bandwidth.
+    
+    Returns
+    -------
+    bandwidths : np.ndarray
+        The selected kernel bandwidth of each row, shape (n_batches,)
+    """
+    n = price_samples.shape[1]
+    if bandwidth_method in {'silverman', 'scott'} and n > 1:
+        std = np.std(price_samples, axis=1, ddof=1)
+        if bandwidth_method == 'scott':
+            spread = std
+            factor = 1.06
+        else:
+            quartiles = np.percentile(price_samples, [75, 25], axis=1)
+            iqr = (quartiles[0] - quartiles[1]) / 1.34
+            spread = np.where(iqr > 0, np.minimum(std, iqr), std)
+            factor = 0.9
+        spread = np.where(spread > 0, spread, 1e-3)
+        return factor * spread * n ** (-1 / 5)
+    
+    return np.array([
+        select_bandwidth(sample, bandwidth_method, **kwargs) 
+        for sample in price_samples
+    ])
+
+
+def weight_bandwidths(
+    bandwidths : np.ndarray, weights : np.ndarray
+) -> np.ndarray:
+    """
+    Widens bandwidths selected from unweighted samples for the smaller
+    effective sample size of weighted ones. The bandwidth scales as 
+    n^(-1/5), with n replaced by Kish's effective sample size 
+    (sum w)^2 / sum w^2 along the last axis of the weights.
+    """
+    weights = np.asarray(weights, dtype=float)
+    n_effective = weights.sum(axis=-1)**2 / (weights**2).sum(axis=-1)
+    return bandwidths * (weights.shape[-1] / n_effective) ** (1 / 5)
+
+
+def batch_kde_critical_values(
+    price_samples : np.ndarray, bandwidths : np.ndarray,
+    thresholds : np.ndarray = 0.05, n_grid : int = 2048,
+    weights : np.ndarray = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the two sided critical values of a batch of gaussian 
+    KDEs at once. Every row is binned onto its own grid, spanning its
+    samples and the tails of its kernel, its density is evaluated
+    with a batched FFT convolution and the quantiles are read off the
+    cumulative densities.
+    
+    Parameters
+    ----------
+    price_samples : np.ndarray
+        Min-max normalized samples, shape (n_batches, n_samples)
+    bandwidths : np.ndarray
+        The kernel bandwidth of each row, shape (n_batches,)
+    thresholds : np.ndarray
+        The critical value thresholds to determine, NOTE: both the 
+        threshold and 1-threshold are determined.
+    n_grid : int
+        The number of points in each row's grid, the critical values
+        are accurate to roughly one grid spacing.
+    weights : np.ndarray
+        Optional kernel weights, shape (n_batches, n_samples)
+    
+    Returns
+    -------
+    lower_bounds : np.ndarray
+        The lower critical values, shape (n_batches, n_thresholds)
+    upper_bounds : np.ndarray
+        The upper critical values, shape (n_batches, n_thresholds)
+    """
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+    probabilities = np.concatenate([thresholds, 1 - thresholds])
+    n_batches = price_samples.shape[0]
+    
+    with span('density_evaluation'):
+        # Per row grids covering the data and the tails of its kernel,
+        # so one wide kernel never coarsens the grids of the others
+        padding = 6 * bandwidths
+        grid_start = price_samples.min(axis=1) - padding
+        grid_spacing = (
+            price_samples.max(axis=1) + padding - grid_start
+        ) / (n_grid - 1)
+    
+        # Batched linear binning, offsetting each row into its own block
+        position = (
+            (price_samples - grid_start[:, np.newaxis]) / 
+            grid_spacing[:, np.newaxis]
+        )
+        left = np.clip(np.floor(position).astype(int), 0, n_grid - 2)
+        right_share = position - left
+        if weights is None:
+            weights = np.ones_like(price_samples)
+        offsets = (np.arange(n_batches) * n_grid)[:, np.newaxis]
+        counts = (
+            np.bincount(
+                (left + offsets).ravel(), 
+                weights=((1 - right_share) * weights).ravel(), 
+                minlength=n_batches * n_grid
+            ) +
+            np.bincount(
+                (left + 1 + offsets).ravel(), 
+                weights=(right_share * weights).ravel(), 
+                minlength=n_batches * n_grid
+            )
+        ).reshape(n_batches, n_grid)
+    
+        # Per row kernels laid out for a circular convolution
+        lags = np.arange(n_grid) * grid_spacing[:, np.newaxis]
+        kernels = np.zeros((n_batches, 2 * n_grid))
+        kernels[:, :n_grid] = _gaussian(lags, bandwidths[:, np.newaxis])
+        kernels[:, -n_grid + 1:] = kernels[:, n_grid - 1:0:-1]
+    
+        densities = np.fft.irfft(
+            np.fft.rfft(kernels, axis=1) * np.fft.rfft(counts, 2 * n_grid, axis=1),
+            2 * n_grid, axis=1
+        )[:, :n_grid] / weights.sum(axis=1, keepdims=True)
+        densities = np.maximum(densities, 0)
+    
+    with span('quantile_extraction'):
+        # Normalised per row, so the grid spacing cancels
+        cdf = integrate.cumulative_trapezoid(densities, initial=0)
+        cdf /= cdf[:, -1:]
+    
+        # Batched inverse interpolation of every row's CDF
+        upper_idx = np.clip(
+            (cdf[:, np.newaxis, :] < probabilities[:, np.newaxis]).sum(axis=-1),
+            1, n_grid - 1
+        )
+        cdf_upper = np.take_along_axis(cdf, upper_idx, axis=1)
+        cdf_lower = np.take_along_axis(cdf, upper_idx - 1, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(
+                cdf_upper > cdf_lower, 
+                (probabilities - cdf_lower) / (cdf_upper - cdf_lower), 0.5
+            )
+        quantiles = (
+            grid_start[:, np.newaxis] + 
+            (upper_idx - 1 + fraction) * grid_spacing[:, np.newaxis]
+        )
+    
+    lower_bounds, upper_bounds = np.split(quantiles, 2, axis=1)
+    
+    return lower_bounds, upper_bounds
+
+
+def get_optimal_kde(
+    price_data : np.ndarray, 
+    bandwidth_search_space : np.ndarray = None,
+    cross_validation_folds : int = 5,
+    bandwidth_method : Union[str, Callable] = 'grid_search',
+    sample_weight : np.ndarray = None
+) -> BaseEstimator:
+    """
+    Computes the optimal KDE model for a given set of normalized 
+    1D data.
+    
+    Parameters
+    ----------
+    price_data : np.array
+        Contains the min-max normalized price data to be interpolated
+    bandwidth_search_space : np.ndarray
+        The candidate bandwidths for the cross validated selectors
+    cross_validation_folds : int
+        The number of folds used by the 'grid_search' selector
+    bandwidth_method : str or callable
+        The bandwidth selection strategy, see select_bandwidth.
+    sample_weight : np.ndarray
+        Optional weight of every sample. The bandwidth is selected
+        from the unweighted data and widened for the effective
+        sample size (see weight_bandwidths).
+    
+    Returns
+    -------
+    opt_model : BaseEstimator
+        The optimal kernel density estimator model for interpolating
+        the PDF.
+    """
+    with span('bandwidth_search'):
+        bandwidth = select_bandwidth(
+            price_data, bandwidth_method, 
+            bandwidth_search_space=bandwidth_search_space,
+            cross_validation_folds=cross_validation_folds
+        )
+        if sample_weight is not None:
+            bandwidth = float(weight_bandwidths(bandwidth, sample_weight))
+    
     # Obtain optimal model
-    opt_model = grid.best_estimator_
+    with span('density_evaluation'):
+        opt_model = KernelDensity(kernel='gaussian', bandwidth=bandwidth)
+        opt_model.fit(price_data.reshape(-1,1), sample_weight=sample_weight)
     
     return opt_model
 
 
+def get_kde_components(
+    optimal_kde : BaseEstimator
+) -> Tuple[np.ndarray, float, np.ndarray]:
+    """
+    Extracts the mixture-of-normals parameters from a fitted
+    gaussian kernel density estimator.
+    
+    Parameters
+    ----------
+    optimal_kde : BaseEstimator
+        A fitted sklearn KernelDensity model with a gaussian kernel.
+    
+    Returns
+    -------
+    centres : np.ndarray
+        The kernel centres (i.e. the fitted samples).
+    bandwidth : float
+        The kernel standard deviation.
+    weights : np.ndarray
+        The kernel weights (or None if the samples are unweighted).
+    """
+    if optimal_kde.kernel != 'gaussian':
+        raise ValueError(
+            f'Only gaussian kernels are supported, got {optimal_kde.kernel}'
+        )
+    centres = np.asarray(optimal_kde.tree_.data).ravel()
+    bandwidth = float(getattr(optimal_kde, 'bandwidth_', optimal_kde.bandwidth))
+    weights = getattr(optimal_kde.tree_, 'sample_weight', None)
+    if weights is not None:
+        weights = np.asarray(weights)
+    
+    return centres, bandwidth, weights
+
+
+def gaussian_mixture_cdf(
+    x : np.ndarray, centres : np.ndarray, 
+    bandwidth : np.ndarray, weights : np.ndarray = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluates the CDF and PDF of a gaussian KDE analytically. All
+    leading dimensions are treated as a batch of independent KDEs.
+    
+    Parameters
+    ----------
+    x : np.ndarray
+        Points to evaluate, shape (..., k)
+    centres : np.ndarray
+        Kernel centres, shape (..., m)
+    bandwidth : np.ndarray
+        Kernel standard deviation, shape (...)
+    weights : np.ndarray
+        Optional kernel weights, shape (..., m)
+    
+    Returns
+    -------
+    cdf : np.ndarray
+        The cumulative probability at x, shape (..., k)
+    pdf : np.ndarray
+        The probability density at x, shape (..., k)
+    """
+    bandwidth = np.asarray(bandwidth, dtype=float)[..., np.newaxis, np.newaxis]
+    z = (x[..., :, np.newaxis] - centres[..., np.newaxis, :]) / bandwidth
+    
+    kernel_cdf = special.ndtr(z)
+    kernel_pdf = np.exp(-0.5 * z**2) / (np.sqrt(2 * np.pi) * bandwidth)
+    
+    if weights is None:
+        return kernel_cdf.mean(axis=-1), kernel_pdf.mean(axis=-1)
+    
+    weights = weights / weights.sum(axis=-1, keepdims=True)
+    weights = weights[..., np.newaxis, :]
+    return (kernel_cdf * weights).sum(axis=-1), (kernel_pdf * weights).sum(axis=-1)
+
+
+def gaussian_mixture_quantiles(
+    probabilities : np.ndarray, centres : np.ndarray, 
+    bandwidth : np.ndarray, weights : np.ndarray = None,
+    tolerance : float = 1e-10, max_iterations : int = 50
+) -> Tuple[np.ndarray, float]:
+    """
+    Inverts the analytic CDF of a gaussian KDE with a vectorised,
+    bracketed Newton root-find. All leading dimensions of the 
+    centres are treated as a batch of independent KDEs.
+    
+    Parameters
+    ----------
+    probabilities : np.ndarray
+        The cumulative probabilities to invert, shape (k,)
+    centres : np.ndarray
+        Kernel centres, shape (..., m)
+    bandwidth : np.ndarray
+        Kernel standard deviation, shape (...)
+    weights : np.ndarray
+        Optional kernel weights, shape (..., m)
+    tolerance : float
+        Absolute tolerance on the CDF residual at which to stop.
+    max_iterations : int
+        The maximum number of Newton/bisection steps.
+    
+    Returns
+    -------
+    quantiles : np.ndarray
+        The values x with CDF(x) = p, shape (..., k)
+    precision : float
+        The largest absolute CDF residual achieved.
+    """
+    probabilities = np.asarray(probabilities, dtype=float)
+    centres = np.asarray(centres, dtype=float)
+    bandwidth = np.asarray(bandwidth, dtype=float)
+    batch_shape = centres.shape[:-1]
+    
+    # The quantiles of the mixture are always bracketed by the 
+    # extreme kernels' quantiles
+    z_max = special.ndtri(np.clip(
+        np.maximum(probabilities, 1 - probabilities), 0.5, 1 - 1e-16
+    )).max()
+    spread = (z_max + 1) * bandwidth[..., np.newaxis]
+    lower = np.broadcast_to(
+        centres.min(axis=-1, keepdims=True) - spread, 
+        batch_shape + probabilities.shape
+    ).copy()
+    upper = np.broadcast_to(
+        centres.max(axis=-1, keepdims=True) + spread, 
+        batch_shape + probabilities.shape
+    ).copy()
+    
+    # Start from the empirical quantiles, which are close to 
+    # the KDE quantiles for any sensible bandwidth
+    if weights is None:
+        x = np.quantile(centres, probabilities, axis=-1)
+        x = np.moveaxis(x, 0, -1)
+    else:
+        x = (lower + upper) / 2
+    
+    residual = np.full_like(x, np.inf)
+    for _ in range(max_iterations):
+        cdf, pdf = gaussian_mixture_cdf(x, centres, bandwidth, weights)
+        residual = cdf - probabilities
+        if np.all(np.abs(residual) <= tolerance):
+            break
+        
+        # Tighten the bracket around the root
+        lower = np.where(residual < 0, x, lower)
+        upper = np.where(residual > 0, x, upper)
+        
+        # Newton step, falling back to bisection when the step
+        # leaves the bracket
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_newton = x - residual / pdf
+        x = np.where(
+            (x_newton > lower) & (x_newton < upper),
+            x_newton, (lower + upper) / 2
+        )
+    
+    return x, float(np.abs(residual).max())
+
+
+def calculate_critical_values(
+    optimal_kde : BaseEstimator,
+    thresholds : np.ndarray = 0.05,
+    method : str = 'analytic',
+    n_samples : int = 1000,
+    tolerance : float = 1e-10
+) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    Computes the two sided critical values of a gaussian KDE for 
+    any number of thresholds in a single call.
+    
+    Parameters
+    ----------
+    optimal_kde : BaseEstimator
+        The optimal kernel density estimator model for interpolating
+        the PDF.
+    thresholds : np.ndarray
+        The critical value thresholds to determine, NOTE: both the 
+        threshold and 1-threshold are determined.
+    method : str
+        'analytic' inverts the mixture-of-normals CDF directly, 
+        'cumulative' integrates the density once on a grid of 
+        n_samples points and interpolates.
+    n_samples : int
+        The grid size used by the 'cumulative' method.
+    tolerance : float
+        The CDF residual at which the 'analytic' root-find stops.
+    
+    Returns
+    -------
+    lower_bounds : np.ndarray
+        The lower critical values (normalised), one per threshold.
+    upper_bounds : np.ndarray
+        The upper critical values (normalised), one per threshold.
+    precision : float
+        The largest absolute error in cumulative probability of the
+        returned critical values.
+    """
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+    probabilities = np.concatenate([thresholds, 1 - thresholds])
+    centres, bandwidth, weights = get_kde_components(optimal_kde)
+    
+    if method == 'analytic':
+        quantiles, precision = gaussian_mixture_quantiles(
+            probabilities, centres, bandwidth, weights, 
+            tolerance=tolerance
+        )
+    
+    elif method == 'cumulative':
+        # Cover the support of every kernel, so no mass is lost
+        x_pdf_sample = np.linspace(
+            centres.min() - 8 * bandwidth, 
+            centres.max() + 8 * bandwidth,
+            num = n_samples
+        )
+        prob_densities = np.exp(
+            optimal_kde.score_samples(x_pdf_sample[:,np.newaxis])
+        )
+        cdf = integrate.cumulative_trapezoid(
+            prob_densities, x_pdf_sample, initial=0
+        )
+        quantiles = np.interp(probabilities, cdf, x_pdf_sample)
+        
+        # Discretisation error shows up as missing/excess mass
+        precision = float(abs(1 - cdf[-1]))
+    
+    else:
+        raise ValueError(f'Unknown critical value method: {method}')
+    
+    lower_bounds, upper_bounds = np.split(quantiles, 2)
+    
+    return lower_bounds, upper_bounds, precision
+
+
 def calculate_critical_value(
     optimal_kde : BaseEstimator, 
     threshold: float =0.05, 
-    n_samples : int = 1000
-) -> Tuple[float, float]:
+    n_samples : int = 1000,
+    method : str = 'analytic',
+    max_precision : float = 1e-4
+) -> Tuple[float, float, float]:
     """
     Computes the critical values from a KDE estimate of 
     an unobserved pdf (2 sided).
@@ -61,8 +817,13 @@ def calculate_critical_value(
         Specifies the critical value threshold to determine,
         NOTE: both the threshold and 1-threshold are determined
     n_samples : int
-        The number of samples to take in the x direction (this
-        is the sames as the discretization of the integration).
+        The number of samples to take in the x direction when 
+        using the 'cumulative' method.
+    method : str
+        The quantile engine to use, see calculate_critical_values.
+    max_precision : float
+        A warning is raised if the critical values can only be
+        located to a worse precision than this.
     
     Returns
     -------
@@ -71,48 +832,15 @@ def calculate_critical_value(
     lower_bound : float
         The upper bounded critical value of the pdf (normalised).
     threshold : float
-        The true threshold used in the calculation (will be different
-        from input if numerical precision is exceeded).
+        The threshold used in the calculation.
     """
-    # sample pdf at linear intervals along x axis
-    x_pdf_sample = np.linspace(0,1,num = n_samples)
-    
-    # Invert log likelihood to get probability estimate
-    prob_densities = np.exp(
-        optimal_kde.score_samples(x_pdf_sample[:,np.newaxis])
+    lower_bounds, upper_bounds, precision = calculate_critical_values(
+        optimal_kde, threshold, method=method, n_samples=n_samples
     )
-
-
-    def find_nearest(array, value):
-        array = np.asarray(array)
-        idx = (np.abs(array - value)).argmin()
-        return idx
-    
-    # Store discretised CDF to find critical values 
-    pdf = []
-    
-    # This is not efficient, but good enough for now
-    for i in range(1,len(prob_densities)):
-        pdf.append(
-            integrate.simpson(
-                prob_densities[:i], 
-                dx=1 / (len(prob_densities)-1)
-            )
-        )
     
-    if threshold < (1-pdf[-1]):
+    if precision > max_precision:
         warnings.warn(
-            f'Threshold exceeds integration precision, setting to maximum ({pdf[-1]})'
+            f'Critical values only located to a precision of {precision:.2g}'
         )
-        threshold = 1-pdf[-1]
-    
-    lower_bound_idx, upper_bound_idx = (
-        find_nearest(pdf,threshold), 
-        find_nearest(pdf, 1- threshold)
-    )
-    lower_bound, upper_bound = (
-        x_pdf_sample[lower_bound_idx], 
-        x_pdf_sample[upper_bound_idx]
-    )
     
-    return lower_bound, upper_bound, threshold
\ No newline at end of file
+    return float(lower_bounds[0]), float(upper_bounds[0]), threshold
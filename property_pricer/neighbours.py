@@ -0,0 +1,274 @@
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+from typing import Callable, List, Mapping
+from property_pricer.instrumentation import count
+
+PROPERTY_TYPES = ['D', 'S', 'T', 'F', 'O']
+PRICE_TYPES = ['adjusted', 'unadjusted']
+UPSAMPLING_METHODS = ['neighbours', 'nearest']
+
+
+def centroid_vectors(centroids : np.ndarray) -> np.ndarray:
+    """
+    Converts (latitude, longitude) centroids in degrees to points on
+    the unit sphere, whose straight line distances order postcodes
+    the same as their great circle distances.
+    """
+    latitude, longitude = np.radians(np.asarray(centroids, dtype=float)).T
+    return np.stack([
+        np.cos(latitude) * np.cos(longitude),
+        np.cos(latitude) * np.sin(longitude),
+        np.sin(latitude)
+    ], axis=1)
+
+
+class NeighbourIndex:
+    """
+    Precomputed adjacency structure over the postcode 'Neighbours'
+    sets, with the number of samples held by every (postcode,
+    property type, price type), so neighbourhoods can be planned
+    without touching any sample arrays. The latest sale month of the
+    data (if it records sale months) is kept as the reference point
+    of time windows, and the postcode centroids (if recorded) back a
+    KD-tree for nearest postcode queries.
+
+    Parameters
+    ----------
+    data : Mapping
+        The property sales data, keyed by postcode
+    """
+    def __init__(self, data : Mapping):
+        self.postcodes = list(data.keys())
+        self.ids = {postcode : i for i, postcode in enumerate(self.postcodes)}
+
+        # Neighbours missing from the data are dropped, and the rest
+        # sorted so expansion order is deterministic
+        self.adjacency = [
+            np.array(sorted(
+                self.ids[x] for x in set(data[postcode]['Neighbours'])
+                if x in self.ids and x != postcode
+            ), dtype=np.int64)
+            for postcode in self.postcodes
+        ]
+
+        self.counts = np.array([
+            [
+                [len(data[postcode][prop_type][price_type]) for price_type in PRICE_TYPES]
+                for prop_type in PROPERTY_TYPES
+            ]
+            for postcode in self.postcodes
+        ], dtype=np.int64).reshape(-1, len(PROPERTY_TYPES), len(PRICE_TYPES))
+
+        # Months are sorted within every cell, so the last is the latest
+        last_months = [
+            data[postcode][prop_type]['months'][-1]
+            for postcode in self.postcodes for prop_type in PROPERTY_TYPES
+            if len(data[postcode][prop_type].get('months', []))
+        ]
+        self.latest_month = int(max(last_months)) if last_months else None
+
+        self._set_centroids(np.array([
+            data[postcode].get('Centroid') or (np.nan, np.nan)
+            for postcode in self.postcodes
+        ], dtype=float).reshape(-1, 2))
+
+    @classmethod
+    def from_arrays(
+        cls, postcodes : List[str], adjacency : List[np.ndarray],
+        counts : np.ndarray, latest_month : int = None,
+        centroids : np.ndarray = None
+    ) -> 'NeighbourIndex':
+        """
+        Builds an index from precomputed postcode ids, neighbour id
+        arrays, a (postcode, property type, price type) array of
+        sample counts, the latest sale month and a (postcode, 2) array
+        of centroids (NaN where unknown), if known.
+        """
+        index = cls.__new__(cls)
+        index.postcodes = list(postcodes)
+        index.ids = {postcode : i for i, postcode in enumerate(index.postcodes)}
+        index.adjacency = [np.asarray(x, dtype=np.int64) for x in adjacency]
+        index.counts = np.asarray(counts, dtype=np.int64)
+        index.latest_month = latest_month
+        index._set_centroids(
+            np.full((len(index.postcodes), 2), np.nan) if centroids is None
+            else np.asarray(centroids, dtype=float)
+        )
+        return index
+
+    def _set_centroids(self, centroids : np.ndarray) -> None:
+        self.centroids = centroids
+        self.located = ~np.isnan(centroids).any(axis=1)
+        self._tree = None
+        self._tree_lock = threading.Lock()
+
+    @property
+    def tree(self) -> cKDTree:
+        """
+        KD-tree over the centroids of the postcodes that have one,
+        built on first use (its points are numbered as
+        np.flatnonzero(self.located)).
+        """
+        with self._tree_lock:
+            if self._tree is None:
+                self._tree = cKDTree(centroid_vectors(self.centroids[self.located]))
+            return self._tree
+
+    def nearest_postcodes(self, postcode : str, k : int) -> List[str]:
+        """
+        Returns the (up to) k postcodes nearest to a postcode by
+        centroid distance, nearest first and starting with the
+        postcode itself.
+        """
+        ids = self._nearest_ids(self.ids[postcode], k)
+        return [self.postcodes[x] for x in ids]
+
+    def _nearest_ids(self, start : int, k : int) -> np.ndarray:
+        if not self.located[start]:
+            raise ValueError(f'{self.postcodes[start]} has no recorded centroid')
+        k = min(k, int(self.located.sum()))
+        _, points = self.tree.query(centroid_vectors(self.centroids[[start]])[0], k=k)
+        return np.flatnonzero(self.located)[np.atleast_1d(points)]
+
+    def sample_counts(self, property_type : str, price_type : str) -> np.ndarray:
+        """
+        Returns the number of samples in every postcode.
+        """
+        return self.counts[
+            :, PROPERTY_TYPES.index(property_type), PRICE_TYPES.index(price_type)
+        ]
+
+    def find_neighbourhood(
+        self, postcode : str, property_type : str,
+        price_type : str, needed_samples : int,
+        count_samples : Callable[[np.ndarray], np.ndarray] = None,
+        upsampling : str = 'neighbours'
+    ) -> List[str]:
+        """
+        Finds the smallest neighbourhood of a postcode holding at least
+        needed_samples samples. By default this is an iterative breadth
+        first expansion: postcodes are added one degree of separation at
+        a time, and within a degree the postcodes with the most samples
+        go first. Postcodes the neighbour graph cannot reach are then
+        added nearest first, if the postcode has a known centroid.
+
+        Parameters
+        ----------
+        postcode : str
+            The postcode being priced
+        property_type : str
+            The property type to be used in the sample collection
+        price_type : str
+            Whether to use 'adjusted' or 'unadjusted' prices
+        needed_samples : int
+            The lower bound on the number of samples needed for statistical
+            significance.
+        count_samples : Callable
+            Optionally maps an array of postcode ids to their number of
+            usable samples (e.g. those inside a time window), called
+            only for the postcodes the expansion reaches. Defaults to
+            the precomputed counts.
+        upsampling : str
+            'neighbours' to expand through the neighbour graph, or
+            'nearest' to add postcodes in order of centroid distance
+            only (the graph is used for postcodes without a centroid).
+
+        Returns
+        -------
+        neighbourhood : list
+            The postcodes whose samples should be pooled, starting with
+            the postcode itself (or None if no neighbourhood is large
+            enough).
+        """
+        if upsampling not in UPSAMPLING_METHODS:
+            raise ValueError(f'Unknown upsampling method {upsampling}')
+        if count_samples is None:
+            all_counts = self.sample_counts(property_type, price_type)
+            count_samples = lambda ids: all_counts[ids]
+        start = self.ids[postcode]
+        neighbourhood = [start]
+        total = int(count_samples(np.array([start]))[0])
+
+        visited = np.zeros(len(self.postcodes), dtype=bool)
+        visited[start] = True
+        frontier = np.array([start])
+        if upsampling == 'nearest' and self.located[start]:
+            frontier = frontier[:0]
+
+        while total < needed_samples and len(frontier):
+            # Every unvisited postcode one step further out
+            candidates = np.unique(np.concatenate(
+                [self.adjacency[x] for x in frontier]
+            )).astype(np.int64)
+            frontier = candidates[~visited[candidates]]
+            visited[frontier] = True
+
+            counts = np.asarray(count_samples(frontier))
+            for i in np.argsort(-counts, kind='stable'):
+                if total >= needed_samples or counts[i] == 0:
+                    break
+                neighbourhood.append(frontier[i])
+                total += counts[i]
+
+        # Then every other postcode nearest first, querying the tree
+        # for twice as many postcodes each time
+        k = 16
+        while total < needed_samples and self.located[start]:
+            nearest = self._nearest_ids(start, k)
+            candidates = nearest[~visited[nearest]]
+            visited[candidates] = True
+
+            counts = np.asarray(count_samples(candidates))
+            for i in np.flatnonzero(counts):
+                if total >= needed_samples:
+                    break
+                neighbourhood.append(candidates[i])
+                total += counts[i]
+
+            if len(nearest) < k:
+                break
+            k *= 2
+
+        count('neighbours_visited', visited.sum() - 1)
+        if total < needed_samples:
+            return None
+
+        return [self.postcodes[x] for x in neighbourhood]
+
+
+def gather_samples(
+    data : Mapping, postcodes : List[str],
+    property_type : str, price_type : str
+) -> np.ndarray:
+    """
+    Pools the samples of several postcodes into one array, copying
+    each sample exactly once.
+    """
+    return np.concatenate([
+        np.asarray(data[postcode][property_type][price_type], dtype=float)
+        for postcode in postcodes
+    ])
+
+
+# Single slot cache, so repeated queries against the same loaded
+# data reuse its index
+_INDEX_LOCK = threading.Lock()
+_CACHED_INDEX = (None, None)
+
+
+def get_neighbour_index(data : Mapping) -> NeighbourIndex:
+    """
+    Returns the NeighbourIndex of the data, building it on the first
+    call for a given data object.
+    """
+    global _CACHED_INDEX
+    with _INDEX_LOCK:
+        cached_data, index = _CACHED_INDEX
+        if cached_data is not data:
+            index = (
+                data.neighbour_index() if hasattr(data, 'neighbour_index')
+                else NeighbourIndex(data)
+            )
+            _CACHED_INDEX = (data, index)
+        return index
@@ -0,0 +1,280 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterator, List, Tuple
+from property_pricer.ingest import ingest_join_properties, PROPERTY_COLUMNS
+from property_pricer.preprocessing import (
+    POSTCODE_MATCH_FIELDS, select_modal_postcodes, impute_postcodes_from_lookups,
+    append_time_information, calculate_adjustment_ratio,
+    apply_sold_price_adjustments
+)
+from property_pricer.transform import iter_property_info
+from property_pricer.incremental import get_preprocessing_state
+from property_pricer.utils import save_json, iter_json
+
+# Columns kept for the price adjustment and JSON conversion stages
+CONVERSION_COLUMNS = [
+    'sold_price', 'sold_date', 'sold_year', 'sold_month', 'sold_year_month',
+    'postcode', 'postcode_group', 'property_type'
+]
+
+
+def shard_of(keys : pd.Series, n_shards : int) -> np.ndarray:
+    """
+    Assigns postcode groups to shards by hashing them. The hash is
+    stable across processes and runs (unlike the builtin hash), so
+    the sales and postcodes of a group always land in the same shard.
+    """
+    hashes = pd.util.hash_pandas_object(
+        pd.Series(np.asarray(keys, dtype=object)), index=False
+    ).values
+    return (hashes % np.uint64(n_shards)).astype(np.int64)
+
+
+def _shard_path(work_dir : str, shard : int) -> str:
+    return os.path.join(work_dir, f'shard_{shard:04d}')
+
+
+def _partition_file(
+    file : str, file_id : int, work_dir : str, n_shards : int
+) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    """
+    Reads one sales file, appends its time information and writes
+    its sales with postcodes to the shards of their postcode groups.
+    Sales with missing postcodes are set aside to be imputed once
+    every file has been partitioned. Returns the first and last sale
+    months of the partitioned sales.
+    """
+    sales = append_time_information(ingest_join_properties([file], n_workers=1))
+    known = sales.postcode.notna()
+    no_postcodes, sales = sales.loc[~known], sales.loc[known]
+
+    for shard, part in sales.groupby(shard_of(sales.postcode_group, n_shards)):
+        part.to_pickle(os.path.join(
+            _shard_path(work_dir, shard), f'part_{file_id:05d}.pkl'
+        ))
+    no_postcodes.to_pickle(os.path.join(
+        work_dir, 'missing', f'part_{file_id:05d}.pkl'
+    ))
+
+    return sales.sold_year_month.min(), sales.sold_year_month.max()
+
+
+def _read_shard(work_dir : str, shard : int) -> pd.DataFrame:
+    # File parts in file order, then the imputed sales, matching the
+    # row order of impute_postcodes
+    shard_dir = _shard_path(work_dir, shard)
+    parts = sorted(x for x in os.listdir(shard_dir) if x.startswith('part_'))
+    if os.path.exists(os.path.join(shard_dir, 'imputed.pkl')):
+        parts.append('imputed.pkl')
+    if len(parts) == 0:
+        return pd.DataFrame(
+            columns=list(dict.fromkeys(list(PROPERTY_COLUMNS) + CONVERSION_COLUMNS))
+        )
+    return pd.concat(
+        [pd.read_pickle(os.path.join(shard_dir, x)) for x in parts], axis=0
+    )
+
+
+def _count_postcode_matches(
+    shard : int, work_dir : str, road_names : np.ndarray, regions : np.ndarray
+) -> dict:
+    """
+    Finds the modal postcode (and its count) of every (road_name,
+    field) key of build_postcode_lookups within one shard, over the
+    sales in the regions with missing postcodes (as impute_postcodes
+    does). Only the road names of sales with missing postcodes can
+    ever be matched, so the sales on every other road are skipped.
+    """
+    sales = _read_shard(work_dir, shard)
+    sales = sales.loc[sales.road_name.isin(road_names) & sales.region.isin(regions)]
+    return {
+        field : select_modal_postcodes(
+            sales
+            .groupby(['road_name', field, 'postcode'], sort=False)
+            .size()
+            .rename('count')
+            .reset_index(),
+            field, keep_counts=True
+        )
+        for field in POSTCODE_MATCH_FIELDS
+    }
+
+
+def _convert_shard(
+    shard : int, postcodes : pd.DataFrame, work_dir : str,
+    price_adjustments : pd.DataFrame
+) -> int:
+    """
+    Adjusts the prices of one shard and streams its postcodes to a
+    JSON file (in the order of postcodes), along with its imputed
+    sales history.
+    """
+    sales = _read_shard(work_dir, shard)
+    shard_dir = _shard_path(work_dir, shard)
+    sales[list(PROPERTY_COLUMNS)].to_csv(os.path.join(shard_dir, 'history.csv'))
+
+    sales_adjusted = apply_sold_price_adjustments(
+        price_adjustments, sales[CONVERSION_COLUMNS]
+    )
+    save_json(
+        os.path.join(shard_dir, 'property_info.json'),
+        iter_property_info(postcodes, sales_adjusted)
+    )
+    return len(sales)
+
+
+def _merge_history(work_dir : str, n_shards : int, filepath : str) -> None:
+    # Concatenate the shard CSVs, keeping only the first header
+    with open(filepath, 'w', encoding='utf-8') as out:
+        for shard in range(n_shards):
+            with open(
+                os.path.join(_shard_path(work_dir, shard), 'history.csv'),
+                encoding='utf-8'
+            ) as f:
+                header = f.readline()
+                if shard == 0:
+                    out.write(header)
+                shutil.copyfileobj(f, out)
+
+
+def _merge_property_info(
+    work_dir : str, postcode_shards : np.ndarray, n_shards : int
+) -> Iterator[Tuple[str, dict]]:
+    # Every shard file holds its postcodes in the original order, so
+    # the next entry of a postcode's shard is always that postcode
+    shard_entries = [
+        iter_json(os.path.join(_shard_path(work_dir, shard), 'property_info.json'))
+        for shard in range(n_shards)
+    ]
+    for shard in postcode_shards:
+        yield next(shard_entries[shard])
+
+
+def preprocess_sharded(
+    sales_files : List[str], postcodes : pd.DataFrame,
+    price_adjustments : pd.DataFrame, work_dir : str,
+    n_shards : int = 16, n_workers : int = None, imputed_path : str = None
+) -> Tuple[Iterator[Tuple[str, dict]], dict]:
+    """
+    Runs the preprocessing pipeline (postcode imputation, time
+    information, price adjustment and JSON conversion) over sales
+    files hash partitioned by postcode group, with every file and
+    shard processed in a worker process so that no process holds
+    more than one file or shard of sales:
+        1. Each file is read, given its time information and split
+           into the shards of its postcode groups, setting aside the
+           sales with missing postcodes.
+        2. Each shard counts the road name matches of the sales with
+           missing postcodes, which are combined into the modal
+           postcode lookups, so sales with missing postcodes are
+           imputed against the sales of every shard exactly as
+           impute_postcodes would, and added to their shards.
+        3. Each shard is price adjusted against the month range of
+           all of the sales and converted to JSON.
+    The entries of every postcode (and of postcodes without sales)
+    equal those of convert_property_info_to_json over all of the
+    sales.
+
+    Parameters
+    ----------
+    sales_files : list
+        The Land Registry pp files to be preprocessed
+    postcodes : pd.DataFrame
+        Postcode information (containing neighbouring postcodes and
+        centroid coordinates)
+    price_adjustments : pd.DataFrame
+        The output of ingest_price_adjustments
+    work_dir : str
+        Empty directory for the shard files, which must be kept until
+        the returned property information has been consumed
+    n_shards : int
+        The number of partitions of the postcode groups, more shards
+        bound the memory of each worker more tightly
+    n_workers : int
+        The number of worker processes (defaults to one per CPU,
+        capped by the number of shards)
+    imputed_path : str
+        If given, the imputed sales are saved here (grouped by
+        shard), as the history for incremental updates
+
+    Returns
+    -------
+    property_info : Iterator
+        The (postcode, information) pairs of every postcode, in the
+        order of postcodes, read lazily from the shard files (e.g.
+        to be streamed to disk with save_json).
+    state : dict
+        The preprocessing state, see get_preprocessing_state.
+    """
+    if n_workers is None:
+        n_workers = max(1, min(n_shards, os.cpu_count() or 1))
+
+    os.makedirs(os.path.join(work_dir, 'missing'), exist_ok=True)
+    for shard in range(n_shards):
+        os.makedirs(_shard_path(work_dir, shard), exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        month_ranges = list(pool.map(
+            partial(_partition_file, work_dir=work_dir, n_shards=n_shards),
+            sales_files, range(len(sales_files))
+        ))
+
+        no_postcodes = pd.concat([
+            pd.read_pickle(os.path.join(work_dir, 'missing', f'part_{i:05d}.pkl'))
+            for i in range(len(sales_files))
+        ], axis=0)
+
+        # Modal postcodes as build_postcode_lookups would find them
+        # over all of the sales. A postcode only occurs in one shard,
+        # so every count is complete within its shard and the modal
+        # postcode of a key is the best of the shard modes
+        shard_counts = list(pool.map(
+            partial(
+                _count_postcode_matches, work_dir=work_dir,
+                road_names=no_postcodes.road_name.dropna().unique(),
+                regions=no_postcodes.region.unique()
+            ),
+            range(n_shards)
+        ))
+        lookups = {
+            field : select_modal_postcodes(
+                pd.concat([x[field] for x in shard_counts], axis=0), field
+            )
+            for field in POSTCODE_MATCH_FIELDS
+        }
+
+        no_postcodes.loc[:,'postcode'] = impute_postcodes_from_lookups(
+            no_postcodes, lookups
+        )
+        imputed = append_time_information(
+            no_postcodes.loc[no_postcodes.postcode.notna()].copy()
+        )
+        for shard, part in imputed.groupby(shard_of(imputed.postcode_group, n_shards)):
+            part.to_pickle(os.path.join(_shard_path(work_dir, shard), 'imputed.pkl'))
+
+        # The adjustment ratios only depend on the month range
+        month_range = pd.DataFrame({'sold_year_month' : pd.to_datetime(
+            [month for x in month_ranges for month in x] +
+            [imputed.sold_year_month.min(), imputed.sold_year_month.max()]
+        )}).dropna()
+        price_adjs = calculate_adjustment_ratio(price_adjustments, month_range)
+        state = get_preprocessing_state(price_adjs, month_range)
+
+        postcode_shards = shard_of(postcodes.Postcode, n_shards)
+        list(pool.map(
+            partial(
+                _convert_shard, work_dir=work_dir,
+                price_adjustments=price_adjs
+            ),
+            range(n_shards),
+            [postcodes.loc[postcode_shards == shard] for shard in range(n_shards)]
+        ))
+
+    if imputed_path is not None:
+        _merge_history(work_dir, n_shards, imputed_path)
+
+    return _merge_property_info(work_dir, postcode_shards, n_shards), state
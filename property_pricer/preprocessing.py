@@ -1,5 +1,5 @@
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
 
 def get_postcode_candidates(
     entry_w_no_postcode : pd.Series, 
@@ -57,6 +57,99 @@ def get_postcode_candidates(
     return None 
 
 
+# Fields matched on (alongside the road name) when imputing postcodes,
+# in order of preference
+POSTCODE_MATCH_FIELDS = ['town', 'city', 'region']
+
+
+def build_postcode_lookups(entries_w_postcodes : pd.DataFrame) -> dict:
+    """
+    Precomputes the modal postcode of every (road name, town),
+    (road name, city) and (road name, region) combination with one
+    groupby each. Ties are broken as pd.Series.mode does, by taking
+    the first postcode in sorted order.
+    
+    Parameters
+    ----------
+    entries_w_postcodes : pd.DataFrame
+        Historical property information with known postcodes.
+    
+    Returns
+    -------
+    lookups : dict
+        Maps each field in POSTCODE_MATCH_FIELDS to a dataframe of
+        unique (road_name, field) keys and their modal postcode.
+    """
+    lookups = {}
+    for field in POSTCODE_MATCH_FIELDS:
+        counts = (
+            entries_w_postcodes
+            .groupby(['road_name', field, 'postcode'], sort=False)
+            .size()
+            .rename('count')
+            .reset_index()
+        )
+        lookups[field] = select_modal_postcodes(counts, field)
+    
+    return lookups
+
+
+def select_modal_postcodes(
+    counts : pd.DataFrame, field : str, keep_counts : bool = False
+) -> pd.DataFrame:
+    """
+    Picks the most common postcode of every (road_name, field) key
+    from a dataframe of (road_name, field, postcode) counts, breaking
+    ties by taking the first postcode in sorted order (see
+    build_postcode_lookups). With keep_counts the count of each
+    modal postcode is kept too.
+    """
+    return (
+        counts
+        .sort_values(
+            ['road_name', field, 'count', 'postcode'],
+            ascending=[True, True, False, True]
+        )
+        .drop_duplicates(['road_name', field])
+        [['road_name', field, 'postcode'] + (['count'] if keep_counts else [])]
+    )
+
+
+def impute_postcodes_from_lookups(
+    no_postcodes : pd.DataFrame, lookups : dict
+) -> np.ndarray:
+    """
+    Resolves the postcodes of properties with a missing postcode by
+    joining them against the precomputed lookups, falling back from
+    town, to city, to region matches.
+    
+    Parameters
+    ----------
+    no_postcodes : pd.DataFrame
+        Historical property information with missing postcodes.
+    lookups : dict
+        The modal postcode lookups from build_postcode_lookups.
+    
+    Returns
+    -------
+    imputed_postcodes : np.ndarray
+        The best postcode match for each row (or NaN if no match 
+        could be found).
+    """
+    imputed_postcodes = pd.Series(np.nan, index=range(len(no_postcodes)), dtype=object)
+    
+    for field in POSTCODE_MATCH_FIELDS:
+        # Left joins keep the row order of no_postcodes
+        matches = no_postcodes[['road_name', field]].merge(
+            lookups[field], on=['road_name', field], how='left'
+        )
+        imputed_postcodes = imputed_postcodes.fillna(
+            pd.Series(matches.postcode.values, dtype=object)
+        )
+    
+    return imputed_postcodes.values
+
+
 def impute_postcodes(all_sales_history : pd.DataFrame) -> pd.DataFrame:
     """
     imputes missing postcodes where possible by searching,
@@ -65,8 +158,9 @@ def impute_postcodes(all_sales_history : pd.DataFrame) -> pd.DataFrame:
     - Matching road names and cities
     - Matching road names and regions
     
-    This function is very slow and unoptimized, but works
-    as a last resort.
+    The most common postcode for each match is precomputed with a
+    groupby, and the missing rows are resolved with joins, giving
+    the same result as get_postcode_candidates row by row.
     
     Parameters
     ----------
@@ -95,19 +189,10 @@ def impute_postcodes(all_sales_history : pd.DataFrame) -> pd.DataFrame:
     postcode_subset = entries_w_postcodes.loc[
         entries_w_postcodes.region.isin(no_postcodes.region.unique())
     ]
-                                        
-    # Loop through to repair missing postcodes - Note 
-    # iterrows is very slow, but this only needs to be 
-    # done once, and only on the 12k missing postcodes
-    imputed_postcodes = []
-    for row in tqdm(no_postcodes.itertuples()):
-        best_postcode_match = (
-            get_postcode_candidates(row, postcode_subset)
-        )
-
-        imputed_postcodes.append(best_postcode_match)
     
-    no_postcodes.loc[:,'postcode'] = imputed_postcodes
+    no_postcodes.loc[:,'postcode'] = impute_postcodes_from_lookups(
+        no_postcodes, build_postcode_lookups(postcode_subset)
+    )
     
     # Modify argument directly as dataframe will be very large
     all_sales_history = pd.concat([
@@ -164,7 +249,9 @@ def calculate_adjustment_ratio(
     return price_adjustments_w_index
 
 
-def append_time_information(all_info : pd.DataFrame) -> pd.DataFrame:
+def append_time_information(
+    all_info : pd.DataFrame, date_format : str = '%Y-%m-%d %H:%M'
+) -> pd.DataFrame:
     """
     Joins on month, yeay, and year-month information
     to the historical property sales.
@@ -173,6 +260,10 @@ def append_time_information(all_info : pd.DataFrame) -> pd.DataFrame:
     ----------
     all_info : pd.DataFrame
         Contains all of the historical property information.
+    date_format : str
+        The format of the sold_date strings (the Land Registry 
+        format by default), dates in any other format are parsed
+        by inference instead.
         
     Returns
     -------
@@ -180,16 +271,34 @@ def append_time_information(all_info : pd.DataFrame) -> pd.DataFrame:
         Contains all of the historical property information
         with year, month and year month columns joined on.
     """
-    all_info_w_time = all_info.copy()
-    all_info_w_time.loc[:,'postcode_group'] = [
-        x.split(' ')[0] for x in all_info_w_time.postcode
-    ]
-    all_info_w_time.loc[:,'sold_date'] = pd.to_datetime(all_info_w_time.sold_date)
-    all_info_w_time.loc[:,'sold_year'] = all_info_w_time.sold_date.dt.year
-    all_info_w_time.loc[:,'sold_month'] = all_info_w_time.sold_date.dt.month
-    all_info_w_time.loc[:,'sold_year_month'] = pd.to_datetime(
-        all_info_w_time['sold_year'].astype('str') + 
-        '-' + all_info_w_time['sold_month'].astype('str')
+    # Modify argument directly as dataframe will be very large
+    all_info_w_time = all_info
+    
+    # Split each distinct postcode once, then broadcast back to the 
+    # rows (missing postcodes have code -1, picking the trailing NaN)
+    postcode_codes, unique_postcodes = pd.factorize(all_info_w_time.postcode)
+    unique_groups = np.append(
+        np.asarray(
+            pd.Index(unique_postcodes).str.split(' ', n=1).str[0], dtype=object
+        ), 
+        np.nan
+    )
+    all_info_w_time['postcode_group'] = unique_groups[postcode_codes]
+    
+    sold_date = all_info_w_time.sold_date
+    if not pd.api.types.is_datetime64_any_dtype(sold_date):
+        try:
+            sold_date = pd.to_datetime(sold_date, format=date_format)
+        except (ValueError, TypeError):
+            sold_date = pd.to_datetime(sold_date)
+    
+    all_info_w_time['sold_date'] = sold_date
+    all_info_w_time['sold_year'] = sold_date.dt.year
+    all_info_w_time['sold_month'] = sold_date.dt.month
+    
+    # Truncate to the month without a round trip through strings
+    all_info_w_time['sold_year_month'] = (
+        sold_date.values.astype('datetime64[M]').astype('datetime64[ns]')
     )
     
     return all_info_w_time
@@ -0,0 +1,157 @@
+import bisect
+import numpy as np
+from typing import Mapping, Sequence, Tuple
+from property_pricer.instrumentation import count
+from property_pricer.neighbours import NeighbourIndex, get_neighbour_index
+
+_NO_MONTHS_MESSAGE = (
+    'The data does not record sale months, regenerate it with '
+    'clean_preprocess_data.py to use time windows or recency weights'
+)
+
+
+def month_code(month) -> int:
+    """
+    Converts a month ('2021-06', a date, a datetime64 or an existing
+    code) to months since January 1970, the integer code of
+    datetime64[M] that sale months are stored as.
+    """
+    if isinstance(month, (int, np.integer)):
+        return int(month)
+    return int(np.datetime64(month).astype('datetime64[M]').astype(np.int64))
+
+
+def sale_months(data : Mapping, postcode : str, property_type : str) -> Sequence:
+    """
+    Returns the (sorted) sale month of every sample of a postcode.
+    """
+    months = data[postcode][property_type].get('months')
+    if months is None:
+        raise ValueError(_NO_MONTHS_MESSAGE)
+    return months
+
+
+def window_slice(
+    months : Sequence, start_month : int = None, end_month : int = None
+) -> slice:
+    """
+    Finds the samples sold from start_month to end_month (inclusive,
+    either may be None for an open end) by binary search over the
+    sorted sale months.
+    """
+    if isinstance(months, np.ndarray):
+        search = lambda month, side: int(np.searchsorted(months, month, side))
+    else:
+        search = lambda month, side: (
+            bisect.bisect_left if side == 'left' else bisect.bisect_right
+        )(months, month)
+
+    start = 0 if start_month is None else search(start_month, 'left')
+    end = len(months) if end_month is None else search(end_month, 'right')
+    return slice(start, max(start, end))
+
+
+def recency_weights(
+    months : np.ndarray, reference_month : int, half_life : float
+) -> np.ndarray:
+    """
+    Exponentially decaying weights that halve every half_life months
+    before reference_month.
+    """
+    return 0.5 ** ((reference_month - np.asarray(months, dtype=float)) / half_life)
+
+
+def gather_recent_samples(
+    data : Mapping, postcode : str, property_type : str, price_type : str,
+    needed_samples : int, window_months : int = None,
+    recency_half_life : float = None, as_of = None,
+    neighbour_index : NeighbourIndex = None, upsampling : str = 'neighbours'
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pools the samples of a postcode sold within a time window, adding
+    neighbouring postcodes as in upsample_data until needed_samples
+    samples fall inside the window, and weights them by recency. Only
+    the windows of the postcodes the expansion reaches are searched.
+
+    Parameters
+    ----------
+    data : Mapping
+        The property sales data, with sale months
+    postcode : str
+        The postcode whose samples are being gathered
+    property_type : str
+        The property type to be used in the sample collection
+    price_type : str
+        Whether to use 'adjusted' or 'unadjusted' prices
+    needed_samples : int
+        The lower bound on the number of samples needed for statistical
+        significance.
+    window_months : int
+        Only samples sold in this many months up to as_of are used
+        (all earlier samples if None)
+    recency_half_life : float
+        If given, samples are weighted by an exponential decay with
+        this half life in months
+    as_of : str
+        The last month of the window and reference of the weights,
+        e.g. '2021-06' (defaults to the latest sale month of the data)
+    neighbour_index : NeighbourIndex
+        Precomputed neighbour graph of the data.
+    upsampling : str
+        'neighbours' or 'nearest' (see NeighbourIndex.find_neighbourhood)
+
+    Returns
+    -------
+    samples : np.ndarray
+        The pooled samples (or None if no neighbourhood with
+        sufficient data could be found).
+    weights : np.ndarray
+        The recency weight of every sample (or None if unweighted).
+    """
+    if window_months is not None and window_months < 1:
+        raise ValueError(f'window_months must be at least 1, got {window_months}')
+    if recency_half_life is not None and not recency_half_life > 0:
+        raise ValueError(
+            f'recency_half_life must be positive, got {recency_half_life}'
+        )
+
+    if neighbour_index is None:
+        neighbour_index = get_neighbour_index(data)
+
+    end_month = (
+        month_code(as_of) if as_of is not None else neighbour_index.latest_month
+    )
+    if end_month is None:
+        raise ValueError(_NO_MONTHS_MESSAGE)
+    start_month = end_month - window_months + 1 if window_months is not None else None
+
+    def get_window(postcode):
+        months = sale_months(data, postcode, property_type)
+        return months, window_slice(months, start_month, end_month)
+
+    def count_samples(ids):
+        windows = (get_window(neighbour_index.postcodes[x])[1] for x in ids)
+        return np.array([x.stop - x.start for x in windows], dtype=np.int64)
+
+    neighbourhood = neighbour_index.find_neighbourhood(
+        postcode, property_type, price_type, needed_samples, count_samples,
+        upsampling=upsampling
+    )
+    if neighbourhood is None:
+        return None, None
+    count('neighbours_added', len(neighbourhood) - 1)
+
+    samples, months = [], []
+    for neighbour in neighbourhood:
+        neighbour_months, window = get_window(neighbour)
+        samples.append(np.asarray(
+            data[neighbour][property_type][price_type][window], dtype=float
+        ))
+        months.append(np.asarray(neighbour_months[window], dtype=np.int64))
+    samples, months = np.concatenate(samples), np.concatenate(months)
+
+    weights = None
+    if recency_half_life is not None:
+        weights = recency_weights(months, end_month, recency_half_life)
+
+    return samples, weights
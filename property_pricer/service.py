@@ -0,0 +1,386 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from property_pricer.cache import PriceCache, fingerprint_file
+from property_pricer.columnar import convert_to_columnar, load_property_data
+from property_pricer.determine_price import calculate_property_prices
+from property_pricer.instrumentation import TraceRecorder, trace_request
+from property_pricer.neighbours import PROPERTY_TYPES, PRICE_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Property data loaded once per service worker process
+_SERVICE_DATA = None
+
+
+class QueryError(Exception):
+    """
+    A pricing query that cannot be answered, with the HTTP status
+    code to report it with.
+    """
+    def __init__(self, status : int, message : str):
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+
+def _init_service_worker(data_path : str) -> None:
+    global _SERVICE_DATA
+    _SERVICE_DATA = load_property_data(data_path)
+
+
+def _worker_postcode_count() -> int:
+    return len(_SERVICE_DATA)
+
+
+def _price_query(
+    postcode : str, pricing_type : str, property_type : str,
+    confidence : float, pricing_kwargs : dict
+) -> tuple:
+    """
+    Prices a single query in a worker process, returning the result
+    and the trace breakdown of where its time went. Every call seeds
+    its own bootstrap generators, so concurrent queries never share
+    random state, and the data is only ever read.
+    """
+    if postcode not in _SERVICE_DATA:
+        raise QueryError(404, f'Unknown postcode: {postcode}')
+
+    with trace_request(postcode) as trace:
+        result = calculate_property_prices(
+            _SERVICE_DATA, postcode, pricing_type,
+            property_type, confidence, **pricing_kwargs
+        )
+    return result, trace.breakdown()
+
+
+def parse_query(params : dict) -> dict:
+    """
+    Validates the parameters of a pricing query.
+
+    Parameters
+    ----------
+    params : dict
+        The raw postcode, price_type, property_type and confidence
+
+    Returns
+    -------
+    query : dict
+        The validated query.
+
+    Raises
+    ------
+    QueryError
+        If any parameter is missing or invalid.
+    """
+    missing = [
+        x for x in ['postcode', 'price_type', 'property_type', 'confidence']
+        if x not in params
+    ]
+    if missing:
+        raise QueryError(400, f'Missing parameters: {missing}')
+
+    if params['price_type'] not in PRICE_TYPES:
+        raise QueryError(400, f'price_type must be one of {PRICE_TYPES}')
+
+    if params['property_type'] not in PROPERTY_TYPES:
+        raise QueryError(400, f'property_type must be one of {PROPERTY_TYPES}')
+
+    try:
+        confidence = float(params['confidence'])
+    except (TypeError, ValueError):
+        raise QueryError(400, 'confidence must be a number')
+
+    if not 0 < confidence < 1:
+        raise QueryError(400, 'confidence must be between 0 and 1')
+
+    return {
+        'postcode' : str(params['postcode']).strip().upper(),
+        'pricing_type' : params['price_type'],
+        'property_type' : params['property_type'],
+        'confidence' : confidence
+    }
+
+
+class PricingService:
+    """
+    Long-running pricing backend. The data artifact is memory-mapped
+    once in each worker of a process pool (a JSON file is converted
+    to a columnar artifact first) and the CPU-bound KDE work runs
+    there, with a bound on the number of queries in flight. A query
+    holds its slot until its worker is done with it, even after it
+    times out. When the data is regenerated the pool is restarted on
+    the new data, with queries already running finishing on the old.
+
+    Parameters
+    ----------
+    data_path : str
+        Path to the cleaned JSON file or columnar artifact
+    n_workers : int
+        The number of worker processes (defaults to the number of CPUs)
+    max_concurrent : int
+        The maximum number of queries in flight, further queries are
+        rejected rather than queued (defaults to twice the workers).
+    timeout : float
+        Seconds after which a query is abandoned
+    cache : PriceCache
+        Optional cache of previous answers
+    pricing_kwargs : dict
+        Extra keyword arguments for calculate_property_prices
+    """
+    def __init__(
+        self, data_path : str, n_workers : int = None,
+        max_concurrent : int = None, timeout : float = 60.,
+        cache : PriceCache = None, pricing_kwargs : dict = None
+    ):
+        self.source_path = data_path
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.max_concurrent = max_concurrent or 2 * self.n_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.pricing_kwargs = pricing_kwargs or {}
+        self.started = time.time()
+        self.recorder = TraceRecorder()
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._in_flight = 0
+        self._counter_lock = threading.Lock()
+        self._pool = None
+        # Guards swapping the pool against submitting to it, while
+        # reloads are serialised without blocking queries
+        self._pool_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._start_pool()
+
+    def _start_pool(self) -> None:
+        """
+        Starts a worker pool on the current version of the data, and
+        retires the previous pool (if any) once its queries finish.
+        """
+        self.source_fingerprint = fingerprint_file(self.source_path)
+
+        # Workers memory-map a columnar artifact, so share its pages
+        self.data_path = (
+            self.source_path if os.path.isdir(self.source_path)
+            else convert_to_columnar(self.source_path)
+        )
+        pool = ProcessPoolExecutor(
+            max_workers=self.n_workers, initializer=_init_service_worker,
+            initargs=(self.data_path,)
+        )
+
+        # Start every worker (and load its data) before serving
+        warm_up = [
+            pool.submit(_worker_postcode_count) for _ in range(self.n_workers)
+        ]
+        self.n_postcodes = max(x.result() for x in warm_up)
+
+        # Queries submitted before the swap keep running on the old pool
+        with self._pool_lock:
+            previous, self._pool = self._pool, pool
+        if previous is not None:
+            previous.shutdown(wait=False)
+
+    def _reload_if_changed(self) -> None:
+        try:
+            changed = fingerprint_file(self.source_path) != self.source_fingerprint
+        except OSError:
+            # Caught mid rewrite, check again on the next query
+            return
+        if not changed:
+            return
+
+        with self._reload_lock:
+            if fingerprint_file(self.source_path) != self.source_fingerprint:
+                logger.info('%s changed, restarting the workers', self.source_path)
+                self._start_pool()
+
+    def _release(self, future=None) -> None:
+        with self._counter_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def price(self, query : dict) -> dict:
+        """
+        Prices a validated query (see parse_query).
+
+        Raises
+        ------
+        QueryError
+            If the service is saturated (503), the query times out
+            (504), the postcode is unknown (404) or there are too few
+            samples to price it (422).
+        """
+        if self.cache is not None:
+            key = self.cache.make_key(
+                query['postcode'], query['pricing_type'],
+                query['property_type'], query['confidence'],
+                **self.pricing_kwargs
+            )
+            hit, result = self.cache.get(key)
+            if hit:
+                return self._format(result)
+
+        self._reload_if_changed()
+
+        # Shed load instead of queueing without bound
+        if not self._slots.acquire(blocking=False):
+            raise QueryError(503, 'Too many concurrent queries, retry later')
+
+        with self._counter_lock:
+            self._in_flight += 1
+        try:
+            # Never submit to a pool a reload has just shut down
+            with self._pool_lock:
+                future = self._pool.submit(
+                    _price_query, query['postcode'], query['pricing_type'],
+                    query['property_type'], query['confidence'],
+                    self.pricing_kwargs
+                )
+        except Exception:
+            self._release()
+            raise
+
+        # A running query can't be stopped, so its slot is only freed
+        # once its worker is done with it
+        future.add_done_callback(self._release)
+        try:
+            result, breakdown = future.result(timeout=self.timeout)
+            self.recorder.record(breakdown)
+        except TimeoutError:
+            future.cancel()
+            raise QueryError(504, f'Query timed out after {self.timeout}s')
+
+        if self.cache is not None:
+            self.cache.put(key, result)
+
+        return self._format(result)
+
+    @staticmethod
+    def _format(result : tuple) -> dict:
+        if result is None:
+            raise QueryError(
+                422, 'Not enough sales in the postcode or its neighbours'
+            )
+        lower_bound, upper_bound, lower_delta, upper_delta, threshold = result
+        return {
+            'lower_bound' : lower_bound, 'upper_bound' : upper_bound,
+            'lower_bound_uncertainty' : lower_delta,
+            'upper_bound_uncertainty' : upper_delta,
+            'threshold' : threshold
+        }
+
+    def health(self) -> dict:
+        with self._counter_lock:
+            in_flight = self._in_flight
+        health = {
+            'status' : 'ok', 'uptime_seconds' : time.time() - self.started,
+            'postcodes' : self.n_postcodes, 'workers' : self.n_workers,
+            'in_flight' : in_flight, 'max_concurrent' : self.max_concurrent
+        }
+        if self.cache is not None:
+            health['cache'] = self.cache.stats()
+        return health
+
+    def metrics(self) -> dict:
+        """
+        Returns the aggregate histograms of where the time of every
+        computed (uncached) query went.
+        """
+        return self.recorder.histograms()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class PricingRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves GET /health, GET /metrics, and pricing queries as GET /price?postcode=
+    ...&price_type=...&property_type=...&confidence=... or as a POST
+    to /price with the same fields in a JSON body.
+    """
+    service = None
+
+    def _send_json(self, status : int, body : dict, headers : dict = None) -> None:
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle_price(self, params : dict) -> None:
+        try:
+            self._send_json(200, self.service.price(parse_query(params)))
+        except QueryError as e:
+            headers = {'Retry-After' : '1'} if e.status == 503 else None
+            self._send_json(e.status, {'error' : e.message}, headers)
+        except Exception as e:
+            self._send_json(500, {'error' : repr(e)})
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self._send_json(200, self.service.health())
+        elif url.path == '/metrics':
+            self._send_json(200, self.service.metrics())
+        elif url.path == '/price':
+            params = {k : v[0] for k, v in parse_qs(url.query).items()}
+            self._handle_price(params)
+        else:
+            self._send_json(404, {'error' : f'Unknown path: {url.path}'})
+
+    def do_POST(self) -> None:
+        if urlparse(self.path).path != '/price':
+            self._send_json(404, {'error' : f'Unknown path: {self.path}'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length) or b'{}')
+        except (ValueError, json.JSONDecodeError):
+            self._send_json(400, {'error' : 'Body must be a JSON object'})
+            return
+
+        if not isinstance(params, dict):
+            self._send_json(400, {'error' : 'Body must be a JSON object'})
+            return
+
+        self._handle_price(params)
+
+    def log_message(self, format, *args) -> None:
+        # Keep request logs terse: one line per request
+        logger.info('%s %s', self.address_string(), format % args)
+
+
+def serve(
+    service : PricingService, host : str = '127.0.0.1', port : int = 8080
+) -> None:
+    """
+    Serves pricing queries over HTTP until interrupted. Requests are
+    handled on threads, which hand the KDE work to the service's
+    process pool.
+    """
+    handler = type(
+        'BoundPricingRequestHandler', (PricingRequestHandler,),
+        {'service' : service}
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    logger.info(
+        'Serving %d postcodes on http://%s:%d', service.n_postcodes, host, port
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
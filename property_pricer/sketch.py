@@ -0,0 +1,222 @@
+import json
+import os
+import numpy as np
+from typing import Iterable, Tuple
+from property_pricer.cache import data_fingerprints, fingerprint_file
+from property_pricer.neighbours import PROPERTY_TYPES, PRICE_TYPES
+
+
+class TDigest:
+    """
+    Mergeable t-digest quantile sketch. Prices are summarised by at
+    most ~compression/2 weighted centroids, sized by the arcsine
+    scale function so centroids are small (and quantiles accurate)
+    in the tails, where the confidence bounds are read off.
+
+    Parameters
+    ----------
+    means : np.ndarray
+        The sorted centroid means
+    weights : np.ndarray
+        The number of prices summarised by each centroid
+    minimum, maximum : float
+        The exact extremes of the summarised prices
+    compression : float
+        The accuracy parameter, larger keeps more centroids
+    """
+    def __init__(
+        self, means : np.ndarray, weights : np.ndarray,
+        minimum : float, maximum : float, compression : float = 200.
+    ):
+        self.means = np.asarray(means, dtype=float)
+        self.weights = np.asarray(weights, dtype=float)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.compression = compression
+
+    @classmethod
+    def from_values(cls, values : np.ndarray, compression : float = 200.) -> 'TDigest':
+        """
+        Builds the sketch of an array of prices.
+        """
+        values = np.sort(np.asarray(values, dtype=float))
+        means, weights = cls._compress(values, np.ones(len(values)), compression)
+        return cls(means, weights, values[0], values[-1], compression)
+
+    @staticmethod
+    def _compress(
+        means : np.ndarray, weights : np.ndarray, compression : float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Merges sorted centroids so none spans more than one unit of
+        the scale function k(q) = compression / (2 pi) arcsin(2q - 1),
+        in one vectorised pass.
+        """
+        cumulative = np.cumsum(weights)
+        q_left = (cumulative - weights) / cumulative[-1]
+        k = compression / (2 * np.pi) * np.arcsin(2 * q_left - 1)
+        bins = np.floor(k)
+
+        starts = np.flatnonzero(np.concatenate([[True], bins[1:] != bins[:-1]]))
+        merged_weights = np.add.reduceat(weights, starts)
+        merged_means = np.add.reduceat(means * weights, starts) / merged_weights
+        return merged_means, merged_weights
+
+    @classmethod
+    def merge(cls, digests : Iterable['TDigest']) -> 'TDigest':
+        """
+        Merges several sketches into the sketch of their pooled prices
+        (None if they are all empty).
+        """
+        digests = [x for x in digests if x is not None and len(x.means)]
+        if len(digests) == 0:
+            return None
+        if len(digests) == 1:
+            return digests[0]
+
+        means = np.concatenate([x.means for x in digests])
+        weights = np.concatenate([x.weights for x in digests])
+        order = np.argsort(means, kind='stable')
+        compression = max(x.compression for x in digests)
+        means, weights = cls._compress(means[order], weights[order], compression)
+
+        return cls(
+            means, weights, min(x.minimum for x in digests),
+            max(x.maximum for x in digests), compression
+        )
+
+    @property
+    def count(self) -> int:
+        return int(round(self.weights.sum()))
+
+    def quantile(self, probabilities : np.ndarray) -> np.ndarray:
+        """
+        Estimates the prices at the given probabilities, interpolating
+        between the centroids (each placed at the middle of its rank
+        range) and the exact extremes.
+        """
+        cumulative = np.cumsum(self.weights)
+        ranks = np.concatenate([[0], cumulative - self.weights / 2, [cumulative[-1]]])
+        values = np.concatenate([[self.minimum], self.means, [self.maximum]])
+        return np.interp(np.asarray(probabilities) * cumulative[-1], ranks, values)
+
+
+def sketch_price_range(digest : TDigest, threshold : float) -> tuple:
+    """
+    Reads a two sided price range off a sketch. The uncertainty of
+    each bound is half the price spread of one standard error of the
+    empirical quantile's rank, sqrt(q (1 - q) / n), either side of it.
+
+    Parameters
+    ----------
+    digest : TDigest
+        The sketch of the (pooled) prices
+    threshold : float
+        two sided confidence interval threshold
+
+    Returns
+    -------
+    price_range : tuple
+        The (lower bound, upper bound, lower bound uncertainty, upper
+        bound uncertainty, threshold), as from calculate_property_prices.
+    """
+    standard_error = np.sqrt(threshold * (1 - threshold) / digest.count)
+    probabilities = np.array([threshold, 1 - threshold])
+    bounds = digest.quantile(probabilities)
+    spread = (
+        digest.quantile(np.clip(probabilities + standard_error, 0, 1)) -
+        digest.quantile(np.clip(probabilities - standard_error, 0, 1))
+    ) / 2
+
+    return (
+        int(bounds[0]), int(bounds[1]),
+        int(spread[0]), int(spread[1]), threshold
+    )
+
+
+def build_sketches(postcode_info : dict, compression : float = 200.) -> dict:
+    """
+    Builds the sketch of every non-empty (postcode, property type,
+    price type) cell of the output of convert_property_info_to_json
+    (or a columnar artifact).
+
+    Returns
+    -------
+    sketches : dict
+        TDigests keyed by (postcode, property type, price type).
+    """
+    sketches = {}
+    for postcode in postcode_info:
+        entry = postcode_info[postcode]
+        for property_type in PROPERTY_TYPES:
+            for price_type in PRICE_TYPES:
+                prices = entry[property_type][price_type]
+                if len(prices):
+                    sketches[(postcode, property_type, price_type)] = (
+                        TDigest.from_values(prices, compression)
+                    )
+
+    return sketches
+
+
+def save_sketches(filepath : str, sketches : dict, data_paths : list = None) -> None:
+    """
+    Saves sketches as flat centroid arrays with per-cell offsets in
+    a single .npz file, with the fingerprints of the data files they
+    were built from (data_paths) so stale sketches can be detected.
+    """
+    fingerprints = [fingerprint_file(x) for x in data_paths or []]
+    keys = list(sketches)
+    lengths = [len(sketches[x].means) for x in keys]
+    np.savez(
+        filepath,
+        keys=np.array(json.dumps(keys)),
+        offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        means=np.concatenate([sketches[x].means for x in keys] or [[]]),
+        weights=np.concatenate([sketches[x].weights for x in keys] or [[]]),
+        extremes=np.array([[sketches[x].minimum, sketches[x].maximum] for x in keys]),
+        compression=np.array([sketches[x].compression for x in keys]),
+        fingerprints=np.array(json.dumps(fingerprints))
+    )
+
+
+def load_sketches(filepath : str, data_path : str = None) -> dict:
+    """
+    Loads the sketches saved by save_sketches.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the sketches .npz file
+    data_path : str
+        If given, the sketches are only returned if they were built
+        from the current version of this data file.
+
+    Returns
+    -------
+    sketches : dict
+        TDigests keyed by (postcode, property type, price type) (or
+        None if they are missing or stale).
+    """
+    if not os.path.exists(filepath):
+        return None
+
+    with np.load(filepath) as f:
+        # Sketches saved without fingerprints can't be checked
+        fingerprints = set(
+            json.loads(str(f['fingerprints'])) if 'fingerprints' in f else []
+        )
+        if data_path is not None and not fingerprints & data_fingerprints(data_path):
+            return None
+
+        keys = [tuple(x) for x in json.loads(str(f['keys']))]
+        offsets, means, weights = f['offsets'], f['means'], f['weights']
+        extremes, compression = f['extremes'], f['compression']
+
+    return {
+        key : TDigest(
+            means[offsets[i]:offsets[i + 1]], weights[offsets[i]:offsets[i + 1]],
+            extremes[i, 0], extremes[i, 1], compression[i]
+        )
+        for i, key in enumerate(keys)
+    }
@@ -1,5 +1,71 @@
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
+from typing import Iterator, Tuple
+from property_pricer.neighbours import PROPERTY_TYPES
+
+
+def get_sale_months(sales : pd.DataFrame) -> np.ndarray:
+    """
+    Returns the sale month of every sale as months since January
+    1970 (the integer code of datetime64[M]).
+    """
+    return (
+        np.asarray(sales.sold_year_month.values, dtype='datetime64[M]')
+        .astype(np.int64)
+    )
+
+
+def group_property_sales(
+    all_info_adjusted : pd.DataFrame
+) -> Tuple[pd.DataFrame, dict]:
+    """
+    Sorts the property sales once by (postcode group, property type),
+    so the sales of every combination form one contiguous slice. Each
+    slice is sorted by sale date (ties keep their original order), so
+    time windows can be found by binary search.
+    
+    Parameters
+    ----------
+    all_info_adjusted : pd.DataFrame
+        Contains all historical property information
+        with an adjusted price to account for historical
+        national market fluctuations.
+    
+    Returns
+    -------
+    sales : pd.DataFrame
+        The sales of the known property types, sorted.
+    cells : dict
+        Maps each (postcode group, property type) to the (start, end)
+        positions of its slice of sales.
+    """
+    sales = all_info_adjusted.loc[
+        all_info_adjusted.property_type.isin(PROPERTY_TYPES) &
+        all_info_adjusted.postcode_group.notna()
+    ]
+    sales = sales.iloc[
+        np.lexsort((
+            sales.sold_date.values, sales.property_type.values, 
+            sales.postcode_group.values
+        ))
+    ]
+    
+    postcode_groups = sales.postcode_group.values
+    property_types = sales.property_type.values
+    boundaries = np.flatnonzero(
+        (postcode_groups[1:] != postcode_groups[:-1]) |
+        (property_types[1:] != property_types[:-1])
+    ) + 1
+    starts = np.concatenate([[0], boundaries]).astype(int)
+    ends = np.concatenate([boundaries, [len(sales)]]).astype(int)
+    
+    cells = {
+        (postcode_groups[start], property_types[start]) : (start, end)
+        for start, end in zip(starts, ends) if start < end
+    }
+    
+    return sales, cells
+
 
 def convert_property_info_to_json(
     postcodes : pd.DataFrame, all_info_adjusted : pd.DataFrame
@@ -14,12 +80,15 @@ def convert_property_info_to_json(
             - Terraced House Sales [Adjusted, Unadjusted]
             - Flat Sales [Adjusted, Unadjusted]
             - Other Sales [Adjusted, Unadjusted]
+            - (with the sale month of each sale of every type)
             - Neighbour Postcodes
+            - Centroid [Latitude, Longitude] (None if unknown)
     
     Parameters
     ----------
     postcodes : pd.DataFrame
-        Postcode information (containing neighbouring postcodes)
+        Postcode information (containing neighbouring postcodes and
+        centroid coordinates)
     all_info_adjusted : pd.DataFrame
         Contains all historical property information
         with an adjusted price to account for historical
@@ -30,50 +99,65 @@ def convert_property_info_to_json(
     postcode_info : dict
         The postcode information structured in JSON format (as
         outlined above).
+    
+    The sales are grouped in a single sort (see group_property_sales),
+    so this scales linearly with the number of sales.
+    """
+    return dict(iter_property_info(postcodes, all_info_adjusted))
+
+
+def iter_property_info(
+    postcodes : pd.DataFrame, all_info_adjusted : pd.DataFrame
+) -> Iterator[Tuple[str, dict]]:
+    """
+    Yields the (postcode, information) pairs of
+    convert_property_info_to_json one postcode at a time, so they can
+    be streamed to disk (see save_json) without building the dict.
     """
-    postcode_info = {}
+    sales, cells = group_property_sales(all_info_adjusted)
+    adjusted_prices = sales.adjusted_sold_price.values
+    unadjusted_prices = sales.sold_price.values
+    sale_months = get_sale_months(sales)
     
-    for tup in tqdm(postcodes[['Postcode','Nearby districts']].itertuples()):
+    # Number of properties sold in each postcode (of any type)
+    n_sales = all_info_adjusted.postcode_group.value_counts()
+    
+    for tup in postcodes[
+        ['Postcode','Nearby districts','Latitude','Longitude']
+    ].itertuples():
         
         # Set postcode as key
-        postcode_info[tup.Postcode] = {}
-        
-        # Find all property sales in the postcode
-        properties = all_info_adjusted.loc[
-            all_info_adjusted.postcode_group == tup.Postcode
-        ]
+        entry = {}
         
         # Store number of properties sold in the postcode
-        postcode_info[tup.Postcode]['n'] = len(properties)
+        entry['n'] = int(n_sales.get(tup.Postcode, 0))
 
-
-        for prop_type in {'D','S','T','F','O'}:
+        for prop_type in PROPERTY_TYPES:
             
             # Store vector of historical property sales, adjusted
-            # and not, for each of the property types
-            postcode_info[tup.Postcode][prop_type] = {}
-            postcode_info[tup.Postcode][prop_type]['adjusted'] = (
-                list(
-                    properties
-                    .loc[properties.property_type == prop_type]
-                    .adjusted_sold_price.values
-                )
-            )
-            postcode_info[tup.Postcode][prop_type]['unadjusted'] = (
-                list(
-                    properties
-                    .loc[properties.property_type == prop_type]
-                    .sold_price.values
-                )
-            )
+            # and not, for each of the property types (postcodes
+            # without sales get empty vectors), and their months so
+            # the columnar artifact can store sold prices only
+            start, end = cells.get((tup.Postcode, prop_type), (0, 0))
+            entry[prop_type] = {
+                'adjusted' : adjusted_prices[start:end].tolist(),
+                'unadjusted' : unadjusted_prices[start:end].tolist(),
+                'months' : sale_months[start:end].tolist()
+            }
         
-        # Store the neighbouring postcodes (or an empty list
+        # Store the neighbouring postcodes (or an empty set
         # if there aren't any)
         if type(tup._2) != str:
-            postcode_info[tup.Postcode]['Neighbours'] = {}
+            entry['Neighbours'] = set()
 
         else:
-            postcode_info[tup.Postcode]['Neighbours'] = {
+            entry['Neighbours'] = {
                     x.replace(' ','') for x in tup._2.split(',')
                 }
-    return postcode_info
\ No newline at end of file
+
+        # Store the centroid, used to upsample by distance
+        entry['Centroid'] = (
+            [float(tup.Latitude), float(tup.Longitude)]
+            if pd.notna(tup.Latitude) and pd.notna(tup.Longitude) else None
+        )
+        yield tup.Postcode, entry
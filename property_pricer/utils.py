@@ -1,5 +1,12 @@
+import gzip
+import io
 import json
 import numpy as np
+from collections.abc import Mapping
+from typing import Iterable, Iterator, Tuple, Union
+
+# Compression implied by the file extension
+JSON_COMPRESSION_SUFFIXES = {'.gz' : 'gzip', '.zst' : 'zstd'}
 
 class CustomEncoder(json.JSONEncoder):
     """
@@ -17,21 +24,148 @@ class CustomEncoder(json.JSONEncoder):
             return obj.tolist()
         return json.JSONEncoder.default(self, obj)
 
-def save_json(filepath : str, json_data : dict)-> None:
+
+def strip_compression_suffix(filepath : str) -> str:
+    """
+    Returns filepath without a compression extension (if any).
+    """
+    for suffix in JSON_COMPRESSION_SUFFIXES:
+        if filepath.endswith(suffix):
+            return filepath[:-len(suffix)]
+    return filepath
+
+
+def open_text(filepath : str, mode : str = 'r', compression : str = None):
+    """
+    Opens a UTF-8 text file for reading ('r') or writing ('w'),
+    through gzip or zstd if compression is given or implied by the
+    extension (.gz, .zst). zstd needs the optional zstandard package.
+    """
+    if compression is None:
+        compression = next((
+            name for suffix, name in JSON_COMPRESSION_SUFFIXES.items()
+            if filepath.endswith(suffix)
+        ), None)
+
+    if compression is None:
+        return open(filepath, mode, encoding='utf-8', buffering=2**20)
+
+    if compression == 'gzip':
+        # The fastest level, price digits compress about as well at
+        # any level
+        return gzip.open(filepath, mode + 't', encoding='utf-8', compresslevel=1)
+
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError(
+                'zstd compression needs the zstandard package '
+                '(pip install zstandard)'
+            ) from e
+
+        raw = open(filepath, mode + 'b')
+        stream = (
+            zstandard.ZstdCompressor(level=3).stream_writer(raw) if mode == 'w'
+            else zstandard.ZstdDecompressor().stream_reader(raw)
+        )
+        return io.TextIOWrapper(stream, encoding='utf-8')
+
+    raise ValueError(f'Unknown compression {compression}')
+
+
+def _to_json_types(value):
+    """
+    Converts NumPy arrays (in bulk) and scalars and sets to the
+    builtin types the C JSON encoder handles, so no per-element
+    Python callbacks run while encoding.
     """
-    Saves json data to a relative filepath
-    
+    if isinstance(value, dict):
+        return {key : _to_json_types(x) for key, x in value.items()}
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def save_json(
+    filepath : str, json_data : Union[Mapping, Iterable[Tuple[str, object]]],
+    indent : int = None, compression : str = None
+)-> None:
+    """
+    Saves json data to a relative filepath, streaming one top level
+    entry (e.g. postcode) per line so the data never has to be
+    encoded, or even built, in memory all at once.
+
     Parameters
     ----------
     filepath : str
-        Specifies the relative path to save the 
+        Specifies the relative path to save the
         json file
     json_data : dict
-        JSON data to be saved
+        JSON data to be saved, or an iterable of (key, value) pairs
+        (e.g. a generator) producing it
+    indent : int
+        If given, the whole file is pretty printed with this indent
+        instead (much slower, and json_data must be a dict)
+    compression : str
+        'gzip' or 'zstd' (by default implied by the extension)
     """
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(
-            json_data, f, cls=CustomEncoder, 
-            ensure_ascii=False, indent=4
-        )
-    return
\ No newline at end of file
+    if indent is not None:
+        with open_text(filepath, 'w', compression) as f:
+            json.dump(
+                json_data, f, cls=CustomEncoder,
+                ensure_ascii=False, indent=indent
+            )
+        return
+
+    items = json_data.items() if isinstance(json_data, Mapping) else json_data
+    with open_text(filepath, 'w', compression) as f:
+        f.write('{')
+        separator = '\n'
+        for key, value in items:
+            f.write(
+                separator + json.dumps(str(key), ensure_ascii=False) + ':' +
+                json.dumps(
+                    _to_json_types(value), ensure_ascii=False, separators=(',', ':')
+                )
+            )
+            separator = ',\n'
+        f.write('\n}\n')
+    return
+
+
+def iter_json(filepath : str, compression : str = None) -> Iterator[Tuple[str, object]]:
+    """
+    Streams the top level (key, value) pairs of a json file written
+    by save_json, parsing one entry at a time. Files in any other
+    layout (e.g. pretty printed) are parsed whole instead.
+    """
+    with open_text(filepath, 'r', compression) as f:
+        streamed = f.readline().strip() == '{'
+        for i, line in enumerate(f if streamed else []):
+            # Entries start unindented, at the start of their line
+            if i == 0 and not line.startswith(('"', '}')):
+                streamed = False
+                break
+            line = line.rstrip().rstrip(',')
+            if line == '}':
+                return
+            yield from json.loads('{' + line + '}').items()
+
+        if streamed:
+            raise ValueError(f'{filepath} ends before the closing brace')
+
+    # Not one entry per line, so fall back to a full parse
+    with open_text(filepath, 'r', compression) as f:
+        yield from json.load(f).items()
+
+
+def load_json(filepath : str, compression : str = None) -> dict:
+    """
+    Loads a (possibly compressed) json file written by save_json.
+    """
+    return dict(iter_json(filepath, compression))
@@ -0,0 +1,39 @@
+from property_pricer import PriceCache
+from property_pricer.service import PricingService, serve
+import os
+import logging
+import argparse
+
+
+# Prefer the memory-mappable columnar artifact when it has been built
+DATA_PATH = (
+    'data/cleaned_data/clean_property_info' 
+    if os.path.isdir('data/cleaned_data/clean_property_info') 
+    else 'data/cleaned_data/clean_property_info.json'
+)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Serve property price queries over HTTP'
+    )
+    parser.add_argument('--data', type=str, default=DATA_PATH)
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max_concurrent', type=int, default=None)
+    parser.add_argument('--timeout', type=float, default=60.)
+    parser.add_argument('--cache_entries', type=int, default=4096)
+    parser.add_argument('--bandwidth_method', type=str, default='grid_search')
+    
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    service = PricingService(
+        args.data, n_workers=args.workers,
+        max_concurrent=args.max_concurrent, timeout=args.timeout,
+        cache=PriceCache(args.data, max_entries=args.cache_entries),
+        pricing_kwargs={'bandwidth_method' : args.bandwidth_method}
+    )
+    serve(service, host=args.host, port=args.port)
@@ -0,0 +1,37 @@
+import numpy as np
+from property_pricer.determine_price import get_price_ranges
+
+THRESHOLDS = np.array([0.025, 0.05, 0.1])
+
+
+def sold_prices(n_samples : int = 400, seed : int = 0) -> np.ndarray:
+    return np.round(np.random.default_rng(seed).lognormal(12, 0.4, n_samples))
+
+
+def test_vectorised_bootstrap_matches_the_replicas_engine():
+    prices = sold_prices()
+    price_ranges = {
+        engine : get_price_ranges(
+            prices, THRESHOLDS, n_bootstraps=200, bandwidth_method='silverman',
+            random_state=0, bootstrap_engine=engine
+        )
+        for engine in ['replicas', 'vectorised']
+    }
+
+    # The engines draw different resamples, so the mean bounds of the
+    # 200 replicas only agree to within their sampling error
+    for replicas, vectorised in zip(*price_ranges.values()):
+        assert replicas[4] == vectorised[4]
+        np.testing.assert_allclose(replicas[:2], vectorised[:2], rtol=0.02)
+
+
+def test_vectorised_bootstrap_is_reproducible():
+    prices = sold_prices()
+    first, second = [
+        get_price_ranges(
+            prices, THRESHOLDS, bandwidth_method='silverman',
+            random_state=7, bootstrap_engine='vectorised'
+        )
+        for _ in range(2)
+    ]
+    assert first == second
@@ -0,0 +1,57 @@
+import numpy as np
+from property_pricer.model import (
+    get_optimal_kde, get_kde_components, gaussian_mixture_cdf,
+    calculate_critical_values, batch_kde_critical_values
+)
+
+THRESHOLDS = np.array([0.005, 0.025, 0.05, 0.25])
+
+
+def normalised_samples(n_samples : int = 300, seed : int = 0) -> np.ndarray:
+    # Skewed, like sold prices, and min-max normalised
+    prices = np.random.default_rng(seed).lognormal(12, 0.4, n_samples)
+    return (prices - prices.min()) / (prices.max() - prices.min())
+
+
+def test_analytic_quantiles_invert_the_mixture_cdf():
+    kde = get_optimal_kde(normalised_samples(), bandwidth_method='silverman')
+    lower_bounds, upper_bounds, precision = calculate_critical_values(
+        kde, THRESHOLDS, method='analytic'
+    )
+    centres, bandwidth, weights = get_kde_components(kde)
+    cdf, _ = gaussian_mixture_cdf(
+        np.concatenate([lower_bounds, upper_bounds]), centres, bandwidth, weights
+    )
+
+    assert precision < 1e-8
+    np.testing.assert_allclose(
+        cdf, np.concatenate([THRESHOLDS, 1 - THRESHOLDS]), atol=1e-8
+    )
+
+
+def test_analytic_quantiles_match_the_cumulative_method():
+    kde = get_optimal_kde(normalised_samples(), bandwidth_method='silverman')
+    analytic = calculate_critical_values(kde, THRESHOLDS, method='analytic')
+    cumulative = calculate_critical_values(
+        kde, THRESHOLDS, method='cumulative', n_samples=20000
+    )
+
+    # The cumulative method is accurate to about one grid spacing
+    np.testing.assert_allclose(analytic[0], cumulative[0], atol=1e-3)
+    np.testing.assert_allclose(analytic[1], cumulative[1], atol=1e-3)
+
+
+def test_batched_quantiles_match_the_analytic_quantiles_of_each_row():
+    rows = np.stack([normalised_samples(seed=seed) for seed in range(4)])
+    kdes = [get_optimal_kde(row, bandwidth_method='silverman') for row in rows]
+    # One row with a much wider kernel must not degrade the others
+    bandwidths = np.array([kde.bandwidth for kde in kdes[:3]] + [1.5])
+    kdes[3].set_params(bandwidth=1.5).fit(rows[3][:, np.newaxis])
+
+    lower_bounds, upper_bounds = batch_kde_critical_values(
+        rows, bandwidths, THRESHOLDS
+    )
+    for i, kde in enumerate(kdes):
+        expected = calculate_critical_values(kde, THRESHOLDS, method='analytic')
+        np.testing.assert_allclose(lower_bounds[i], expected[0], atol=1e-3)
+        np.testing.assert_allclose(upper_bounds[i], expected[1], atol=1e-3)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from benchmarks.generate_data import generate_dataset
+from property_pricer import (
+    ingest_join_properties, ingest_price_adjustments, impute_postcodes,
+    append_time_information, calculate_adjustment_ratio,
+    apply_sold_price_adjustments, convert_property_info_to_json
+)
+from property_pricer.incremental import get_preprocessing_state
+from property_pricer.pipeline import CONVERSION_COLUMNS, preprocess_sharded
+from property_pricer.utils import _to_json_types
+
+
+def test_sharded_pipeline_matches_the_single_process_pipeline(tmp_path):
+    sales_files = generate_dataset(
+        str(tmp_path / 'raw'), n_rows=5000, n_postcodes=60,
+        missing_postcode_rate=0.05, end_year=2017
+    )
+    postcodes = pd.read_csv(tmp_path / 'raw' / 'Postcode districts.csv')
+    price_adjustments = ingest_price_adjustments(
+        str(tmp_path / 'raw' / 'Average-price-seasonally-adjusted.csv')
+    )
+
+    sales = append_time_information(
+        impute_postcodes(ingest_join_properties(sales_files))
+    )
+    price_adjs = calculate_adjustment_ratio(price_adjustments, sales)
+    expected = convert_property_info_to_json(
+        postcodes, apply_sold_price_adjustments(price_adjs, sales[CONVERSION_COLUMNS])
+    )
+    expected_state = get_preprocessing_state(price_adjs, sales)
+
+    for n_shards in [1, 3]:
+        work_dir = tmp_path / f'work_{n_shards}'
+        imputed_path = str(tmp_path / f'imputed_{n_shards}.csv')
+        property_info, state = preprocess_sharded(
+            sales_files, postcodes, price_adjustments, str(work_dir),
+            n_shards=n_shards, n_workers=2, imputed_path=imputed_path
+        )
+        sharded = dict(property_info)
+
+        assert list(sharded) == list(expected)
+        assert _to_json_types(sharded) == _to_json_types(expected)
+        assert state == expected_state
+
+        history = pd.read_csv(imputed_path, index_col=0)
+        assert len(history) == len(sales)
+        assert np.array_equal(
+            np.sort(history.postcode.astype(str).values),
+            np.sort(sales.postcode.astype(str).values)
+        )